@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CMDB.settings')
 
 application = get_asgi_application()
+
+# Flush the event log buffer and the search index on time and on SIGTERM,
+# they import models so only once the apps are loaded.
+from assets import event_sink  # noqa: E402
+from assets import search_index  # noqa: E402
+
+event_sink.start_worker()
+search_index.indexer.start()
@@ -127,4 +127,123 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
-]
\ No newline at end of file
+]
+
+
+# CMDB asset reporting
+
+# Max number of reports accepted by one POST to /assets/report/batch/
+REPORT_BATCH_MAX = 1000
+# Largest batch body, decompressed, in bytes: a full server report is a few KB, leave 16 KB per report.
+# It replaces DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB) for that endpoint only.
+REPORT_BATCH_MAX_BYTES = REPORT_BATCH_MAX * 16 * 1024
+
+# Minutes a report section stays safe from `python manage.py prune_report_sections` after it was last stored,
+# longer than any report takes between storing its sections and writing its approval zone row.
+REPORT_SECTION_GRACE_MINUTES = 60
+
+# Queue reports in a local spool and answer 202 right away,
+# run `python manage.py drain_report_spool` to write them to the database.
+REPORT_SPOOL_ENABLED = False
+REPORT_SPOOL_PATH = BASE_DIR / 'spool.sqlite3'
+REPORT_SPOOL_WORKERS = 2
+REPORT_SPOOL_BATCH_SIZE = 200
+# Seconds before a claimed but unfinished batch is handed to another worker
+REPORT_SPOOL_VISIBILITY_TIMEOUT = 300
+# Claims of an entry before it moves to the dead letters of the spool (`drain_report_spool --requeue-dead`).
+REPORT_SPOOL_MAX_ATTEMPTS = 5
+
+# Threads running ORM work for the async views under CMDB.asgi
+ASYNC_DB_WORKERS = 4
+
+# Entries kept per in-process lookup cache (SN -> asset, manufacturer name -> id)
+LOOKUP_CACHE_SIZE = 10000
+
+# Bulk approval of new assets: assets written per transaction,
+# and whether the admin action runs the job in a background thread
+# (otherwise run `python manage.py run_approval_jobs`).
+APPROVAL_CHUNK_SIZE = 500
+APPROVAL_JOB_IN_THREAD = True
+
+# EventLog rows are buffered in memory once their transaction commits (dropped if it rolls back) and bulk written
+# when the buffer holds this many events, when the oldest is this many seconds old or when the process exits.
+EVENT_LOG_BUFFER_SIZE = 100
+EVENT_LOG_BUFFER_SECONDS = 2
+
+# EventLog rows older than this many days are moved to gzipped JSONL segments
+# by `python manage.py archive_event_logs`, in chunks of EVENT_LOG_ARCHIVE_CHUNK_SIZE rows.
+EVENT_LOG_RETENTION_DAYS = 90
+EVENT_LOG_ARCHIVE_PATH = BASE_DIR / 'event_archive'
+EVENT_LOG_ARCHIVE_CHUNK_SIZE = 1000
+
+# Asset history keeps a full snapshot every this many versions and deltas in between,
+# so rebuilding a past state reads at most this many rows.
+ASSET_HISTORY_SNAPSHOT_EVERY = 20
+
+# Assets per page of the asset index.
+INDEX_PAGE_SIZE = 100
+
+# Seconds committed asset changes wait before their search index documents are rewritten, in one batch.
+# 0 rewrites them as each transaction commits, on the request that made the change.
+SEARCH_INDEX_DELAY = 2
+
+# Rendered asset index rows and detail pages, see assets.fragment_cache.
+# CMDB_FRAGMENT_CACHE picks the backend: locmem (per process), file (shared by the processes of one host)
+# or db (shared by every host, run `python manage.py createcachetable` first).
+# locmem is for a single process only: asset edits reach the other processes through Asset.m_time, but changes
+# to shared objects (IDCs, business units, ...) and to the index generation don't, those pages stay stale
+# there until FRAGMENT_CACHE_TIMEOUT.
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cmdb-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'fragment_cache',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cmdb_fragment_cache',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': FRAGMENT_CACHE_BACKENDS[os.environ.get('CMDB_FRAGMENT_CACHE', 'locmem')],
+}
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Assets per chunk of the streaming export, each chunk reads its components with one query per table.
+EXPORT_CHUNK_SIZE = 500
+
+# Levels of hosted_on followed by the topology queries, it also ends hosted_on cycles.
+TOPOLOGY_MAX_DEPTH = 16
+
+# Filtered admin changelists count at most this many rows (or up to the page after the one shown) and show "N+",
+# unfiltered lists use a COUNT(*) of the table cached for ADMIN_COUNT_CACHE_SECONDS.
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_COUNT_CACHE_SECONDS = 300
+
+# SQLite profile. CMDB_DB_PROFILE=production is for a server taking concurrent reports:
+# WAL lets readers run while a write is in progress, synchronous=NORMAL skips the fsync of every commit
+# (a power cut can lose the last commits, not corrupt the file), and busy_timeout (ms) waits for the lock
+# instead of failing. The PRAGMAs run on every new connection.
+DB_PROFILE = os.environ.get('CMDB_DB_PROFILE', 'development')
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS if DB_PROFILE == 'production' else {}
+# Run report writes one at a time on a single writer thread per process, see assets/db_writer.py.
+# The queue only orders the writes of its own process: route the report endpoints to one server process
+# (or spool them, REPORT_SPOOL_ENABLED, and run one drain_report_spool) so a deployment has one writer.
+# Writes of other processes still wait on the lock through busy_timeout and the retries below.
+SQLITE_WRITE_QUEUE = DB_PROFILE == 'production'
+# Retries of a report write failing with "database is locked", the first after SQLITE_RETRY_DELAY seconds, then doubling.
+SQLITE_WRITE_RETRIES = 3
+SQLITE_RETRY_DELAY = 0.05
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+汇报接口压测脚本，用于比较 WSGI 和 ASGI 部署的吞吐量。
+
+用法示例（先分别启动两种服务，再在项目根目录下对同一接口压测）：
+    gunicorn CMDB.wsgi -w 4 -b 127.0.0.1:8000
+    uvicorn CMDB.asgi:application --workers 4 --port 8001
+
+    python -m Client.bin.bench_report --port 8000 --url /assets/report/ --concurrency 1000
+    python -m Client.bin.bench_report --port 8001 --url /assets/async/report/ --concurrency 1000
+"""
+import argparse
+import asyncio
+import copy
+import json
+import time
+import urllib.parse
+
+from Client.bin.report_assets import linux_data
+
+
+def build_body(index, known_sns):
+    # 一半的请求更新已有资产，另一半作为新资产进入待审批区
+    data = copy.deepcopy(linux_data)
+    if known_sns and index % 2 == 0:
+        data['sn'] = known_sns[index % len(known_sns)]
+    else:
+        data['sn'] = 'bench-%06d' % index
+    return urllib.parse.urlencode({"asset_data": json.dumps(data)}).encode()
+
+
+async def send(host, port, url, body, timeout):
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        head = ('POST %s HTTP/1.1\r\n'
+                'Host: %s:%s\r\n'
+                'Content-Type: application/x-www-form-urlencoded\r\n'
+                'Content-Length: %s\r\n'
+                'Connection: close\r\n\r\n' % (url, host, port, len(body)))
+        writer.write(head.encode() + body)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return int(status_line.split()[1]), time.perf_counter() - start
+
+
+async def reporter(args, queue, results):
+    while True:
+        try:
+            body = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            results.append(await send(args.host, args.port, args.url, body, args.timeout))
+        except Exception as e:
+            results.append((type(e).__name__, None))
+
+
+async def run(args):
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(build_body(i, args.known_sn))
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*[reporter(args, queue, results) for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[1] for r in results if r[1] is not None)
+    errors = {}
+    for status, _ in results:
+        if status not in (200, 202):
+            errors[status] = errors.get(status, 0) + 1
+    print('请求数: %s  并发: %s  耗时: %.2fs' % (len(results), args.concurrency, elapsed))
+    print('吞吐量: %.1f req/s' % (len(results) / elapsed))
+    if latencies:
+        for p in (50, 90, 99):
+            print('p%s 延迟: %.1f ms' % (p, latencies[min(len(latencies) - 1, len(latencies) * p // 100)] * 1000))
+    print('失败: %s' % (errors or 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CMDB 汇报接口压测')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--url', default='/assets/report/')
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--known-sn', action='append', default=[], help='已审批上线的资产 SN，可指定多次')
+    asyncio.run(run(parser.parse_args()))
@@ -7,6 +7,7 @@ Params = {
     "server": "192.168.0.7",
     "port": 8000,
     'url': '/assets/report/',
+    'delta_url': '/assets/report/delta/',
     'request_timeout': 30,
 }
 
@@ -14,5 +15,8 @@ Params = {
 
 PATH = os.path.join(os.path.dirname(os.getcwd()), 'log', 'cmdb.log')
 
+# 服务器最近一次确认的完整数据和版本号，用于增量汇报
+STATE_PATH = os.path.join(os.path.dirname(os.getcwd()), 'log', 'last_report.json')
+
 
 # 更多配置，请都集中在此文件中
\ No newline at end of file
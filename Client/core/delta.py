@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+"""
+增量汇报：与服务器确认过的上一份完整数据比较，只发送变化的部分。
+"""
+import hashlib
+import json
+
+# 各组件列表中用来识别同一个组件的字段，和服务器端保持一致
+COMPONENT_KEYS = {
+    'ram': ('slot',),
+    'physical_disk_driver': ('sn',),
+    'nic': ('model', 'mac'),
+}
+
+
+def normalize(data):
+    """转换成经过 json 传输后的样子，保证前后两份数据可以直接比较"""
+    return json.loads(json.dumps(data))
+
+
+def report_hash(data):
+    """与服务器端 asset_handler.report_hash 相同的算法，结果作为数据的版本号"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def build_delta(old, new, base_version):
+    """
+    生成增量数据。
+    :param old: 服务器已确认的上一份完整数据
+    :param new: 本次收集的完整数据
+    :param base_version: 上一份数据的版本号
+    :return: 增量数据字典
+    """
+    old, new = normalize(old), normalize(new)
+    delta = {
+        'sn': new['sn'],
+        'base_version': base_version,
+        'version': report_hash(new),
+        'sections': {},
+    }
+    for key in set(old) | set(new):
+        if key not in COMPONENT_KEYS and old.get(key) != new.get(key):
+            delta['sections'][key] = new.get(key)
+
+    for key, key_fields in COMPONENT_KEYS.items():
+        old_items = {tuple(item.get(f) for f in key_fields): item for item in old.get(key) or []}
+        new_items = {tuple(item.get(f) for f in key_fields): item for item in new.get(key) or []}
+        added = [item for k, item in new_items.items() if k not in old_items]
+        modified = [item for k, item in new_items.items() if k in old_items and old_items[k] != item]
+        removed = [{f: item.get(f) for f in key_fields} for k, item in old_items.items() if k not in new_items]
+        if added or modified or removed:
+            delta[key] = {'added': added, 'modified': modified, 'removed': removed}
+    return delta
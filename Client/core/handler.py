@@ -1,12 +1,25 @@
 # -*- coding:utf-8 -*-
 
+import gzip
 import json
+import os
 import time
+import urllib.error
 import urllib.parse
 import urllib.request
+from core import delta
 from core import info_collection
 from conf import settings
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORM = 'application/x-www-form-urlencoded'
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
 
 class ArgvHandler(object):
 
@@ -56,18 +69,29 @@ class ArgvHandler(object):
         # 收集信息
         info = info_collection.InfoCollection()
         asset_data = info.collect()
-        # 将数据打包到一个字典内，并转换为json格式
-        data = {"asset_data": json.dumps(asset_data)}
         # 根据settings中的配置，构造url
         url = "http://%s:%s%s" % (settings.Params['server'], settings.Params['port'], settings.Params['url'])
         print('正在将数据发送至： [%s]  ......' % url)
         try:
-            # 使用Python内置的urllib.request库，发送post请求。
-            # 需要先将数据进行封装，并转换成bytes类型
-            data_encode = urllib.parse.urlencode(data).encode()
-            response = urllib.request.urlopen(url=url, data=data_encode, timeout=settings.Params['request_timeout'])
+            state = load_state()
+            # 服务器支持的数据格式保存在状态文件中，只有第一次汇报或服务器返回 415 时才重新询问
+            formats = state.get('formats') if state else None
+            if not formats or formats.get('url') != url or formats.get('guessed'):
+                formats = negotiate(url)
+            status, message, version = None, None, None
+            # 有服务器确认过的上一份数据时，只发送变化的部分
+            if state and state['data'].get('sn') == asset_data.get('sn') and \
+                    state['data'].get('asset_type') == asset_data.get('asset_type'):
+                delta_url = "http://%s:%s%s" % (settings.Params['server'], settings.Params['port'],
+                                                settings.Params['delta_url'])
+                delta_data = delta.build_delta(state['data'], asset_data, state['version'])
+                status, message, version = post_negotiated(delta_url, delta_data, formats)
+            # 服务器版本不一致（409）或不支持增量汇报时，重新发送完整数据
+            if status not in (200, 202):
+                status, message, version = post_negotiated(url, asset_data, formats)
+            if status in (200, 202) and version:
+                save_state(asset_data, version, formats)
             print("\033[31;1m发送完毕！\033[0m ")
-            message = response.read().decode()
             print("返回结果：%s" % message)
         except Exception as e:
             message = '发送失败' + "   错误原因：  {}".format(e)
@@ -76,4 +100,81 @@ class ArgvHandler(object):
         with open(settings.PATH, 'ab') as f:  # 以byte的方式写入，防止出现编码错误
             log = '发送时间：%s \t 服务器地址：%s \t 返回结果：%s \n' % (time.strftime('%Y-%m-%d %H:%M:%S'), url, message)
             f.write(log.encode())
-            print("日志记录成功！")
\ No newline at end of file
+            print("日志记录成功！")
+
+
+def post_report(url, data, accept_types, accept_encodings):
+    """
+    发送一份数据，返回 (状态码, 返回结果, 服务器确认的版本号)。
+    """
+    data_encode, headers = encode_report(data, accept_types, accept_encodings)
+    request = urllib.request.Request(url=url, data=data_encode, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=settings.Params['request_timeout'])
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode(), None
+    return response.status, response.read().decode(), response.headers.get('X-Report-Version')
+
+
+def post_negotiated(url, data, formats):
+    """
+    按 formats 中的服务器格式发送。服务器返回 415 说明支持的格式变了，重新询问一次后再发送，
+    formats 会更新为新的结果。
+    """
+    status, message, version = post_report(url, data, formats['types'], formats['encodings'])
+    if status == 415:
+        negotiated = negotiate(formats['url'])
+        formats.clear()
+        formats.update(negotiated)
+        status, message, version = post_report(url, data, formats['types'], formats['encodings'])
+    return status, message, version
+
+
+def load_state():
+    if not os.path.exists(settings.STATE_PATH):
+        return None
+    try:
+        with open(settings.STATE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def save_state(data, version, formats):
+    with open(settings.STATE_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'data': data, 'formats': formats}, f)
+
+
+def negotiate(url):
+    """
+    GET 汇报接口，读取服务器声明的 Accept-Post 和 Accept-Encoding，
+    返回 {'url': ..., 'types': [...], 'encodings': [...]}。
+    旧版本服务器没有这两个响应头，此时只能使用表单格式。
+    询问失败时也先用表单格式，并标记为 guessed，下次汇报时重新询问。
+    """
+    try:
+        response = urllib.request.urlopen(url=url, timeout=settings.Params['request_timeout'])
+    except Exception:
+        return {'url': url, 'types': [FORM], 'encodings': [], 'guessed': True}
+    accept_types = [t.strip() for t in (response.headers.get('Accept-Post') or FORM).split(',')]
+    accept_encodings = [e.strip() for e in (response.headers.get('Accept-Encoding') or '').split(',') if e.strip()]
+    return {'url': url, 'types': accept_types, 'encodings': accept_encodings}
+
+
+def encode_report(asset_data, accept_types, accept_encodings):
+    """
+    按服务器支持的格式分别编码，返回体积最小的 (body, headers)。
+    """
+    candidates = []
+    if FORM in accept_types:
+        body = urllib.parse.urlencode({"asset_data": json.dumps(asset_data)}).encode()
+        candidates.append((body, {'Content-Type': FORM}))
+    if JSON in accept_types:
+        body = json.dumps(asset_data, separators=(',', ':')).encode()
+        candidates.append((body, {'Content-Type': JSON}))
+    if MSGPACK in accept_types and msgpack is not None:
+        candidates.append((msgpack.packb(asset_data, use_bin_type=True), {'Content-Type': MSGPACK}))
+    if 'gzip' in accept_encodings:
+        for body, headers in list(candidates):
+            candidates.append((gzip.compress(body), dict(headers, **{'Content-Encoding': 'gzip'})))
+    return min(candidates, key=lambda c: len(c[0]))
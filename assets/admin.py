@@ -1,48 +1,299 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
 from assets import models
 from assets import asset_handler
+from assets import report_payload
+from assets import fragment_cache
+from assets import search_index
+from assets import capacity_rollups
+from assets import ip_index
 
 
 # Register your models here.
 
-class NewAssetAdmin(admin.ModelAdmin):
+class AtLeast(int):
+    """A row count that is only a lower bound, shown as "N+"."""
+
+    def __str__(self):
+        return '%d+' % self
+
+
+def table_count(model):
+    """COUNT(*) of the whole table, cached for ADMIN_COUNT_CACHE_SECONDS."""
+    key = 'admin-count:%s' % model._meta.db_table
+    count = cache.get(key)
+    if count is None:
+        count = model._default_manager.count()
+        cache.set(key, count, getattr(settings, 'ADMIN_COUNT_CACHE_SECONDS', 300))
+    return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Avoids a COUNT(*) over a huge table on every page. An unfiltered list takes a cached count of the table,
+    a filtered list counts ADMIN_COUNT_LIMIT rows, or up to the page after the requested one, and shows "N+"
+    when there are more. Pages past the count are served all the same, the count only sizes the page links.
+    """
+
+    def __init__(self, *args, page_hint=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_hint = page_hint
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            return table_count(queryset.model)
+        limit = max(getattr(settings, 'ADMIN_COUNT_LIMIT', 10000), (self.page_hint + 1) * self.per_page)
+        count = queryset.order_by()[:limit + 1].count()
+        return AtLeast(limit) if count > limit else count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Changelists that stay fast on large tables: estimated counts, relations joined for list_display
+    and search limited to exact matches on indexed fields (`exact_search_fields`), LIKE '%...%' can't use an index.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    exact_search_fields = ()
+    deferred_fields = ()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_hint = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page_hint = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_hint=page_hint)
+
+    def get_search_fields(self, request):
+        return self.search_fields or self.exact_search_fields
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.defer(*self.deferred_fields) if self.deferred_fields else queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if self.search_fields or not term:
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for field in self.exact_search_fields:
+            condition |= Q(**{field: term})
+        return queryset.filter(condition), False
+
+
+class NewAssetAdmin(ScalableAdmin):
     list_display = ['asset_type', 'sn', 'model', 'manufacturer', 'c_time', 'm_time']
-    list_filter = ['asset_type', 'manufacturer', 'c_time']
-    search_fields = ('sn',)
+    # manufacturer is a plain CharField, its filter would scan the table for distinct values.
+    list_filter = ['asset_type', 'c_time']
+    exact_search_fields = ('sn',)
+    readonly_fields = ['report']
+    # The change page loads the payload on demand, lists never touch it.
+    deferred_fields = ('payload',)
 
     actions = ['approve_selected_new_assets']
 
+    def report(self, obj):
+        return json.dumps(report_payload.load(obj), indent=2, ensure_ascii=False)
+    report.short_description = 'Asset Data'
+
     def approve_selected_new_assets(self, request, queryset):
-        selected = request.POST.getlist('_selected_action')
-        success_upline_number = 0
-        for asset_id in selected:
-            obj = asset_handler.ApproveAsset(request, asset_id)
-            ret = obj.asset_upline()
-            if ret:
-                success_upline_number += 1
+        # queryset covers every page when "select all" is used, only ids are loaded here.
+        ids = list(queryset.values_list('id', flat=True))
+        job = models.ApprovalJob.objects.create(user=request.user, new_asset_ids=json.dumps(ids), total=len(ids))
+        asset_handler.start_approval_job(job)
         # 顶部绿色提示信息
-        self.message_user(request, "成功批准  %s  条新资产上线！" % success_upline_number)
+        self.message_user(request, "已提交批准任务 #%s，共 %s 条新资产，进度请查看 Approval Jobs！" % (job.id, len(ids)))
     approve_selected_new_assets.short_description = "批准选择的新资产"
 
 
-class AssetAdmin(admin.ModelAdmin):
-    list_display = ['asset_type', 'sn', 'model', 'manufacturer', 'c_time', 'm_time']
+class ApprovalJobAdmin(ScalableAdmin):
+    list_display = ['id', 'user', 'status', 'total', 'approved', 'failed', 'progress', 'c_time', 'm_time']
+    list_select_related = ['user']
+    list_filter = ['status']
+    exclude = ['new_asset_ids']
+    deferred_fields = ('new_asset_ids',)
+    readonly_fields = ['user', 'status', 'total', 'approved', 'failed', 'memo']
+
+    def has_add_permission(self, request):
+        return False
+
+
+class ComponentAdmin(ScalableAdmin):
+    list_select_related = ['asset']
+    exact_search_fields = ('asset__sn',)
+    raw_id_fields = ['asset']
+
+    # Component deletes send no signals the caches listen to, refresh the asset's cached pages and search document.
+    # Edits bypass UpdateAsset, so the capacity rollups are moved here as well.
+
+    def save_model(self, request, obj, form, change):
+        model = type(obj)
+        old_rows = capacity_rollups.component_rows(model.objects.filter(pk=obj.pk)) if change else []
+        super().save_model(request, obj, form, change)
+        if model in capacity_rollups.SOURCES:
+            capacity_rollups.add_rows(model, old_rows, -1)
+            capacity_rollups.add_rows(model, capacity_rollups.component_rows(model.objects.filter(pk=obj.pk)))
+
+    def delete_model(self, request, obj):
+        model = type(obj)
+        old_rows = capacity_rollups.component_rows(model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        capacity_rollups.add_rows(model, old_rows, -1)
+        fragment_cache.touch(obj.asset_id)
+        search_index.mark(obj.asset_id)
+
+    def delete_queryset(self, request, queryset):
+        asset_ids = set(queryset.values_list('asset_id', flat=True))
+        old_rows = capacity_rollups.component_rows(queryset)
+        super().delete_queryset(request, queryset)
+        capacity_rollups.add_rows(queryset.model, old_rows, -1)
+        fragment_cache.touch(*asset_ids)
+        search_index.mark(*asset_ids)
+
+
+class CPUAdmin(ComponentAdmin):
+    list_display = ['asset', 'cpu_model', 'cpu_count', 'cpu_core_count']
+
+
+class RAMAdmin(ComponentAdmin):
+    list_display = ['asset', 'slot', 'model', 'manufacturer', 'capacity', 'sn']
+
+
+class DiskAdmin(ComponentAdmin):
+    list_display = ['asset', 'slot', 'sn', 'model', 'capacity', 'interface_type']
+    exact_search_fields = ('asset__sn', 'sn')
+
+
+class NICAdmin(ComponentAdmin):
+    list_display = ['asset', 'name', 'model', 'mac', 'ip_address', 'net_mask']
+
+    def get_search_results(self, request, queryset, search_term):
+        # An address or a CIDR is looked up on the indexed ip_key range.
+        try:
+            low, high = ip_index.cidr_range(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(ip_key__gte=low, ip_key__lte=high), False
+
+
+class DeviceAdmin(ScalableAdmin):
+    list_display = ['asset', 'sub_asset_type', 'model']
+    list_select_related = ['asset']
+    list_filter = ['sub_asset_type']
+    exact_search_fields = ('asset__sn',)
+    raw_id_fields = ['asset']
+
+
+class ServerAdmin(DeviceAdmin):
+    list_display = ['asset', 'sub_asset_type', 'model', 'os_type', 'os_release', 'hosted_on']
+    list_select_related = ['asset', 'hosted_on__asset']
+    raw_id_fields = ['asset', 'hosted_on']
+
+
+class AssetAdmin(ScalableAdmin):
+    list_display = ['asset_type', 'sn', 'name', 'server_model', 'manufacturer', 'status', 'idc', 'c_time', 'm_time']
+    list_select_related = ['server', 'manufacturer', 'idc']
+    # Choice fields need no query, FK filters list the small IDC and business unit tables;
+    # the filtered rows are found through asset_type_status_idx and the FK indexes.
+    list_filter = ['asset_type', 'status', 'idc', 'business_unit']
+    exact_search_fields = ('sn',)
+    raw_id_fields = ['admin', 'approved_by', 'contract']
+    deferred_fields = ('memo',)
+
+    def server_model(self, obj):
+        return obj.server.model if hasattr(obj, 'server') else None
+    server_model.short_description = 'Model'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Serials, MACs, IPs and models through the FTS5 index, exact serials without it or for short terms.
+        ranked = search_index.ranked_ids(search_term.strip(), getattr(settings, 'ADMIN_COUNT_LIMIT', 10000))
+        if not ranked:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=[asset_id for asset_id, _ in ranked]), False
+
+
+class EventLogAdmin(ScalableAdmin):
+    list_display = ['name', 'event_type', 'asset', 'new_asset', 'component', 'user', 'date']
+    list_select_related = ['asset', 'new_asset', 'user']
+    # Both are served by eventlog_type_date_idx and the date index.
+    list_filter = ['event_type', 'date']
+    exact_search_fields = ('asset__sn', 'new_asset__sn')
+    raw_id_fields = ['asset', 'new_asset', 'user']
+    deferred_fields = ('detail', 'memo', 'new_asset__payload')
+
+
+class AssetHistoryAdmin(ScalableAdmin):
+    list_display = ['asset', 'version', 'kind', 'time']
+    list_select_related = ['asset']
+    exact_search_fields = ('asset__sn',)
+    raw_id_fields = ['asset']
+    deferred_fields = ('data',)
+
+
+class BusinessUnitAdmin(admin.ModelAdmin):
+    list_display = ['name', 'parent_unit', 'memo']
+    list_select_related = ['parent_unit']
+    search_fields = ('name',)
+
+
+class NamedAdmin(admin.ModelAdmin):
+    # Small lookup tables.
+    list_display = ['name', 'memo']
+    search_fields = ('name',)
+
+
+class ContractAdmin(admin.ModelAdmin):
+    list_display = ['sn', 'name', 'price', 'start_day', 'end_day', 'license_num']
+    search_fields = ('sn', 'name')
+
+
+class SoftwareAdmin(admin.ModelAdmin):
+    list_display = ['sub_asset_type', 'license_num', 'version']
+
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name', 'c_day']
+    search_fields = ('name',)
 
 
 admin.site.register(models.Asset, AssetAdmin)
-admin.site.register(models.Server)
-admin.site.register(models.StorageDevice)
-admin.site.register(models.SecurityDevice)
-admin.site.register(models.BusinessUnit)
-admin.site.register(models.Contract)
-admin.site.register(models.CPU)
-admin.site.register(models.Disk)
-admin.site.register(models.EventLog)
-admin.site.register(models.IDC)
-admin.site.register(models.Manufacturer)
-admin.site.register(models.NetworkDevice)
-admin.site.register(models.NIC)
-admin.site.register(models.RAM)
-admin.site.register(models.Software)
-admin.site.register(models.Tag)
+admin.site.register(models.Server, ServerAdmin)
+admin.site.register(models.StorageDevice, DeviceAdmin)
+admin.site.register(models.SecurityDevice, DeviceAdmin)
+admin.site.register(models.BusinessUnit, BusinessUnitAdmin)
+admin.site.register(models.Contract, ContractAdmin)
+admin.site.register(models.CPU, CPUAdmin)
+admin.site.register(models.Disk, DiskAdmin)
+admin.site.register(models.EventLog, EventLogAdmin)
+admin.site.register(models.IDC, NamedAdmin)
+admin.site.register(models.Manufacturer, NamedAdmin)
+admin.site.register(models.NetworkDevice, DeviceAdmin)
+admin.site.register(models.NIC, NICAdmin)
+admin.site.register(models.RAM, RAMAdmin)
+admin.site.register(models.Software, SoftwareAdmin)
+admin.site.register(models.Tag, TagAdmin)
 admin.site.register(models.NewAssetApprovalZone, NewAssetAdmin)
+admin.site.register(models.ApprovalJob, ApprovalJobAdmin)
+admin.site.register(models.AssetHistory, AssetHistoryAdmin)
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class AssetsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'assets'
+
+    def ready(self):
+        from assets import lookup_cache
+        from assets import event_sink
+        from assets import dashboard_counters
+        from assets import fragment_cache
+        from assets import search_index
+        from assets import capacity_rollups
+        from assets import unit_tree
+        from assets import db_writer
@@ -1,5 +1,22 @@
 import json
+import hashlib
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 from assets import models
+from assets import lookup_cache
+from assets import event_sink
+from assets import asset_history
+from assets import report_payload
+from assets import dashboard_counters
+from assets import search_index
+from assets import capacity_rollups
+from assets import db_writer
+from assets import fragment_cache
 
 
 class NewAsset(object):
@@ -8,37 +25,63 @@ class NewAsset(object):
         self.data = data
 
     def add_to_new_assets_zone(self):
-        defaults = {
-            'data': json.dumps(self.data),
-            'asset_type': self.data.get('asset_type'),
-            'manufacturer': self.data.get('manufacturer'),
-            'model': self.data.get('model'),
-            'ram_size': self.data.get('ram_size'),
-            'cpu_model': self.data.get('cpu_model'),
-            'cpu_count': self.data.get('cpu_count'),
-            'cpu_core_count': self.data.get('cpu_core_count'),
-            'os_distribution': self.data.get('os_distribution'),
-            'os_release': self.data.get('os_release'),
-            'os_type': self.data.get('os_type'),
-        }
+        defaults = self.zone_defaults(self.data, report_payload.dump(self.data))
         models.NewAssetApprovalZone.objects.update_or_create(sn=self.data['sn'], defaults=defaults)
 
         return 'Asset has been added in New Asset Zone！'
 
+    @staticmethod
+    def zone_defaults(data, payload):
+        return {
+            'payload': payload,
+            'asset_type': data.get('asset_type'),
+            'manufacturer': data.get('manufacturer'),
+            'model': data.get('model'),
+            'ram_size': data.get('ram_size'),
+            'cpu_model': data.get('cpu_model'),
+            'cpu_count': data.get('cpu_count'),
+            'cpu_core_count': data.get('cpu_core_count'),
+            'os_distribution': data.get('os_distribution'),
+            'os_release': data.get('os_release'),
+            'os_type': data.get('os_type'),
+        }
+
+
+def report_hash(data):
+    """
+    Canonical hash of a report, key order and whitespace do not matter.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def touch_unchanged(asset_id, sn, last_hash):
+    """
+    Bump last_seen only if the stored report hash still matches, returns True if the asset was touched.
+    """
+    return models.Asset.objects.filter(pk=asset_id, sn=sn, report_hash=last_hash).update(
+        last_seen=timezone.now()) > 0
+
 
 def log(log_type, msg=None, asset=None, new_asset=None, request=None):
+    event = build_event(log_type, msg=msg, asset=asset, new_asset=new_asset,
+                        user=request.user if request is not None else None)
+    event_sink.sink.add(event)
+
+
+def build_event(log_type, msg=None, asset=None, new_asset=None, user=None):
     event = models.EventLog()
     if log_type == "upline":
         event.name = "%s <%s>  : Upline" % (asset.name, asset.sn)
         event.asset = asset
         event.detail = "Asset online success!"
-        event.user = request.user
+        event.user = user
     elif log_type == "approve_failed":
         event.name = "%s <%s> : Approve failed!" % (new_asset.asset_type, new_asset.sn)
         event.new_asset = new_asset
         event.detail = "Approve failed! " \
                        "n%s" % msg
-        event.user = request.user
+        event.user = user
 
     elif log_type == "update":
         event.name = "%s <%s> ：  Data Updated！" % (asset.asset_type, asset.sn)
@@ -49,7 +92,7 @@ def log(log_type, msg=None, asset=None, new_asset=None, request=None):
         event.asset = asset
         event.detail = "Update failed！\n%s" % msg
 
-    event.save()
+    return event
 
 
 class ApproveAsset:
@@ -57,7 +100,10 @@ class ApproveAsset:
     def __init__(self, request, asset_id):
         self.request = request
         self.new_asset = models.NewAssetApprovalZone.objects.get(id=asset_id)
-        self.data = json.loads(self.new_asset.data)
+
+    @cached_property
+    def data(self):
+        return report_payload.load(self.new_asset)
 
     def asset_upline(self):
         func = getattr(self, "_%s_upline" % self.new_asset.asset_type)
@@ -73,6 +119,8 @@ class ApproveAsset:
             self._create_RAM(asset)
             self._create_disk(asset)
             self._create_nic(asset)
+            self._create_capacity(asset)
+            self._create_history(asset)
             self._delete_original_asset()
         except Exception as e:
             asset.delete()
@@ -87,15 +135,17 @@ class ApproveAsset:
     def _create_asset(self):
         asset = models.Asset.objects.create(asset_type=self.new_asset.asset_type,
                                             name="%s: %s" % (self.new_asset.asset_type, self.new_asset.sn),
-                                            sn=self.new_asset.sn, approved_by=self.request.user, )
+                                            sn=self.new_asset.sn, approved_by=self.request.user,
+                                            report_hash=report_hash(self.data), last_seen=timezone.now())
+        # Until _create_capacity, deleting it must not take its components out of the rollups.
+        asset._capacity_counted = False
 
         return asset
 
     def _create_manufacturer(self, asset):
         m = self.new_asset.manufacturer
         if m:
-            manufacturer_obj, _ = models.Manufacturer.objects.get_or_create(name=m)
-            asset.manufacturer = manufacturer_obj
+            asset.manufacturer_id = lookup_cache.manufacturer_id(m)
             asset.save()
 
     def _create_server(self, asset):
@@ -172,6 +222,15 @@ class ApproveAsset:
                     nic.net_mask = nic_dict.get('net_mask')[0]
             nic.save()
 
+    def _create_capacity(self, asset):
+        capacity_rollups.add_many(capacity_rollups.component_sums(asset_id=asset.pk))
+        asset._capacity_counted = True
+
+    def _create_history(self, asset):
+        asset.history_version = 1
+        asset.save(update_fields=['history_version'])
+        asset_history.build_entry(asset, 'snapshot', asset_history.snapshot(asset)).save()
+
     def _delete_original_asset(self):
 
         self.new_asset.delete()
@@ -183,25 +242,47 @@ class UpdateAsset:
         self.request = request
         self.asset = asset
         self.report_data = report_data
-        self.asset_update()
+        self.report_hash = report_hash(report_data)
+        self.unchanged = False
+        self.component_changes = dict()
+        self.capacity_delta = Counter()
+        self.versioned = False
+        self.result = self.asset_update()
 
     def asset_update(self):
+        if self.asset.report_hash == self.report_hash and \
+                touch_unchanged(self.asset.pk, self.asset.sn, self.report_hash):
+            # Same report as last time, only remember that the asset is still alive.
+            self.unchanged = True
+            return True
         func = getattr(self, "_%s_update" % self.report_data['asset_type'])
         ret = func()
         return ret
 
     def _server_update(self):
         try:
-            self._update_manufacturer()
-            self._update_server()
-            self._update_CPU()
-            self._update_RAM()
-            self._update_disk()
-            self._update_nic()
-            self.asset.save()
+            # Ends with _save_asset(), whose m_time is what other processes key their fragments on.
+            with transaction.atomic(), fragment_cache.asset_saved_after():
+                old_fields = asset_history.field_state(self.asset)
+                self._update_manufacturer()
+                self._update_server()
+                self._update_CPU()
+                self._update_RAM()
+                self._update_disk()
+                self._update_nic()
+                self._record_change(old_fields)
+                capacity_rollups.add(capacity_rollups.group_of(self.asset), self.capacity_delta)
+                self.asset.report_hash = self.report_hash
+                self.asset.last_seen = timezone.now()
+                self._save_asset()
 
         except Exception as e:
-            log('update_failed, msg=e, asset=self.asset, request=self.request')
+            # A cached id may point at a row another process deleted.
+            lookup_cache.clear()
+            if db_writer.is_lock_error(e):
+                # Not the report's fault: db_writer.write() runs it again once the lock is released.
+                raise
+            log('update_failed', msg=e, asset=self.asset, request=self.request)
             print(e)
             return False
         else:
@@ -212,11 +293,9 @@ class UpdateAsset:
     def _update_manufacturer(self):
         m = self.report_data.get('manufacturer')
         if m:
-            manufacturer_obj, _ = models.Manufacturer.objects.get_or_create(name=m)
-            self.asset.manufacturer = manufacturer_obj
+            self.asset.manufacturer_id = lookup_cache.manufacturer_id(m)
         else:
             self.asset.manufacturer = None
-        self.asset.manufacturer.save()
 
     def _update_server(self):
         self.asset.server.model = self.report_data.get('model')
@@ -226,103 +305,636 @@ class UpdateAsset:
         self.asset.server.save()
 
     def _update_CPU(self):
+        old_cores = self.asset.cpu.cpu_core_count
         self.asset.cpu.cpu_model = self.report_data.get('cpu_model')
         self.asset.cpu.cpu_count = self.report_data.get('cpu_count')
         self.asset.cpu.cpu_core_count = self.report_data.get('cpu_core_count')
         self.asset.cpu.save()
+        self._count_cores(old_cores)
 
     def _update_RAM(self):
-        old_rams = models.RAM.objects.filter(asset=self.asset)
-        old_rams_dict = dict()
-        if old_rams:
-            for ram in old_rams:
-                old_rams_dict[ram.slot] = ram
-
-        new_rams_list = self.report_data['ram']
-        new_rams_dict = dict()
-        if new_rams_list:
-            for item in new_rams_list:
-                new_rams_dict[item['slot']] = item
-
-        need_deleted_keys = set(old_rams_dict.keys()) - set(new_rams_dict.keys())
-        if need_deleted_keys:
-            for key in need_deleted_keys:
-                old_rams_dict[key].delete()
-
-        if new_rams_dict:
-            for key in new_rams_dict:
-                defaults = {
-                    'sn': new_rams_dict[key].get('sn'),
-                    'model': new_rams_dict[key].get('model'),
-                    'manufacturer': new_rams_dict[key].get('manufacturer'),
-                    'capacity': new_rams_dict[key].get('capacity', 0),
-                }
-                models.RAM.objects.update_or_create(asset=self.asset, slot=key, defaults=defaults)
+        self._sync_components(models.RAM, ('slot',), [ram_values(item) for item in self.report_data['ram'] or []])
 
     def _update_disk(self):
-
-        old_disk = models.Disk.objects.filter(asset=self.asset)
-        old_disk_dict = dict()
-        if old_disk:
-            for disk in old_disk:
-                old_disk_dict[disk.sn] = disk
-
-        new_disk_list = self.report_data['physical_disk_driver']
-        new_disk_dict = dict()
-        if new_disk_list:
-            for item in new_disk_list:
-                new_disk_dict[item['sn']] = item
-
-        need_deleted_keys = set(old_disk_dict.keys()) - set(new_disk_dict.keys())
-        if need_deleted_keys:
-            for key in need_deleted_keys:
-                old_disk_dict[key].delete()
-
-        if new_disk_dict:
-            for key in new_disk_dict:
-                interface_type = new_disk_dict[key].get('interface_type', 'unknown')
-                if interface_type not in ['SATA', 'SAS', 'SCSI', 'SSD', 'unknown']:
-                    interface_type = 'unknown'
-                defaults = {
-                    'slot': new_disk_dict[key].get('slot'),
-                    'model': new_disk_dict[key].get('model'),
-                    'manufacturer': new_disk_dict[key].get('manufacturer'),
-                    'capacity': new_disk_dict[key].get('capacity'),
-                    'interface_type': interface_type,
-                }
-                models.Disk.objects.update_or_create(asset=self.asset, sn=key, defaults=defaults)
+        self._sync_components(models.Disk, ('sn',),
+                              [disk_values(item) for item in self.report_data['physical_disk_driver'] or []])
 
     def _update_nic(self):
+        self._sync_components(models.NIC, ('model', 'mac'), [nic_values(item) for item in self.report_data['nic'] or []])
+
+    def _count_cores(self, old_cores):
+        field = models.CPU._meta.get_field('cpu_core_count')
+        self.capacity_delta['cores'] += (field.to_python(self.asset.cpu.cpu_core_count) or 0) - \
+            (field.to_python(old_cores) or 0)
+
+    def _record_change(self, old_fields):
+        delta = asset_history.change(self.asset, old_fields, self.component_changes)
+        if delta is not None:
+            self.asset.history_version = asset_history.next_versions([self.asset.pk])[self.asset.pk]
+            asset_history.build_change(self.asset, delta).save()
+            self.versioned = True
+
+    def _save_asset(self):
+        # Only what a report changes: a stale copy of the asset must not move history_version back
+        # or undo admin edits made since it was loaded.
+        fields = ['manufacturer', 'report_hash', 'last_seen', 'm_time']
+        if self.versioned:
+            fields.append('history_version')
+        self.asset.save(update_fields=fields)
+
+    def _sync_components(self, model, key_fields, new_items, removed=None):
+        """
+        Diff the reported components against the stored rows of one table in a single pass:
+        one SELECT, then at most one bulk delete, one bulk_create and one bulk_update of the changed fields.
+        With removed (a list of key dicts) new_items is a patch: only the listed rows are deleted.
+        """
+        plan = ComponentPlan(self.asset, model, key_fields, model.objects.filter(asset=self.asset), new_items, removed)
+        self.component_changes[model._meta.model_name] = plan.history
+        self.capacity_delta.update(plan.capacity)
+        plan.write()
+
+
+class ComponentPlan:
+    """
+    The writes that bring the stored components of one asset and one table in line with a report,
+    computed without touching the database. Plans of many assets can be written together with merge().
+    """
+
+    def __init__(self, asset, model, key_fields, old_objs, new_items, removed=None):
+        self.model = model
+        old_items = dict()
+        for obj in old_objs:
+            old_items[tuple(getattr(obj, f) for f in key_fields)] = obj
+
+        new_items_dict = dict()
+        for values in new_items:
+            values = clean_component(model, values)
+            new_items_dict[tuple(values[f] for f in key_fields)] = values
+        self.values = list(new_items_dict.values())
+
+        if removed is None:
+            need_deleted_keys = [key for key in old_items if key not in new_items_dict]
+        else:
+            removed_keys = set()
+            for key_values in removed:
+                key_values = clean_component(model, {f: key_values.get(f) for f in key_fields})
+                removed_keys.add(tuple(key_values[f] for f in key_fields))
+            need_deleted_keys = [key for key in removed_keys if key in old_items and key not in new_items_dict]
+        self.history = asset_history.component_diff(key_fields, old_items, new_items_dict, need_deleted_keys)
+        self.capacity = capacity_rollups.component_delta(model, old_items, new_items_dict, need_deleted_keys)
+        self.deleted = [old_items[key].pk for key in need_deleted_keys]
+
+        self.created = []
+        self.updated = []
+        self.changed_fields = set()
+        for key, values in new_items_dict.items():
+            obj = old_items.get(key)
+            if obj is None:
+                self.created.append(model(asset=asset, **values))
+                continue
+            changed = [f for f, value in values.items() if getattr(obj, f) != value]
+            if changed:
+                for f in changed:
+                    setattr(obj, f, values[f])
+                self.updated.append(obj)
+                self.changed_fields.update(changed)
+
+    def merge(self, other):
+        self.deleted += other.deleted
+        self.created += other.created
+        self.updated += other.updated
+        self.changed_fields |= other.changed_fields
+
+    def write(self):
+        if self.deleted:
+            self.model.objects.filter(pk__in=self.deleted).delete()
+        if self.created:
+            self.model.objects.bulk_create(self.created)
+        if self.updated:
+            self.model.objects.bulk_update(self.updated, sorted(self.changed_fields))
+
+
+def ram_values(item):
+    return {
+        'slot': item['slot'],
+        'sn': item.get('sn'),
+        'model': item.get('model'),
+        'manufacturer': item.get('manufacturer'),
+        'capacity': item.get('capacity', 0),
+    }
+
+
+def disk_values(item):
+    interface_type = item.get('interface_type', 'unknown')
+    if interface_type not in ['SATA', 'SAS', 'SCSI', 'SSD', 'unknown']:
+        interface_type = 'unknown'
+    return {
+        'sn': item['sn'],
+        'slot': item.get('slot'),
+        'model': item.get('model'),
+        'manufacturer': item.get('manufacturer'),
+        'capacity': item.get('capacity'),
+        'interface_type': interface_type,
+    }
+
+
+def nic_values(item):
+    if item.get('net_mask') and len(item.get('net_mask')) > 0:
+        net_mask = item.get('net_mask')[0]
+    else:
+        net_mask = ""
+    return {
+        'model': item['model'],
+        'mac': item['mac'],
+        'name': item.get('name'),
+        'ip_address': item.get('ip_address'),
+        'ip_key': models.ip_key(item.get('ip_address')),
+        'net_mask': net_mask,
+    }
+
+
+def clean_component(model, values):
+    """
+    Convert reported values to what the database gives back, so unchanged rows compare equal.
+    """
+    cleaned = dict()
+    for name, value in values.items():
+        field = model._meta.get_field(name)
+        value = field.to_python(value)
+        if value in field.empty_values and not field.empty_strings_allowed:
+            value = None
+        cleaned[name] = value
+    return cleaned
+
+
+class PatchAsset(UpdateAsset):
+    """
+    Apply a delta report on top of the report version the server holds.
+    A delta carries the new version, the changed top-level sections and, per component table,
+    the added, modified and removed entries (removed entries only need their key fields).
+    """
+
+    components = (
+        ('ram', models.RAM, ('slot',), ram_values),
+        ('physical_disk_driver', models.Disk, ('sn',), disk_values),
+        ('nic', models.NIC, ('model', 'mac'), nic_values),
+    )
+
+    def __init__(self, request, asset, delta):
+        self.request = request
+        self.asset = asset
+        self.report_data = delta
+        self.report_hash = delta['version']
+        self.unchanged = False
+        self.component_changes = dict()
+        self.capacity_delta = Counter()
+        self.versioned = False
+        self.result = self.asset_update()
+
+    def asset_update(self):
+        if self.report_hash == self.report_data['base_version'] and \
+                touch_unchanged(self.asset.pk, self.asset.sn, self.report_hash):
+            self.unchanged = True
+            return True
+        func = getattr(self, "_%s_patch" % self.asset.asset_type)
+        ret = func()
+        return ret
 
-        old_nics = models.NIC.objects.filter(asset=self.asset)
-        old_nics_dict = dict()
-        if old_nics:
-            for nic in old_nics:
-                old_nics_dict[nic.model + nic.mac] = nic
-
-        new_nics_list = self.report_data['nic']
-        new_nics_dict = dict()
-        if new_nics_list:
-            for item in new_nics_list:
-                new_nics_dict[item['model'] + item['mac']] = item
-
-        need_delete_keys = set(old_nics_dict.keys()) - set(new_nics_dict.keys())
-        if need_delete_keys:
-            for key in need_delete_keys:
-                old_nics_dict[key].delete()
-
-        if new_nics_dict:
-            for key in new_nics_dict:
-                if new_nics_dict[key].get('net_mask') and len(new_nics_dict[key].get('net_mask')) > 0:
-                    net_mask = new_nics_dict[key].get('net_mask')[0]
+    def _server_patch(self):
+        sections = self.report_data.get('sections') or {}
+        try:
+            # Ends with _save_asset(), whose m_time is what other processes key their fragments on.
+            with transaction.atomic(), fragment_cache.asset_saved_after():
+                old_fields = asset_history.field_state(self.asset)
+                if 'manufacturer' in sections:
+                    m = sections['manufacturer']
+                    self.asset.manufacturer_id = lookup_cache.manufacturer_id(m) if m else None
+                self._patch_fields(self.asset.server, sections, ('model', 'os_type', 'os_distribution', 'os_release'))
+                old_cores = self.asset.cpu.cpu_core_count
+                self._patch_fields(self.asset.cpu, sections, ('cpu_model', 'cpu_count', 'cpu_core_count'))
+                self._count_cores(old_cores)
+                for key, model, key_fields, values in self.components:
+                    patch = self.report_data.get(key)
+                    if not patch:
+                        continue
+                    items = [values(item) for item in patch.get('added', []) + patch.get('modified', [])]
+                    self._sync_components(model, key_fields, items, removed=patch.get('removed', []))
+                self._record_change(old_fields)
+                capacity_rollups.add(capacity_rollups.group_of(self.asset), self.capacity_delta)
+                self.asset.report_hash = self.report_hash
+                self.asset.last_seen = timezone.now()
+                self._save_asset()
+
+        except Exception as e:
+            lookup_cache.clear()
+            if db_writer.is_lock_error(e):
+                # Not the report's fault: db_writer.write() runs it again once the lock is released.
+                raise
+            log('update_failed', msg=e, asset=self.asset, request=self.request)
+            print(e)
+            return False
+        else:
+            log("update", asset=self.asset)
+            print("Asset patched!")
+            return True
+
+    @staticmethod
+    def _patch_fields(obj, sections, fields):
+        changed = [f for f in fields if f in sections]
+        for f in changed:
+            setattr(obj, f, sections[f])
+        if changed:
+            obj.save(update_fields=changed)
+
+
+class BatchReport:
+    """
+    Ingest many asset reports at once.
+    All SNs are resolved with one query, new assets go to the approval zone with bulk writes
+    and known assets are updated together with a fixed number of queries per table, whatever the batch size.
+    If that bulk write fails, the known assets are updated one by one, each inside its own savepoint.
+    """
+
+    zone_fields = ['payload', 'asset_type', 'manufacturer', 'model', 'ram_size', 'cpu_model', 'cpu_count',
+                   'cpu_core_count', 'os_distribution', 'os_release', 'os_type', 'm_time']
+    # What UpdateAsset writes.
+    asset_fields = ['manufacturer', 'report_hash', 'last_seen', 'm_time']
+    server_fields = ['model', 'os_type', 'os_distribution', 'os_release']
+    cpu_fields = ['cpu_model', 'cpu_count', 'cpu_core_count']
+
+    def __init__(self, request, reports):
+        self.request = request
+        self.reports = reports
+        self.results = dict()
+
+    def run(self):
+        order = []
+        valid = dict()
+        for data in self.reports:
+            if not isinstance(data, dict) or not data.get('sn'):
+                order.append(None)
+                continue
+            sn = str(data['sn'])
+            if sn not in valid:
+                order.append(sn)
+            valid[sn] = data
+
+        with transaction.atomic():
+            assets = models.Asset.objects.select_related('server', 'cpu').in_bulk(list(valid), field_name='sn')
+            new_data = {sn: data for sn, data in valid.items() if sn not in assets}
+            self._add_to_new_assets_zone(new_data)
+            self._update_known(assets, valid)
+
+        results = []
+        for sn in order:
+            if sn is None:
+                results.append({'sn': None, 'status': 'invalid', 'msg': 'No Asset SN, Please check Data!'})
+            else:
+                results.append(self.results[sn])
+        return results
+
+    def _add_to_new_assets_zone(self, new_data):
+        if not new_data:
+            return
+        existing = models.NewAssetApprovalZone.objects.in_bulk(list(new_data), field_name='sn')
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        sections = dict()
+        for sn, data in new_data.items():
+            obj = existing.get(sn) or models.NewAssetApprovalZone(sn=sn)
+            payload, report_sections = report_payload.pack(data)
+            sections.update(report_sections)
+            for field, value in NewAsset.zone_defaults(data, payload).items():
+                setattr(obj, field, value)
+            obj.m_time = now
+            if obj.pk:
+                to_update.append(obj)
+            else:
+                to_create.append(obj)
+            self.results[sn] = {'sn': sn, 'status': 'new', 'msg': 'Asset has been added in New Asset Zone！',
+                                'version': report_hash(data)}
+        report_payload.store_sections(sections)
+        models.NewAssetApprovalZone.objects.bulk_create(to_create)
+        models.NewAssetApprovalZone.objects.bulk_update(to_update, self.zone_fields)
+
+    def _update_known(self, assets, reports):
+        now = timezone.now()
+        unchanged = [asset for sn, asset in assets.items() if asset.report_hash == report_hash(reports[sn])]
+        if unchanged:
+            # Same report as last time, only remember that the assets are still alive.
+            models.Asset.objects.filter(pk__in=[asset.pk for asset in unchanged]).update(last_seen=now)
+            for asset in unchanged:
+                self.results[asset.sn] = {'sn': asset.sn, 'status': 'unchanged', 'msg': 'Assets Data Unchanged!',
+                                          'version': asset.report_hash}
+        changed = {sn: asset for sn, asset in assets.items() if sn not in self.results}
+        if not changed:
+            return
+        try:
+            with transaction.atomic():
+                self._bulk_update(changed, reports, now)
+        except Exception as e:
+            if db_writer.is_lock_error(e):
+                # The whole batch is run again by db_writer.write().
+                raise
+            print(e)
+            # The bulk attempt changed the instances, start over from the stored rows.
+            fresh = models.Asset.objects.select_related('server', 'cpu').in_bulk([a.pk for a in changed.values()])
+            for asset in fresh.values():
+                self._update(asset, reports[asset.sn])
+
+    def _bulk_update(self, assets, reports, now):
+        """
+        What UpdateAsset does, for all the assets at once: one SELECT per component table for the whole batch,
+        then one delete, bulk_create and bulk_update per table and one bulk_update of the assets, servers and CPUs.
+        A report that can't be applied fails alone, before anything is written.
+        """
+        ids = [asset.pk for asset in assets.values()]
+        stored = dict()
+        for _, model, _, _ in PatchAsset.components:
+            stored[model] = {asset_id: [] for asset_id in ids}
+            for obj in model.objects.filter(asset_id__in=ids):
+                stored[model][obj.asset_id].append(obj)
+        manufacturers = dict()
+        plans = dict()
+        capacity = defaultdict(Counter)
+        changes = dict()
+        updated = []
+        for sn, asset in assets.items():
+            data = reports[sn]
+            try:
+                if data.get('asset_type') != 'server':
+                    raise ValueError("Unsupported asset type: %s" % data.get('asset_type'))
+                old_fields = asset_history.field_state(asset)
+                asset_plans = [ComponentPlan(asset, model, key_fields, stored[model][asset.pk],
+                                             [values(item) for item in data[key] or []])
+                               for key, model, key_fields, values in PatchAsset.components]
+                m = data.get('manufacturer')
+                if m and m not in manufacturers:
+                    manufacturers[m] = lookup_cache.manufacturer_id(m)
+                asset.manufacturer_id = manufacturers[m] if m else None
+                for f in self.server_fields:
+                    setattr(asset.server, f, data.get(f))
+                field = models.CPU._meta.get_field('cpu_core_count')
+                old_cores = field.to_python(asset.cpu.cpu_core_count) or 0
+                for f in self.cpu_fields:
+                    setattr(asset.cpu, f, data.get(f))
+                cores = (field.to_python(asset.cpu.cpu_core_count) or 0) - old_cores
+            except Exception as e:
+                log('update_failed', msg=e, asset=asset, request=self.request)
+                self.results[sn] = {'sn': sn, 'status': 'failed', 'msg': 'Update failed!'}
+                continue
+            group = capacity_rollups.group_of(asset)
+            capacity[group]['cores'] += cores
+            for plan in asset_plans:
+                capacity[group].update(plan.capacity)
+                if plan.model in plans:
+                    plans[plan.model].merge(plan)
+                else:
+                    plans[plan.model] = plan
+            delta = asset_history.change(asset, old_fields, {plan.model._meta.model_name: plan.history
+                                                             for plan in asset_plans})
+            if delta is not None:
+                changes[asset.pk] = (asset, delta, {plan.model: plan.values for plan in asset_plans})
+            asset.report_hash = report_hash(data)
+            asset.last_seen = now
+            asset.m_time = now
+            updated.append(asset)
+        if not updated:
+            return
+
+        for plan in plans.values():
+            plan.write()
+        models.Server.objects.bulk_update([asset.server for asset in updated], self.server_fields)
+        models.CPU.objects.bulk_update([asset.cpu for asset in updated], self.cpu_fields)
+        versions = asset_history.next_versions(changes)
+        entries = []
+        for asset_id, (asset, delta, components) in changes.items():
+            asset.history_version = versions[asset_id]
+            entries.append(asset_history.build_change(asset, delta, components))
+        models.AssetHistory.objects.bulk_create(entries)
+        # history_version only where next_versions() moved it.
+        models.Asset.objects.bulk_update([a for a in updated if a.pk not in changes], self.asset_fields)
+        models.Asset.objects.bulk_update([a for a in updated if a.pk in changes],
+                                         self.asset_fields + ['history_version'])
+        capacity_rollups.add_many(capacity)
+        search_index.mark(*[asset.pk for asset in updated])
+        for asset in updated:
+            lookup_cache.forget_asset(asset.sn)
+            log('update', asset=asset)
+            self.results[asset.sn] = {'sn': asset.sn, 'status': 'updated', 'msg': 'Assets Data Updated!',
+                                      'version': asset.report_hash}
+
+    def _update(self, asset, data):
+        try:
+            with transaction.atomic():
+                update_asset = UpdateAsset(self.request, asset, data)
+            ret = update_asset.result
+        except Exception as e:
+            if db_writer.is_lock_error(e):
+                raise
+            ret = False
+            print(e)
+        if ret and update_asset.unchanged:
+            self.results[asset.sn] = {'sn': asset.sn, 'status': 'unchanged', 'msg': 'Assets Data Unchanged!',
+                                      'version': update_asset.report_hash}
+        elif ret:
+            self.results[asset.sn] = {'sn': asset.sn, 'status': 'updated', 'msg': 'Assets Data Updated!',
+                                      'version': update_asset.report_hash}
+        else:
+            self.results[asset.sn] = {'sn': asset.sn, 'status': 'failed', 'msg': 'Update failed!'}
+
+
+class BulkApproveAsset:
+    """
+    Approve many assets of the approval zone in chunks.
+    A chunk is written with one bulk_create per table inside one transaction,
+    if that fails the chunk is retried asset by asset so one bad report doesn't sink the others.
+    """
+
+    def __init__(self, user, new_asset_ids, chunk_size=None, progress=None):
+        self.user = user
+        self.new_asset_ids = list(new_asset_ids)
+        self.chunk_size = chunk_size or getattr(settings, 'APPROVAL_CHUNK_SIZE', 500)
+        self.progress = progress
+        self.approved = 0
+        self.failed = 0
+
+    def run(self):
+        for i in range(0, len(self.new_asset_ids), self.chunk_size):
+            self._approve_chunk(self.new_asset_ids[i:i + self.chunk_size])
+            if self.progress:
+                self.progress(self.approved, self.failed)
+        event_sink.sink.flush()
+        return self.approved, self.failed
+
+    def _approve_chunk(self, ids):
+        items = []
+        new_assets = list(models.NewAssetApprovalZone.objects.filter(id__in=ids))
+        reports = report_payload.load_many(new_assets)
+        for new_asset in new_assets:
+            try:
+                if new_asset.id not in reports:
+                    raise ValueError("Report sections of %s are missing" % new_asset.sn)
+                items.append((new_asset, self._build_components(new_asset, reports[new_asset.id])))
+            except Exception as e:
+                self._fail(new_asset, e)
+        if not items:
+            return
+        try:
+            with transaction.atomic():
+                self._write(items)
+        except Exception:
+            for item in items:
+                try:
+                    with transaction.atomic():
+                        self._write([item])
+                except Exception as e:
+                    self._fail(item[0], e)
                 else:
-                    net_mask = ""
-                defaults = {
-                    'name': new_nics_dict[key].get('name'),
-                    'ip_address': new_nics_dict[key].get('ip_address'),
-                    'net_mask': net_mask,
-                }
-                models.NIC.objects.update_or_create(asset=self.asset, model=new_nics_dict[key]['model'],
-                                                    mac=new_nics_dict[key]['mac'], defaults=defaults)
-
-        print('Update Success！')
+                    self.approved += 1
+        else:
+            self.approved += len(items)
+
+    def _fail(self, new_asset, e):
+        self.failed += 1
+        event_sink.sink.add(build_event('approve_failed', msg=e, new_asset=new_asset, user=self.user))
+
+    @staticmethod
+    def _build_components(new_asset, data):
+        if new_asset.asset_type != 'server':
+            raise ValueError("Unsupported asset type: %s" % new_asset.asset_type)
+        for ram_dict in data.get('ram') or []:
+            if not ram_dict.get('slot'):
+                raise ValueError("Unknown RAM Slot")
+        for disk_dict in data.get('physical_disk_driver') or []:
+            if not disk_dict.get('sn'):
+                raise ValueError("Unknown Disk SN")
+        for nic_dict in data.get('nic') or []:
+            if not nic_dict.get('mac'):
+                raise ValueError("No mac address！")
+            if not nic_dict.get('model'):
+                raise ValueError("Unknown nic model！")
+        components = {'report_hash': report_hash(data)}
+        for key, model, key_fields, values in PatchAsset.components:
+            # Duplicated keys in one report keep the last entry, like UpdateAsset.
+            unique = dict()
+            for item in data.get(key) or []:
+                item_values = clean_component(model, values(item))
+                unique[tuple(item_values[f] for f in key_fields)] = item_values
+            components[model] = list(unique.values())
+        return components
+
+    def _write(self, items):
+        now = timezone.now()
+        assets = []
+        for new_asset, components in items:
+            m = new_asset.manufacturer
+            assets.append(models.Asset(asset_type=new_asset.asset_type,
+                                       name="%s: %s" % (new_asset.asset_type, new_asset.sn),
+                                       sn=new_asset.sn, approved_by=self.user,
+                                       manufacturer_id=lookup_cache.manufacturer_id(m) if m else None,
+                                       report_hash=components['report_hash'], last_seen=now,
+                                       history_version=1))
+        models.Asset.objects.bulk_create(assets)
+        dashboard_counters.add_many(assets)
+        asset_ids = dict(models.Asset.objects.filter(sn__in=[a.sn for a in assets]).values_list('sn', 'id'))
+
+        rows = {models.Server: [], models.CPU: [], models.RAM: [], models.Disk: [], models.NIC: [],
+                models.AssetHistory: [], models.EventLog: []}
+        capacity = dict()
+        for asset, (new_asset, components) in zip(assets, items):
+            asset.id = asset_ids[asset.sn]
+            rows[models.Server].append(models.Server(asset=asset, model=new_asset.model,
+                                                     os_type=new_asset.os_type,
+                                                     os_distribution=new_asset.os_distribution,
+                                                     os_release=new_asset.os_release))
+            rows[models.CPU].append(models.CPU(asset=asset, cpu_model=new_asset.cpu_model,
+                                               cpu_count=new_asset.cpu_count,
+                                               cpu_core_count=new_asset.cpu_core_count))
+            for model in (models.RAM, models.Disk, models.NIC):
+                rows[model].extend(model(asset=asset, **values) for values in components[model])
+            rows[models.AssetHistory].append(
+                asset_history.build_entry(asset, 'snapshot', asset_history.snapshot(asset, components)))
+            rows[models.EventLog].append(build_event('upline', asset=asset, user=self.user))
+            group = capacity_rollups.group_key(asset.__dict__)
+            capacity[group] = capacity.get(group, Counter()) + \
+                capacity_rollups.totals_of(components, new_asset.cpu_core_count)
+        for model, objs in rows.items():
+            model.objects.bulk_create(objs)
+        capacity_rollups.add_many(capacity)
+        search_index.mark(*asset_ids.values())
+        models.NewAssetApprovalZone.objects.filter(id__in=[new_asset.id for new_asset, _ in items]).delete()
+
+
+class ApprovalJobTakenOver(Exception):
+    """Another worker claimed the approval job after its heartbeat went stale."""
+
+
+def claim_approval_job(job_id, stale_before=None):
+    """
+    Mark the job running if it is pending, or running with a heartbeat (m_time) older than stale_before.
+    The claim is one conditional UPDATE, so two workers never both get the job.
+    Returns the heartbeat of the claim, None when the job is not free.
+    """
+    free = Q(status='pending')
+    if stale_before is not None:
+        free |= Q(status='running', m_time__lt=stale_before)
+    now = timezone.now()
+    if models.ApprovalJob.objects.filter(free, pk=job_id).update(status='running', m_time=now):
+        return now
+    return None
+
+
+def run_approval_job(job_id, stale_before=None):
+    """Claim the job and approve its assets, returns False when the job is not free or was taken over."""
+    heartbeat = claim_approval_job(job_id, stale_before)
+    if heartbeat is None:
+        return False
+    job = models.ApprovalJob.objects.select_related('user').get(pk=job_id)
+    ids = json.loads(job.new_asset_ids)
+    # On a resumed job the assets approved by the earlier run have left the zone, its failures are tried again.
+    remaining = set(models.NewAssetApprovalZone.objects.filter(id__in=ids).values_list('id', flat=True))
+    approved_before = len(ids) - len(remaining)
+    state = {'heartbeat': heartbeat}
+
+    def update(**fields):
+        # Only while the heartbeat is still ours: a worker that resumed the job in the meantime changed it.
+        now = timezone.now()
+        if not models.ApprovalJob.objects.filter(pk=job.pk, m_time=state['heartbeat']).update(m_time=now, **fields):
+            raise ApprovalJobTakenOver('%s was taken over by another worker' % job)
+        state['heartbeat'] = now
+
+    def progress(approved, failed):
+        update(approved=approved_before + approved, failed=failed)
+
+    update(total=len(ids), approved=approved_before, failed=0)
+    try:
+        BulkApproveAsset(job.user, [i for i in ids if i in remaining], progress=progress).run()
+    except ApprovalJobTakenOver:
+        return False
+    except Exception as e:
+        update(status='failed', memo=str(e))
+        raise
+    update(status='done')
+    return True
+
+
+def start_approval_job(job):
+    """
+    Run the job in a background thread once the job row is committed.
+    With APPROVAL_JOB_IN_THREAD off, jobs wait for `manage.py run_approval_jobs`.
+    """
+    if not getattr(settings, 'APPROVAL_JOB_IN_THREAD', True):
+        return
+    thread = threading.Thread(target=_approval_job_thread, args=(job.pk,), daemon=True)
+    transaction.on_commit(thread.start)
+
+
+def _approval_job_thread(job_id):
+    try:
+        run_approval_job(job_id)
+    except Exception as e:
+        print(e)
+    finally:
+        connection.close()
@@ -0,0 +1,163 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from assets import models
+
+TABLE = models.Asset._meta.db_table
+
+# (attribute of the asset, field) pairs a history entry tracks outside the component tables.
+FIELDS = (
+    ('self', 'manufacturer_id'),
+    ('server', 'model'),
+    ('server', 'os_type'),
+    ('server', 'os_distribution'),
+    ('server', 'os_release'),
+    ('cpu', 'cpu_model'),
+    ('cpu', 'cpu_count'),
+    ('cpu', 'cpu_core_count'),
+)
+
+# Component table -> key fields, the same keys UpdateAsset diffs on.
+COMPONENTS = (
+    (models.RAM, ('slot',)),
+    (models.Disk, ('sn',)),
+    (models.NIC, ('model', 'mac')),
+)
+
+
+def field_state(asset):
+    """The tracked fields as the database would return them."""
+    state = dict()
+    for attr, name in FIELDS:
+        obj = asset if attr == 'self' else getattr(asset, attr)
+        field = obj._meta.get_field(name)
+        state[name] = field.to_python(getattr(obj, field.attname))
+    return state
+
+
+def component_key(key):
+    return json.dumps(list(key), ensure_ascii=False)
+
+
+def component_values(obj, key_fields):
+    return {f.name: getattr(obj, f.attname) for f in obj._meta.concrete_fields
+            if f.name not in ('id', 'asset') and f.name not in key_fields}
+
+
+def component_diff(key_fields, old_items, new_items, removed_keys):
+    """
+    The diff _sync_components applied to one table: added rows, changed fields of kept rows and removed keys.
+    old_items maps key tuples to stored rows, new_items maps key tuples to cleaned values.
+    """
+    diff = {'added': {}, 'changed': {}, 'removed': [component_key(key) for key in removed_keys]}
+    for key, values in new_items.items():
+        obj = old_items.get(key)
+        if obj is None:
+            diff['added'][component_key(key)] = {f: v for f, v in values.items() if f not in key_fields}
+            continue
+        changed = {f: v for f, v in values.items() if getattr(obj, f) != v}
+        if changed:
+            diff['changed'][component_key(key)] = changed
+    return {k: v for k, v in diff.items() if v}
+
+
+def snapshot(asset, components=None):
+    """
+    The full state of the asset. `components` maps component models to lists of cleaned values,
+    the rows are read from the database without it.
+    """
+    state = {'fields': field_state(asset)}
+    for model, key_fields in COMPONENTS:
+        if components is None:
+            rows = {component_key(getattr(obj, f) for f in key_fields): component_values(obj, key_fields)
+                    for obj in model.objects.filter(asset=asset)}
+        else:
+            rows = {component_key(values[f] for f in key_fields):
+                    {f: v for f, v in values.items() if f not in key_fields}
+                    for values in components[model]}
+        state[model._meta.model_name] = rows
+    return state
+
+
+def build_entry(asset, kind, data):
+    return models.AssetHistory(asset=asset, version=asset.history_version, kind=kind, time=timezone.now(),
+                               data=json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str))
+
+
+def next_versions(asset_ids):
+    """
+    Allocate the next history version of each asset in the database, {asset id: version}.
+    The increment locks the rows until the transaction ends, so concurrent updates of an asset get distinct versions.
+    """
+    asset_ids = list(asset_ids)
+    if not asset_ids:
+        return {}
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET history_version = history_version + 1 WHERE id IN (%s) '
+                           'RETURNING id, history_version' % (TABLE, ', '.join(['%s'] * len(asset_ids))), asset_ids)
+            return dict(cursor.fetchall())
+    models.Asset.objects.filter(pk__in=asset_ids).update(history_version=F('history_version') + 1)
+    return dict(models.Asset.objects.filter(pk__in=asset_ids).values_list('id', 'history_version'))
+
+
+def change(asset, old_fields, components):
+    """
+    The delta of one update: changed tracked fields and the non-empty component_diff() results of `components`,
+    which maps table names to them. None when nothing structural changed.
+    """
+    new_fields = field_state(asset)
+    fields = {name: value for name, value in new_fields.items() if old_fields.get(name) != value}
+    delta = {name: diff for name, diff in components.items() if diff}
+    if not fields and not delta:
+        return None
+    if fields:
+        delta['fields'] = fields
+    return delta
+
+
+def build_change(asset, delta, components=None):
+    """
+    The history entry of a change() delta, unsaved, at asset.history_version as allocated by next_versions().
+    Every ASSET_HISTORY_SNAPSHOT_EVERY versions it is a full snapshot instead, `components` as for snapshot().
+    """
+    every = getattr(settings, 'ASSET_HISTORY_SNAPSHOT_EVERY', 20)
+    if every <= 1 or asset.history_version % every == 1:
+        return build_entry(asset, 'snapshot', snapshot(asset, components))
+    return build_entry(asset, 'delta', delta)
+
+
+def apply_delta(state, delta):
+    state['fields'].update(delta.get('fields', {}))
+    for model, key_fields in COMPONENTS:
+        diff = delta.get(model._meta.model_name)
+        if not diff:
+            continue
+        rows = state[model._meta.model_name]
+        for key in diff.get('removed', []):
+            rows.pop(key, None)
+        rows.update(diff.get('added', {}))
+        for key, changed in diff.get('changed', {}).items():
+            rows.setdefault(key, {}).update(changed)
+    return state
+
+
+def asset_state(asset_id, at=None):
+    """
+    What the asset looked like at the given time (default: now), rebuilt from the last snapshot before it
+    and the deltas after that snapshot. None if the asset has no recorded history by then.
+    """
+    entries = models.AssetHistory.objects.filter(asset_id=asset_id)
+    if at is not None:
+        entries = entries.filter(time__lte=at)
+    base = entries.filter(kind='snapshot').order_by('-version').first()
+    if base is None:
+        return None
+    state = json.loads(base.data)
+    for data in entries.filter(version__gt=base.version).order_by('version').values_list('data', flat=True):
+        apply_delta(state, json.loads(data))
+    return state
@@ -0,0 +1,188 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from assets import models
+from assets import unit_tree
+
+GROUP_FIELDS = ('idc_id', 'business_unit_id')
+TOTALS = ('ram', 'disk', 'cores')
+
+# Component table -> (rollup column, summed field).
+SOURCES = {
+    models.RAM: ('ram', 'capacity'),
+    models.Disk: ('disk', 'capacity'),
+    models.CPU: ('cores', 'cpu_core_count'),
+}
+
+
+def group_key(values):
+    """The CapacityRollup row of an asset, from an instance __dict__ or a values() row. None if a field is missing."""
+    if any(f not in values for f in GROUP_FIELDS):
+        return None
+    return values['idc_id'] or 0, values['business_unit_id'] or 0
+
+
+def group_of(asset):
+    return group_key(asset.__dict__) or group_key(
+        models.Asset.objects.filter(pk=asset.pk).values(*GROUP_FIELDS).first() or {})
+
+
+def add(group, delta, sign=1):
+    """Add a {column: amount} delta to the row of one group, no query when it is all zero."""
+    changes = {name: sign * delta[name] for name in TOTALS if delta.get(name)}
+    if not changes or group is None:
+        return
+    lookup = dict(zip(GROUP_FIELDS, group))
+    if models.CapacityRollup.objects.filter(**lookup).update(**{n: F(n) + v for n, v in changes.items()}):
+        return
+    try:
+        with transaction.atomic():
+            models.CapacityRollup.objects.create(**lookup, **changes)
+    except IntegrityError:
+        # Created concurrently.
+        models.CapacityRollup.objects.filter(**lookup).update(**{n: F(n) + v for n, v in changes.items()})
+
+
+def add_many(deltas):
+    for group, delta in deltas.items():
+        add(group, delta)
+
+
+def totals_of(components=None, cores=None):
+    """The delta of new rows: `components` maps component models to lists of cleaned values."""
+    delta = Counter()
+    for model, values in (components or {}).items():
+        if model in SOURCES:
+            name, field = SOURCES[model]
+            delta[name] += sum(item.get(field) or 0 for item in values)
+    delta['cores'] += cores or 0
+    return delta
+
+
+def component_delta(model, old_items, new_items, removed_keys):
+    """
+    What UpdateAsset._sync_components changes in the rollup, with the same arguments as asset_history.component_diff:
+    the new values of written rows minus the stored values of the rows they replace or remove.
+    """
+    delta = Counter()
+    if model not in SOURCES:
+        return delta
+    name, field = SOURCES[model]
+    delta[name] += sum(values.get(field) or 0 for values in new_items.values())
+    delta[name] -= sum(getattr(old_items[key], field) or 0 for key in new_items if key in old_items)
+    delta[name] -= sum(getattr(old_items[key], field) or 0 for key in removed_keys)
+    return delta
+
+
+def component_sums(**lookup):
+    """{group: Counter} summed from the component tables, one query per table. Lookups apply to the component rows."""
+    sums = defaultdict(Counter)
+    for model, (name, field) in SOURCES.items():
+        rows = model.objects.filter(**lookup).values('asset__idc_id', 'asset__business_unit_id') \
+            .annotate(total=Sum(field)).order_by()
+        for row in rows:
+            sums[(row['asset__idc_id'] or 0, row['asset__business_unit_id'] or 0)][name] += row['total'] or 0
+    return sums
+
+
+def component_rows(queryset):
+    """(asset id, value) of component rows, [] for tables the rollups don't count."""
+    if queryset.model not in SOURCES:
+        return []
+    return list(queryset.values_list('asset_id', SOURCES[queryset.model][1]))
+
+
+def add_rows(model, rows, sign=1):
+    """Count rows read with component_rows, sign=-1 takes them out."""
+    if not rows:
+        return
+    name = SOURCES[model][0]
+    groups = {row[0]: group_key(dict(zip(GROUP_FIELDS, row[1:]))) for row in models.Asset.objects.filter(
+        id__in={asset_id for asset_id, _ in rows}).values_list('id', *GROUP_FIELDS)}
+    deltas = defaultdict(Counter)
+    for asset_id, value in rows:
+        if asset_id in groups:
+            deltas[groups[asset_id]][name] += sign * (value or 0)
+    add_many(deltas)
+
+
+def differences(stored, expected):
+    """[(group, stored totals, expected totals)] of the groups that don't match."""
+    drift = []
+    for group in sorted(set(stored) | set(expected)):
+        old = [stored.get(group, {}).get(name) or 0 for name in TOTALS]
+        new = [expected.get(group, {}).get(name) or 0 for name in TOTALS]
+        if any(abs(a - b) > 1e-6 for a, b in zip(old, new)):
+            drift.append((group, dict(zip(TOTALS, old)), dict(zip(TOTALS, new))))
+    return drift
+
+
+def rebuild(check_only=False):
+    """
+    Recompute the rollups from the component tables and return the groups that had drifted.
+    With check_only the stored rows are left alone.
+    """
+    with transaction.atomic():
+        expected = component_sums()
+        stored = {(row['idc_id'], row['business_unit_id']): row
+                  for row in models.CapacityRollup.objects.values(*GROUP_FIELDS, *TOTALS)}
+        drift = differences(stored, expected)
+        if not check_only:
+            models.CapacityRollup.objects.all().delete()
+            models.CapacityRollup.objects.bulk_create([
+                models.CapacityRollup(**dict(zip(GROUP_FIELDS, group)), **{n: totals[n] for n in TOTALS})
+                for group, totals in expected.items()])
+    return drift
+
+
+def rollup(by, business_unit=None):
+    """Totals per 'idc' or 'business_unit' id, one query over the rollup table, optionally within a unit's subtree."""
+    rows = models.CapacityRollup.objects.all()
+    if business_unit is not None:
+        rows = rows.filter(business_unit_id__in=unit_tree.subtree(business_unit))
+    rows = rows.values('%s_id' % by).annotate(
+        **{'total_%s' % n: Sum(n) for n in TOTALS}).order_by('%s_id' % by)
+    return {row['%s_id' % by]: {n: row['total_%s' % n] for n in TOTALS} for row in rows}
+
+
+@receiver(post_init, sender=models.Asset)
+def remember_group(sender, instance, **kwargs):
+    instance._capacity_group = group_key(instance.__dict__) if instance.pk else None
+
+
+@receiver(pre_save, sender=models.Asset)
+def load_group(sender, instance, **kwargs):
+    if instance.pk and instance._capacity_group is None and not instance._state.adding:
+        row = models.Asset.objects.filter(pk=instance.pk).values(*GROUP_FIELDS).first()
+        instance._capacity_group = group_key(row) if row else None
+
+
+@receiver(post_save, sender=models.Asset)
+def asset_saved(sender, instance, created, **kwargs):
+    group = group_of(instance)
+    old_group = instance._capacity_group
+    if not created and old_group is not None and group != old_group:
+        # Moved to another IDC or business unit, its components move along.
+        totals = component_sums(asset_id=instance.pk).get(group, Counter())
+        add(old_group, totals, -1)
+        add(group, totals)
+    instance._capacity_group = group
+
+
+@receiver(pre_delete, sender=models.Asset)
+def asset_deleting(sender, instance, **kwargs):
+    # Before the cascade removes the components. ApproveAsset clears the flag until it has counted them.
+    if getattr(instance, '_capacity_counted', True):
+        for group, totals in component_sums(asset_id=instance.pk).items():
+            add(group, totals, -1)
+
+
+@receiver(post_delete, sender=models.IDC)
+@receiver(post_delete, sender=models.BusinessUnit)
+def group_deleted(sender, instance, **kwargs):
+    # Its assets were moved to "none" with a queryset update, which sends no signals.
+    rebuild()
@@ -0,0 +1,97 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from assets import models
+from assets import unit_tree
+
+KEY_FIELDS = ('asset_type', 'status', 'idc_id', 'business_unit_id')
+
+
+def counter_key(values):
+    """The AssetCounter row of an asset, from an instance __dict__ or a values() row. None if a field is missing."""
+    if any(f not in values for f in KEY_FIELDS):
+        return None
+    return values['asset_type'], values['status'], values['idc_id'] or 0, values['business_unit_id'] or 0
+
+
+def bump(key, delta):
+    if not delta:
+        return
+    lookup = dict(zip(KEY_FIELDS, key))
+    if models.AssetCounter.objects.filter(**lookup).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            models.AssetCounter.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        # Created concurrently.
+        models.AssetCounter.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def add_many(assets):
+    """Count assets written with bulk_create, which sends no signals."""
+    for key, delta in Counter(counter_key(asset.__dict__) for asset in assets).items():
+        bump(key, delta)
+
+
+def rebuild():
+    """Recount everything from the asset table. Returns the number of counter rows."""
+    rows = models.Asset.objects.values(*KEY_FIELDS).annotate(n=Count('id')).order_by()
+    with transaction.atomic():
+        models.AssetCounter.objects.all().delete()
+        models.AssetCounter.objects.bulk_create(
+            [models.AssetCounter(count=row['n'], **dict(zip(KEY_FIELDS, counter_key(row)))) for row in rows])
+        return models.AssetCounter.objects.count()
+
+
+def totals(business_unit=None):
+    """{(asset_type, status): count} over all IDCs and business units, or the subtree of one unit. One query."""
+    rows = models.AssetCounter.objects.all()
+    if business_unit is not None:
+        rows = rows.filter(business_unit_id__in=unit_tree.subtree(business_unit))
+    rows = rows.values('asset_type', 'status').annotate(n=Sum('count')).order_by()
+    return {(row['asset_type'], row['status']): row['n'] for row in rows}
+
+
+@receiver(post_init, sender=models.Asset)
+def remember_key(sender, instance, **kwargs):
+    # Read from __dict__, deferred fields must not cost a query per instance.
+    instance._counter_key = counter_key(instance.__dict__) if instance.pk else None
+
+
+@receiver(pre_save, sender=models.Asset)
+def load_key(sender, instance, **kwargs):
+    if instance.pk and instance._counter_key is None and not instance._state.adding:
+        row = models.Asset.objects.filter(pk=instance.pk).values(*KEY_FIELDS).first()
+        instance._counter_key = counter_key(row) if row else None
+
+
+@receiver(post_save, sender=models.Asset)
+def asset_saved(sender, instance, created, **kwargs):
+    key = counter_key(instance.__dict__)
+    if key is None:
+        key = counter_key(models.Asset.objects.filter(pk=instance.pk).values(*KEY_FIELDS).first())
+    old_key = None if created else instance._counter_key
+    if key != old_key:
+        if old_key is not None:
+            bump(old_key, -1)
+        bump(key, 1)
+    instance._counter_key = key
+
+
+@receiver(post_delete, sender=models.Asset)
+def asset_deleted(sender, instance, **kwargs):
+    key = instance._counter_key or counter_key(instance.__dict__)
+    if key is not None:
+        bump(key, -1)
+
+
+@receiver(post_delete, sender=models.IDC)
+@receiver(post_delete, sender=models.BusinessUnit)
+def group_deleted(sender, instance, **kwargs):
+    # Its assets were moved to "none" with a queryset update, which sends no signals.
+    rebuild()
@@ -0,0 +1,176 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    """Run SQLITE_PRAGMAS on every new SQLite connection, in order."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+class WriteStats:
+    """
+    Counters of the writes run by write(). lock_wait is the time spent in attempts that failed with
+    "database is locked" and in the pauses before retrying them, queue_wait the time writes waited for the writer thread.
+    """
+
+    FIELDS = ('writes', 'retries', 'failures', 'lock_wait', 'max_lock_wait', 'queue_wait', 'max_queue_wait')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            for name in self.FIELDS:
+                setattr(self, name, 0)
+
+    def add(self, writes=0, retries=0, failures=0, lock_wait=0.0, queue_wait=0.0):
+        with self.lock:
+            self.writes += writes
+            self.retries += retries
+            self.failures += failures
+            self.lock_wait += lock_wait
+            self.max_lock_wait = max(self.max_lock_wait, lock_wait)
+            self.queue_wait += queue_wait
+            self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+
+    def as_dict(self):
+        with self.lock:
+            values = {name: getattr(self, name) for name in self.FIELDS}
+        return {name: round(value, 6) if isinstance(value, float) else value for name, value in values.items()}
+
+
+stats = WriteStats()
+
+
+def is_locked(error):
+    # "database is locked", or "database table is locked" with a shared cache.
+    return 'locked' in str(error)
+
+
+def is_lock_error(error):
+    """An error that run_with_retry() retries, handlers that catch every error let these through."""
+    return isinstance(error, OperationalError) and is_locked(error)
+
+
+def run_with_retry(func, *args):
+    """
+    Run func, again after a pause while it fails with "database is locked".
+    Only outside of a transaction: inside one the lock error has to roll the whole transaction back.
+    Reports are full snapshots, so running one again is safe.
+    """
+    retries = getattr(settings, 'SQLITE_WRITE_RETRIES', 3)
+    delay = getattr(settings, 'SQLITE_RETRY_DELAY', 0.05)
+    waited = 0.0
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            result = func(*args)
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            if attempt >= retries or connection.in_atomic_block:
+                stats.add(failures=1, lock_wait=waited + time.monotonic() - start)
+                raise
+            time.sleep(delay * 2 ** attempt)
+            waited += time.monotonic() - start
+            attempt += 1
+            stats.add(retries=1)
+            continue
+        stats.add(writes=1, lock_wait=waited)
+        return result
+
+
+class Writer:
+    """
+    One thread, with one database connection, running the queued writes in order,
+    so the writes of this process never wait on each other for the SQLite lock.
+    Other processes still compete for it: a deployment should send its reports to one process, see the settings.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args):
+        future = Future()
+        self.start()
+        self.queue.put((func, args, future, time.monotonic()))
+        return future
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='cmdb-db-writer', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """Write what is queued, then end the thread and close its connection."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+
+    def in_writer(self):
+        return threading.current_thread() is self.thread
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                func, args, future, queued_at = item
+                stats.add(queue_wait=time.monotonic() - queued_at)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(run_with_retry(func, *args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            connection.close()
+
+
+writer = Writer()
+atexit.register(writer.stop)
+
+
+def write(func, *args):
+    """
+    Run an ingest write and return its result: on the writer thread with SQLITE_WRITE_QUEUE, in this thread otherwise.
+    Either way it is retried while the database is locked.
+    """
+    if getattr(settings, 'SQLITE_WRITE_QUEUE', False) and not writer.in_writer():
+        return writer.submit(func, *args).result()
+    return run_with_retry(func, *args)
+
+
+def info():
+    """The counters, the queue depth and the journal mode of the database."""
+    result = stats.as_dict()
+    result['queued'] = writer.queue.qsize()
+    result['write_queue'] = bool(getattr(settings, 'SQLITE_WRITE_QUEUE', False))
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            result['journal_mode'] = cursor.fetchone()[0]
+    return result
@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from assets import models
+
+FIELDS = ('id', 'name', 'asset_id', 'new_asset_id', 'event_type', 'component', 'detail', 'date', 'user_id', 'memo')
+
+
+class EventArchive:
+    """
+    EventLog rows rolled out of the database, one gzipped JSONL segment per day.
+    Every segment has a sidecar index with its id range and the id range of each asset in it,
+    so a history lookup only opens the segments that mention the asset.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or getattr(settings, 'EVENT_LOG_ARCHIVE_PATH', settings.BASE_DIR / 'event_archive'))
+        # day -> (index, ids in the segment), read from the segment on the first append of the day.
+        self.loaded = {}
+
+    def segment_path(self, day):
+        return os.path.join(self.path, 'events-%s.jsonl.gz' % day.isoformat())
+
+    def index_path(self, day):
+        return os.path.join(self.path, 'events-%s.idx.json' % day.isoformat())
+
+    def days(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(datetime.strptime(name[7:17], '%Y-%m-%d').date()
+                      for name in os.listdir(self.path) if name.startswith('events-') and name.endswith('.idx.json'))
+
+    def empty_index(self, day):
+        return {'day': day.isoformat(), 'count': 0, 'min_id': None, 'max_id': 0, 'assets': {}}
+
+    def index(self, day):
+        try:
+            with open(self.index_path(day)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self.empty_index(day)
+
+    def load(self, day):
+        if day not in self.loaded:
+            # Built from the segment itself, a run that stopped between segment and index left the index behind.
+            index = self.empty_index(day)
+            ids = set()
+            if os.path.exists(self.segment_path(day)):
+                for row in self.read(day):
+                    ids.add(row['id'])
+                    self._add(index, row)
+            self.loaded[day] = (index, ids)
+        return self.loaded[day]
+
+    def _add(self, index, row):
+        index['count'] += 1
+        index['min_id'] = row['id'] if index['min_id'] is None else min(index['min_id'], row['id'])
+        index['max_id'] = max(index['max_id'], row['id'])
+        if row['asset_id'] is not None:
+            low, high = index['assets'].get(str(row['asset_id']), (row['id'], row['id']))
+            index['assets'][str(row['asset_id'])] = [min(low, row['id']), max(high, row['id'])]
+
+    def append(self, day, rows):
+        """
+        Append the rows of one day that aren't in its segment yet, late ones with lower ids included.
+        Returns the ids of the rows that are on disk once it returns, written now or by an earlier run.
+        """
+        index, ids = self.load(day)
+        new_rows = [row for row in rows if row['id'] not in ids]
+        if new_rows:
+            os.makedirs(self.path, exist_ok=True)
+            # Each append is a new gzip member, gzip readers see the members as one stream.
+            with open(self.segment_path(day), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                    for row in new_rows:
+                        f.write((json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+            for row in new_rows:
+                ids.add(row['id'])
+                self._add(index, row)
+            tmp_path = self.index_path(day) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path(day))
+        return {row['id'] for row in rows}
+
+    def read(self, day, asset_id=None):
+        seen = set()
+        with gzip.open(self.segment_path(day), 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                # A run that stopped between segment and index leaves duplicates behind.
+                if row['id'] in seen or (asset_id is not None and row['asset_id'] != asset_id):
+                    continue
+                seen.add(row['id'])
+                row['date'] = datetime.fromisoformat(row['date'])
+                yield row
+
+    def asset_events(self, asset_id, since=None, until=None):
+        for day in self.days():
+            if (since and day < since) or (until and day > until):
+                continue
+            if str(asset_id) in self.index(day)['assets']:
+                yield from self.read(day, asset_id)
+
+
+def archive_events(before=None, chunk_size=None, archive=None):
+    """
+    Move EventLog rows older than `before` (default: EVENT_LOG_RETENTION_DAYS ago) into the archive.
+    Rows are deleted chunk by chunk, only those the archive confirmed on disk. Returns the number of rows moved.
+    """
+    if before is None:
+        before = timezone.now() - timedelta(days=getattr(settings, 'EVENT_LOG_RETENTION_DAYS', 90))
+    chunk_size = chunk_size or getattr(settings, 'EVENT_LOG_ARCHIVE_CHUNK_SIZE', 1000)
+    archive = archive or EventArchive()
+    moved = 0
+    last_id = 0
+    while True:
+        rows = list(models.EventLog.objects.filter(date__lt=before, id__gt=last_id)
+                    .order_by('id').values(*FIELDS)[:chunk_size])
+        if not rows:
+            return moved
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(timezone.localdate(row['date']), []).append(dict(row, date=row['date'].isoformat()))
+        written = set()
+        for day, day_rows in by_day.items():
+            written |= archive.append(day, day_rows)
+        last_id = rows[-1]['id']
+        with transaction.atomic():
+            models.EventLog.objects.filter(id__in=written).delete()
+        moved += len(written)
+
+
+def asset_history(asset_id, since=None, until=None, archive=None):
+    """
+    All events of one asset, newest first, from the table and the archive.
+    `since` and `until` are dates, both inclusive.
+    """
+    events = models.EventLog.objects.filter(asset_id=asset_id)
+    if since:
+        events = events.filter(date__date__gte=since)
+    if until:
+        events = events.filter(date__date__lte=until)
+    rows = list(events.values(*FIELDS))
+    hot_ids = {row['id'] for row in rows}
+    archive = archive or EventArchive()
+    for row in archive.asset_events(asset_id, since, until):
+        if row['id'] not in hot_ids and (not since or timezone.localdate(row['date']) >= since) \
+                and (not until or timezone.localdate(row['date']) <= until):
+            rows.append(row)
+    rows.sort(key=lambda row: (row['date'], row['id']), reverse=True)
+    return rows
@@ -0,0 +1,163 @@
+import atexit
+import functools
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from assets import models
+
+
+class EventSink:
+    """
+    Buffer EventLog rows in memory and write them with one bulk_create.
+    Events added inside a transaction join the buffer when it commits and are dropped if it rolls back,
+    so the buffer only holds events of finished work. It is flushed when it holds EVENT_LOG_BUFFER_SIZE events,
+    when the oldest event is EVENT_LOG_BUFFER_SECONDS old (by the timer thread of start(), otherwise checked
+    on every add and at the end of every request) and when the process exits.
+    Automatic flushes never run inside a transaction, they would write the events into a transaction that isn't theirs.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.first_time = None
+        self.lock = threading.Lock()
+        self.timer = None
+        self.wakeup = threading.Event()
+
+    def add(self, event):
+        # The time it happened, not the time of the flush.
+        event.date = timezone.now()
+        if transaction.get_connection().in_atomic_block:
+            # Rolling back the transaction or the savepoint discards the callback, and the event with it.
+            transaction.on_commit(functools.partial(self._enqueue, event))
+        else:
+            self._enqueue(event)
+
+    def _enqueue(self, event):
+        max_size = getattr(settings, 'EVENT_LOG_BUFFER_SIZE', 100)
+        with self.lock:
+            first = not self.buffer
+            if first:
+                self.first_time = time.monotonic()
+            self.buffer.append(event)
+            full = len(self.buffer) >= max_size
+        if first:
+            self.wakeup.set()
+        if (full or self.expired()) and not transaction.get_connection().in_atomic_block:
+            self.flush()
+
+    def expired(self):
+        max_age = getattr(settings, 'EVENT_LOG_BUFFER_SECONDS', 2)
+        with self.lock:
+            return bool(self.buffer) and time.monotonic() - self.first_time >= max_age
+
+    def seconds_left(self):
+        max_age = getattr(settings, 'EVENT_LOG_BUFFER_SECONDS', 2)
+        with self.lock:
+            if not self.buffer:
+                return max_age
+            return max(0, self.first_time + max_age - time.monotonic())
+
+    def start(self):
+        """Flush on time from a background thread, with its own connection."""
+        with self.lock:
+            if self.timer is not None and self.timer.is_alive():
+                return
+            self.timer = threading.Thread(target=self._run_timer, name='cmdb-event-sink', daemon=True)
+            self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            self.wakeup.set()
+            timer.join()
+
+    def _run_timer(self):
+        try:
+            while self.timer is threading.current_thread():
+                self.wakeup.wait(self.seconds_left())
+                self.wakeup.clear()
+                if self.expired():
+                    self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Write the buffer now, call it outside of a transaction."""
+        with self.lock:
+            events, self.buffer = self.buffer, []
+        if not events:
+            return 0
+        try:
+            models.EventLog.objects.bulk_create(events)
+            return len(events)
+        except IntegrityError:
+            # Usually an event whose asset was rolled back; write the rest one by one and drop it.
+            return self._save_each(events)
+        except DatabaseError as e:
+            self._requeue(events)
+            print(e)
+            return 0
+
+    def _save_each(self, events):
+        saved = 0
+        for i, event in enumerate(events):
+            try:
+                with transaction.atomic():
+                    event.save()
+                saved += 1
+            except IntegrityError as e:
+                print(e)
+            except DatabaseError as e:
+                self._requeue(events[i:])
+                print(e)
+                break
+        return saved
+
+    def _requeue(self, events):
+        # Keep the events for the next flush, but don't grow without bound while the database is down.
+        with self.lock:
+            self.buffer = (events + self.buffer)[-10 * getattr(settings, 'EVENT_LOG_BUFFER_SIZE', 100):]
+            self.first_time = time.monotonic()
+
+
+sink = EventSink()
+
+
+@receiver(request_finished)
+def flush_expired(sender, **kwargs):
+    if sink.expired() and not transaction.get_connection().in_atomic_block:
+        sink.flush()
+
+
+def _flush_at_exit():
+    sink.stop()
+    try:
+        sink.flush()
+    except Exception as e:
+        print(e)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Unwind normally so the atexit flush runs.
+    raise SystemExit(0)
+
+
+def start_worker():
+    """
+    Called by the server entry points (CMDB.wsgi, CMDB.asgi): start the flush timer and, unless the server
+    has its own SIGTERM handling, exit on SIGTERM through the atexit flush.
+    """
+    sink.start()
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+
+atexit.register(_flush_at_exit)
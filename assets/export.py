@@ -0,0 +1,101 @@
+import csv
+import json
+
+from django.conf import settings
+
+from assets import models
+
+ASSET_FIELDS = {
+    'id': 'id',
+    'sn': 'sn',
+    'name': 'name',
+    'asset_type': 'asset_type',
+    'status': 'status',
+    'manage_ip': 'manage_ip',
+    'manufacturer': 'manufacturer__name',
+    'idc': 'idc__name',
+    'business_unit': 'business_unit__name',
+    'c_time': 'c_time',
+    'm_time': 'm_time',
+    'last_seen': 'last_seen',
+    'model': 'server__model',
+    'os_type': 'server__os_type',
+    'os_distribution': 'server__os_distribution',
+    'os_release': 'server__os_release',
+    'cpu_model': 'cpu__cpu_model',
+    'cpu_count': 'cpu__cpu_count',
+    'cpu_core_count': 'cpu__cpu_core_count',
+}
+
+COMPONENTS = (
+    ('ram', models.RAM, ('slot', 'sn', 'model', 'manufacturer', 'capacity')),
+    ('disk', models.Disk, ('sn', 'slot', 'model', 'manufacturer', 'capacity', 'interface_type')),
+    ('nic', models.NIC, ('name', 'model', 'mac', 'ip_address', 'net_mask', 'bonding')),
+)
+
+CSV_COLUMNS = list(ASSET_FIELDS) + ['ram_count', 'ram_capacity', 'disk_count', 'disk_capacity', 'macs', 'ip_addresses']
+
+
+def iter_chunks(chunk_size=None):
+    """
+    Lists of asset dicts with their components, chunk by chunk.
+    Assets are paged on id, each chunk costs one query for the assets and one per component table.
+    """
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 500)
+    last_id = 0
+    while True:
+        rows = list(models.Asset.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list(*ASSET_FIELDS.values())[:chunk_size])
+        if not rows:
+            return
+        assets = dict()
+        for row in rows:
+            asset = dict(zip(ASSET_FIELDS, row))
+            for key, _, _ in COMPONENTS:
+                asset[key] = []
+            assets[asset['id']] = asset
+        for key, model, fields in COMPONENTS:
+            components = model.objects.filter(asset_id__in=list(assets)).order_by('id').values_list('asset_id', *fields)
+            for row in components.iterator(chunk_size=2000):
+                assets[row[0]][key].append(dict(zip(fields, row[1:])))
+        yield list(assets.values())
+        last_id = rows[-1][0]
+
+
+def iter_assets(chunk_size=None):
+    for chunk in iter_chunks(chunk_size):
+        yield from chunk
+
+
+def ndjson_lines(chunk_size=None):
+    for chunk in iter_chunks(chunk_size):
+        yield ''.join(json.dumps(asset, ensure_ascii=False, default=str) + '\n' for asset in chunk)
+
+
+def csv_row(asset):
+    row = [asset[column] for column in ASSET_FIELDS]
+    row += [len(asset['ram']), sum(ram['capacity'] or 0 for ram in asset['ram']),
+            len(asset['disk']), sum(disk['capacity'] or 0 for disk in asset['disk']),
+            ';'.join(nic['mac'] for nic in asset['nic']),
+            ';'.join(nic['ip_address'] for nic in asset['nic'] if nic['ip_address'])]
+    return row
+
+
+class Echo:
+    """File-like object for csv.writer that hands back what it is given."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(chunk_size=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for chunk in iter_chunks(chunk_size):
+        yield ''.join(writer.writerow(csv_row(asset)) for asset in chunk)
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
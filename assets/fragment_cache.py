@@ -0,0 +1,179 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from assets import models
+
+lock = threading.Lock()
+local = threading.local()
+hits = 0
+misses = 0
+
+GLOBAL_GENERATION = 'asset-fragment-gen'
+# Bumped with every asset generation, so the index ETag notices component edits without reading every asset's.
+INDEX_GENERATION = 'asset-fragment-gen:index'
+
+
+def cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'fragments')]
+
+
+def generation_key(asset_id):
+    return 'asset-fragment-gen:%s' % asset_id
+
+
+def generations(asset_id=None):
+    """(global generation, asset generation), also part of the conditional GET validators of the views."""
+    keys = [GLOBAL_GENERATION] + ([generation_key(asset_id)] if asset_id is not None else [])
+    values = cache().get_many(keys)
+    return values.get(GLOBAL_GENERATION, 0), values.get(generation_key(asset_id), 0) if asset_id is not None else 0
+
+
+def index_generations():
+    """(global generation, index generation), part of the conditional GET validator of the asset index."""
+    values = cache().get_many([GLOBAL_GENERATION, INDEX_GENERATION])
+    return values.get(GLOBAL_GENERATION, 0), values.get(INDEX_GENERATION, 0)
+
+
+def fragment_key(name, asset):
+    return 'asset-fragment:%s:%s:%s' % (name, asset.id, asset.m_time.timestamp() if asset.m_time else 0)
+
+
+def timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600)
+
+
+class Page:
+    """
+    The fragments of a page of assets: read with one get_many, the misses written back with one set_many by save().
+    Fragments are keyed on the asset's id and m_time and stored with the generations they were rendered under,
+    a fragment from before invalidate() or invalidate_all() is a miss. So the generations and the fragments
+    are read together, not one after the other.
+    """
+
+    def __init__(self, name, assets):
+        self.name = name
+        keys = [GLOBAL_GENERATION]
+        for asset in assets:
+            keys += [generation_key(asset.id), fragment_key(name, asset)]
+        self.values = cache().get_many(keys)
+        self.pending = dict()
+
+    def get_or_render(self, asset, render):
+        global hits, misses
+        key = fragment_key(self.name, asset)
+        current = (self.values.get(GLOBAL_GENERATION, 0), self.values.get(generation_key(asset.id), 0))
+        cached = self.values.get(key)
+        hit = cached is not None and tuple(cached[:2]) == current
+        with lock:
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+        if hit:
+            return cached[2]
+        content = render()
+        self.pending[key] = current + (content,)
+        return content
+
+    def save(self):
+        if self.pending:
+            cache().set_many(self.pending, timeout())
+            self.pending = dict()
+
+
+def get_or_render(name, asset, render):
+    """The cached fragment of one asset, rendered with render() on a miss. One cache read, one write on a miss."""
+    page = Page(name, [asset])
+    content = page.get_or_render(asset, render)
+    page.save()
+    return content
+
+
+def invalidate(asset_id):
+    """Drop the fragments of one asset after a change that doesn't touch its m_time."""
+    generation = time.time_ns()
+    cache().set_many({generation_key(asset_id): generation, INDEX_GENERATION: generation}, None)
+
+
+def touch(*asset_ids):
+    """
+    Drop the fragments of the assets and move their m_time: fragments are keyed on it, so other processes,
+    which don't see this process's generations with the locmem backend, drop theirs too.
+    """
+    for asset_id in asset_ids:
+        invalidate(asset_id)
+    models.Asset.objects.filter(pk__in=asset_ids).update(m_time=timezone.now())
+
+
+@contextmanager
+def asset_saved_after():
+    """Component saves in this block don't touch the asset: the block ends with a save of the asset itself."""
+    local.depth = getattr(local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        local.depth -= 1
+
+
+def invalidate_all():
+    cache().set(GLOBAL_GENERATION, time.time_ns(), None)
+
+
+def stats():
+    with lock:
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 3) if total else None,
+                'backend': cache().__class__.__name__}
+
+
+@receiver(post_save, sender=models.Server)
+@receiver(post_save, sender=models.NetworkDevice)
+@receiver(post_save, sender=models.StorageDevice)
+@receiver(post_save, sender=models.SecurityDevice)
+@receiver(post_save, sender=models.CPU)
+@receiver(post_save, sender=models.RAM)
+@receiver(post_save, sender=models.Disk)
+@receiver(post_save, sender=models.NIC)
+def component_changed(sender, instance, **kwargs):
+    # No post_delete receivers here: they would stop UpdateAsset's component deletes from being
+    # single DELETE queries. Those are followed by an asset save anyway, the admin touches its own deletes.
+    if getattr(local, 'depth', 0):
+        invalidate(instance.asset_id)
+    else:
+        touch(instance.asset_id)
+
+
+@receiver(m2m_changed, sender=models.Asset.tags.through)
+def tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # Tags are part of the asset, touching m_time also moves the validators of the index and detail pages.
+    if not reverse:
+        touch(instance.pk)
+    elif pk_set:
+        touch(*pk_set)
+    else:
+        # tag.asset_set.clear()
+        invalidate_all()
+
+
+@receiver(post_save, sender=models.Tag)
+@receiver(post_delete, sender=models.Tag)
+@receiver(post_save, sender=models.IDC)
+@receiver(post_delete, sender=models.IDC)
+@receiver(post_save, sender=models.BusinessUnit)
+@receiver(post_delete, sender=models.BusinessUnit)
+@receiver(post_save, sender=models.Manufacturer)
+@receiver(post_delete, sender=models.Manufacturer)
+@receiver(post_save, sender=models.Contract)
+@receiver(post_delete, sender=models.Contract)
+def shared_object_changed(sender, instance, **kwargs):
+    # Shown by name on many assets, these change rarely.
+    invalidate_all()
@@ -0,0 +1,52 @@
+import heapq
+import ipaddress
+from itertools import groupby
+
+from django.db.models import Q
+
+from assets import models
+
+
+def cidr_range(cidr):
+    """(first key, last key) of a CIDR like 10.20.0.0/16 or 2001:db8::/32. Raises ValueError for bad input."""
+    network = ipaddress.ip_network(cidr, strict=False)
+    return models.ip_key(str(network.network_address)), models.ip_key(str(network.broadcast_address))
+
+
+def nics_in(cidr, limit=None):
+    low, high = cidr_range(cidr)
+    nics = models.NIC.objects.filter(ip_key__gte=low, ip_key__lte=high).order_by('ip_key', 'id')
+    nics = nics.values('id', 'asset_id', 'asset__sn', 'asset__name', 'name', 'mac', 'ip_address')
+    return list(nics[:limit] if limit else nics)
+
+
+def assets_in(cidr, limit=None):
+    """Assets with the management IP or any NIC address in the subnet."""
+    low, high = cidr_range(cidr)
+    nic_assets = models.NIC.objects.filter(ip_key__gte=low, ip_key__lte=high).values('asset_id')
+    assets = models.Asset.objects.filter(
+        Q(manage_ip_key__gte=low, manage_ip_key__lte=high) | Q(id__in=nic_assets)
+    ).order_by('id').values('id', 'sn', 'name', 'asset_type', 'manage_ip')
+    return list(assets[:limit] if limit else assets)
+
+
+def conflicts():
+    """
+    Addresses used by more than one asset, from NICs and management IPs.
+    Both sources are read sorted on the indexed key and merged in one pass.
+    """
+    nics = (models.NIC.objects.exclude(ip_key=None).order_by('ip_key')
+            .values_list('ip_key', 'ip_address', 'asset_id', 'asset__sn', 'mac').iterator())
+    managed = ((key, ip, asset_id, sn, None) for key, ip, asset_id, sn in
+               models.Asset.objects.exclude(manage_ip_key=None).order_by('manage_ip_key')
+               .values_list('manage_ip_key', 'manage_ip', 'id', 'sn').iterator())
+    results = []
+    for key, rows in groupby(heapq.merge(nics, managed, key=lambda row: row[0]), key=lambda row: row[0]):
+        rows = list(rows)
+        if len({row[2] for row in rows}) < 2:
+            continue
+        results.append({
+            'ip_address': rows[0][1],
+            'assets': [{'id': asset_id, 'sn': sn, 'mac': mac} for _, _, asset_id, sn, mac in rows],
+        })
+    return results
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from assets import models
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping with hit and miss counters.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# sn -> (asset id, last report hash) of approved assets
+assets = LRUCache(getattr(settings, 'LOOKUP_CACHE_SIZE', 10000))
+# manufacturer name -> manufacturer id
+manufacturers = LRUCache(getattr(settings, 'LOOKUP_CACHE_SIZE', 10000))
+
+
+def asset_for_sn(sn):
+    """
+    (asset id, last report hash) of the approved asset with this SN, or None.
+    Only hits are cached, an unknown SN always asks the database.
+    Callers must still filter on the SN when using the id, the entry may be stale in other processes.
+    """
+    entry = assets.get(sn)
+    if entry is None:
+        entry = models.Asset.objects.filter(sn=sn).values_list('id', 'report_hash').first()
+        if entry is not None:
+            assets.set(sn, tuple(entry))
+    return entry
+
+
+def forget_asset(sn):
+    assets.delete(sn)
+
+
+def manufacturer_id(name):
+    pk = manufacturers.get(name)
+    if pk is None:
+        manufacturer_obj, _ = models.Manufacturer.objects.get_or_create(name=name)
+        pk = manufacturer_obj.pk
+        # Inside a transaction the row may have been created by it and still be rolled back,
+        # so only cache once committed (right away in autocommit).
+        transaction.on_commit(lambda: manufacturers.set(name, pk))
+    return pk
+
+
+def clear():
+    assets.clear()
+    manufacturers.clear()
+
+
+def stats():
+    return {'assets': assets.stats(), 'manufacturers': manufacturers.stats()}
+
+
+@receiver(post_save, sender=models.Asset)
+@receiver(post_delete, sender=models.Asset)
+def asset_changed(sender, instance, **kwargs):
+    assets.delete(instance.sn)
+
+
+@receiver(post_save, sender=models.Manufacturer)
+@receiver(post_delete, sender=models.Manufacturer)
+def manufacturer_changed(sender, instance, **kwargs):
+    # A rename leaves the old name behind, manufacturers change rarely so drop them all.
+    manufacturers.clear()
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from assets import event_archive
+
+
+class Command(BaseCommand):
+    help = 'Move old EventLog rows into the compressed, date partitioned archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Keep this many days in the table.')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        before = None
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        moved = event_archive.archive_events(before=before, chunk_size=options['chunk_size'])
+        self.stdout.write('%s events archived' % moved)
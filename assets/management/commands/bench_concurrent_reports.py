@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from assets import db_writer
+from assets import event_sink
+from assets import lookup_cache
+from assets import models
+from assets import search_index
+from assets import views
+
+
+def bench_report(sn, round_number):
+    """A full report of a bench server, its RAM and disks change every round so the update is never skipped."""
+    count = round_number % 3 + 1
+    return {
+        'asset_type': 'server',
+        'sn': sn,
+        'manufacturer': 'Dell Inc.',
+        'model': 'PowerEdge R740',
+        'os_type': 'Linux',
+        'os_distribution': 'Ubuntu',
+        'os_release': 'Ubuntu 22.04 LTS',
+        'cpu_model': 'Intel(R) Xeon(R) Gold 6230',
+        'cpu_count': 2,
+        'cpu_core_count': 40,
+        'ram_size': 16 * count,
+        'ram': [{'slot': 'A%s' % i, 'capacity': 16, 'model': 'DDR4', 'sn': 'RAM-%s-%s' % (sn, i)}
+                for i in range(count)],
+        'physical_disk_driver': [{'slot': str(i), 'sn': 'DISK-%s-%s' % (sn, i), 'model': 'ST4000',
+                                  'capacity': 4000, 'interface_type': 'SAS'} for i in range(count)],
+        'nic': [{'name': 'eth0', 'model': 'Intel X710', 'mac': '00:11:22:33:44:55', 'ip_address': '10.0.0.1',
+                 'net_mask': ['255.255.255.0']}],
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent reporters and dashboard/index readers against scratch databases, '
+            'once with the default SQLite settings and once with the production profile. Nothing is kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reporters', type=int, default=8)
+        parser.add_argument('--reports', type=int, default=25, help='Reports sent by each reporter.')
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--assets', type=int, default=50)
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('default', {'SQLITE_PRAGMAS': {}, 'SQLITE_WRITE_QUEUE': False, 'SQLITE_WRITE_RETRIES': 0}),
+            ('production', {'SQLITE_PRAGMAS': settings.SQLITE_PRODUCTION_PRAGMAS, 'SQLITE_WRITE_QUEUE': True,
+                            'SQLITE_WRITE_RETRIES': 3}),
+        )
+        settings_dict = connections['default'].settings_dict
+        old_name = settings_dict['NAME']
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            template = os.path.join(tmp_dir, 'template.sqlite3')
+            with override_settings(SQLITE_PRAGMAS={}):
+                self.use_database(template)
+                call_command('migrate', verbosity=0)
+                sns = self.seed(options['assets'])
+                self.finish_round()
+            for label, profile in profiles:
+                path = os.path.join(tmp_dir, '%s.sqlite3' % label)
+                shutil.copy(template, path)
+                with override_settings(**profile):
+                    self.use_database(path)
+                    db_writer.stats.reset()
+                    result = self.run_round(sns, options['reporters'], options['reports'], options['readers'])
+                    db_writer.writer.stop()
+                    self.finish_round()
+                self.report(label, result)
+        finally:
+            connections.close_all()
+            settings_dict['NAME'] = old_name
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def use_database(self, path):
+        # Every thread's connection is created from this dict, so new connections open the scratch file.
+        connections.close_all()
+        connections['default'].settings_dict['NAME'] = path
+
+    def finish_round(self):
+        # Write buffered events and index documents to the scratch database and forget its ids.
+        event_sink.sink.flush()
+        search_index.indexer.flush()
+        lookup_cache.clear()
+        connections.close_all()
+
+    def seed(self, count):
+        sns = ['BENCH-%s' % i for i in range(count)]
+        for sn in sns:
+            asset = models.Asset.objects.create(asset_type='server', name='bench: %s' % sn, sn=sn)
+            models.Server.objects.create(asset=asset)
+            models.CPU.objects.create(asset=asset)
+        return sns
+
+    def run_round(self, sns, reporter_count, report_count, reader_count):
+        factory = RequestFactory()
+        lock = threading.Lock()
+        result = {'ok': 0, 'failed': 0, 'errors': {}, 'reads': [], 'read_errors': 0}
+        done = threading.Event()
+
+        def failed(key, error):
+            with lock:
+                result[key] += 1
+                message = str(error)[:60]
+                result['errors'][message] = result['errors'].get(message, 0) + 1
+
+        def reporter(number):
+            try:
+                for i in range(report_count):
+                    sn = sns[(number * report_count + i) % len(sns)]
+                    request = factory.post('/assets/report/', {'asset_data': json.dumps(bench_report(sn, i))})
+                    request.user = AnonymousUser()
+                    try:
+                        response = views.report(request)
+                    except Exception as e:
+                        failed('failed', e)
+                        continue
+                    if response.status_code == 200:
+                        with lock:
+                            result['ok'] += 1
+                    else:
+                        failed('failed', response.content.decode())
+            finally:
+                connection.close()
+
+        def reader(number):
+            view = views.index if number % 2 else views.dashboard
+            try:
+                while not done.is_set():
+                    start = time.perf_counter()
+                    try:
+                        view(factory.get('/assets/'))
+                    except Exception as e:
+                        failed('read_errors', e)
+                        continue
+                    with lock:
+                        result['reads'].append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        readers = [threading.Thread(target=reader, args=(i,)) for i in range(reader_count)]
+        reporters = [threading.Thread(target=reporter, args=(i,)) for i in range(reporter_count)]
+        start = time.perf_counter()
+        for thread in readers + reporters:
+            thread.start()
+        for thread in reporters:
+            thread.join()
+        result['elapsed'] = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+        result['stats'] = db_writer.stats.as_dict()
+        return result
+
+    def report(self, label, result):
+        reads = result['reads']
+        stats = result['stats']
+        self.stdout.write(
+            '%-10s reports: %d ok, %d failed in %.2fs (%.0f/s) | reads: %d, p50 %.1fms, p95 %.1fms, max %.1fms, '
+            '%d failed | retries %d, lock wait %.3fs, queue wait %.3fs' % (
+                label, result['ok'], result['failed'], result['elapsed'], result['ok'] / result['elapsed'],
+                len(reads), percentile(reads, 0.5) * 1000, percentile(reads, 0.95) * 1000,
+                max(reads, default=0) * 1000, result['read_errors'],
+                stats['retries'], stats['lock_wait'], stats['queue_wait']))
+        for message, count in sorted(result['errors'].items(), key=lambda item: -item[1]):
+            self.stdout.write('           %5d x %s' % (count, message))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from assets import event_sink
+from assets import models
+
+
+class Command(BaseCommand):
+    help = 'Compare writing EventLog rows one by one with the buffered event sink. The rows are deleted afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['events']
+        start_id = (models.EventLog.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        try:
+            start = time.perf_counter()
+            for i in range(count):
+                models.EventLog(name='bench', detail='save %s' % i).save()
+            self.report('save()', count, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for i in range(count):
+                event_sink.sink.add(models.EventLog(name='bench', detail='sink %s' % i))
+            event_sink.sink.flush()
+            self.report('sink', count, time.perf_counter() - start)
+        finally:
+            models.EventLog.objects.filter(id__gte=start_id, name='bench').delete()
+
+    def report(self, label, count, elapsed):
+        self.stdout.write('%-8s %d events in %.3fs, %.0f events/s' % (label, count, elapsed, count / elapsed))
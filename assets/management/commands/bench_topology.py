@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from assets import models
+from assets import topology
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time the topology queries on a synthetic fleet of hypervisors and VMs. Nothing is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vms', type=int, default=100000)
+        parser.add_argument('--hosts', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['vms'], options['hosts'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, vm_count, host_count):
+        start = time.perf_counter()
+        # A blade chassis hosting every hypervisor, the VMs spread over the hypervisors.
+        chassis = models.Asset.objects.create(asset_type='server', name='bench: chassis', sn='BENCH-CHASSIS')
+        chassis_server = models.Server.objects.create(asset=chassis)
+        models.Asset.objects.bulk_create(
+            [models.Asset(asset_type='server', name='bench: host %s' % i, sn='BENCH-HOST-%s' % i)
+             for i in range(host_count)] +
+            [models.Asset(asset_type='server', name='bench: vm %s' % i, sn='BENCH-VM-%s' % i)
+             for i in range(vm_count)], batch_size=5000)
+        ids = dict(models.Asset.objects.filter(sn__startswith='BENCH-').values_list('sn', 'id'))
+        models.Server.objects.bulk_create(
+            [models.Server(asset_id=ids['BENCH-HOST-%s' % i], hosted_on=chassis_server, sub_asset_type=1)
+             for i in range(host_count)], batch_size=5000)
+        host_servers = list(models.Server.objects.filter(hosted_on=chassis_server).values_list('id', flat=True))
+        models.Server.objects.bulk_create(
+            [models.Server(asset_id=ids['BENCH-VM-%s' % i], hosted_on_id=host_servers[i % host_count])
+             for i in range(vm_count)], batch_size=5000)
+        models.CPU.objects.bulk_create([models.CPU(asset_id=asset_id, cpu_core_count=4) for asset_id in ids.values()],
+                                       batch_size=5000)
+        self.stdout.write('fleet of %s servers built in %.1fs' % (len(ids), time.perf_counter() - start))
+
+        for label, func in (('blast radius', topology.blast_radius), ('subtree', topology.subtree)):
+            start = time.perf_counter()
+            result = func(chassis.id)
+            self.stdout.write('%-12s %d servers in %.3fs' % (label, len(result), time.perf_counter() - start))
+        vm_id = ids['BENCH-VM-%s' % (vm_count - 1)]
+        start = time.perf_counter()
+        chain = topology.hosts(vm_id)
+        self.stdout.write('%-12s %d servers in %.3fs' % ('hosts', len(chain), time.perf_counter() - start))
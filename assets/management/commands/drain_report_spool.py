@@ -0,0 +1,52 @@
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from assets import spool
+
+
+def worker(batch_size, once, idle_sleep):
+    report_spool = spool.ReportSpool()
+    while True:
+        try:
+            processed = spool.drain_batch(report_spool, batch_size)
+        except Exception as e:
+            print(e)
+            processed = 0
+            time.sleep(idle_sleep)
+        if not processed:
+            if once:
+                break
+            time.sleep(idle_sleep)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Drain the report spool into the CMDB database with a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'REPORT_SPOOL_WORKERS', 2))
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'REPORT_SPOOL_BATCH_SIZE', 200))
+        parser.add_argument('--once', action='store_true', help='Exit when the spool is empty.')
+        parser.add_argument('--idle-sleep', type=float, default=1.0)
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Put the dead letters back in the spool first, once their cause is fixed.')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            self.stdout.write('%s dead letters requeued' % spool.ReportSpool().requeue_dead())
+        worker_args = (options['batch_size'], options['once'], options['idle_sleep'])
+        if options['workers'] <= 1:
+            worker(*worker_args)
+        else:
+            # Forked workers must not share the parent's database connection.
+            connections.close_all()
+            processes = [multiprocessing.Process(target=worker, args=worker_args) for _ in range(options['workers'])]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+        self.stdout.write('Spool: %s' % spool.ReportSpool().stats())
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from assets import export
+
+
+class Command(BaseCommand):
+    help = 'Write every asset with its components as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--output', help='File to write, standard output by default.')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        lines, _ = export.FORMATS[options['format']]
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                for text in lines(options['chunk_size']):
+                    f.write(text)
+        else:
+            for text in lines(options['chunk_size']):
+                self.stdout.write(text, ending='')
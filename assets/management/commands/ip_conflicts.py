@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from assets import ip_index
+
+
+class Command(BaseCommand):
+    help = 'List IP addresses used by more than one asset, on NICs or as management IP.'
+
+    def handle(self, *args, **options):
+        conflicts = ip_index.conflicts()
+        for conflict in conflicts:
+            self.stdout.write('%s: %s' % (conflict['ip_address'], ', '.join(
+                '%s%s' % (asset['sn'], ' (%s)' % asset['mac'] if asset['mac'] else '') for asset in conflict['assets'])))
+        self.stdout.write('%s conflicting addresses' % len(conflicts))
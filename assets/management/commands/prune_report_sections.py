@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from assets import report_payload
+
+
+class Command(BaseCommand):
+    help = 'Delete report sections no longer used by the new asset approval zone.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('%s sections deleted' % report_payload.prune_sections())
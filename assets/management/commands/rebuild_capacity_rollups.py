@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from assets import capacity_rollups
+
+
+class Command(BaseCommand):
+    help = 'Verify the capacity rollups against the component tables and rebuild them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drift, leave the rollups alone.')
+
+    def handle(self, *args, **options):
+        drift = capacity_rollups.rebuild(check_only=options['check'])
+        for (idc_id, business_unit_id), stored, expected in drift:
+            self.stdout.write('IDC %s, business unit %s: %s' % (idc_id, business_unit_id, ', '.join(
+                '%s %s -> %s' % (name, stored[name], expected[name]) for name in capacity_rollups.TOTALS)))
+        if options['check']:
+            self.stdout.write('%s groups drifted' % len(drift))
+        else:
+            self.stdout.write('%s groups drifted, rollups rebuilt' % len(drift))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from assets import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the asset search index from the asset and component tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = search_index.rebuild(options['chunk_size'])
+        self.stdout.write('%s assets indexed' % count)
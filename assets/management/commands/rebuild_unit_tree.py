@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from assets import unit_tree
+
+
+class Command(BaseCommand):
+    help = 'Verify the business unit closure table against parent_unit and rebuild it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drift, leave the closure alone.')
+
+    def handle(self, *args, **options):
+        drift = unit_tree.rebuild(check_only=options['check'])
+        for ancestor_id, descendant_id, stored, expected in drift:
+            self.stdout.write('Business unit %s above %s: depth %s -> %s' % (
+                ancestor_id, descendant_id, stored, expected))
+        if options['check']:
+            self.stdout.write('%s links drifted' % len(drift))
+        else:
+            self.stdout.write('%s links drifted, closure rebuilt' % len(drift))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from assets import dashboard_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the dashboard counters from the asset table, fixing drift from bulk updates.'
+
+    def handle(self, *args, **options):
+        before = dashboard_counters.totals()
+        rows = dashboard_counters.rebuild()
+        after = dashboard_counters.totals()
+        drift = {key: after.get(key, 0) - before.get(key, 0) for key in set(before) | set(after)
+                 if after.get(key, 0) != before.get(key, 0)}
+        for (asset_type, status), delta in sorted(drift.items()):
+            self.stdout.write('%s status %s: %+d' % (asset_type, status, delta))
+        self.stdout.write('%s counter rows rebuilt' % rows)
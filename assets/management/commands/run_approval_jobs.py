@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from assets import asset_handler
+from assets import models
+
+
+class Command(BaseCommand):
+    help = 'Run pending bulk approval jobs, and jobs whose worker stopped reporting progress.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=30)
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        jobs = models.ApprovalJob.objects.filter(Q(status='pending') | Q(status='running', m_time__lt=stale))
+        for job_id in jobs.order_by('id').values_list('id', flat=True):
+            # The job is claimed again with the same cutoff, a worker that picked it up since then keeps it.
+            # Approved assets have left the approval zone, a rerun only picks up the rest.
+            if not asset_handler.run_approval_job(job_id, stale_before=stale):
+                self.stdout.write('ApprovalJob %s: taken by another worker' % job_id)
+                continue
+            job = models.ApprovalJob.objects.get(pk=job_id)
+            self.stdout.write('%s: %s, %s approved, %s failed' % (job, job.status, job.approved, job.failed))
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0002_rename_apprived_newassetapprovalzone_approved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last Report Time'),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='report_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Last Report Hash'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('assets', '0003_asset_report_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='Job Status')),
+                ('new_asset_ids', models.TextField(verbose_name='New Asset IDs')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total')),
+                ('approved', models.PositiveIntegerField(default=0, verbose_name='Approved')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed')),
+                ('memo', models.TextField(blank=True, null=True, verbose_name='Memo')),
+                ('c_time', models.DateTimeField(auto_now_add=True, verbose_name='Job create time')),
+                ('m_time', models.DateTimeField(auto_now=True, verbose_name='Job update time')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Approved By')),
+            ],
+            options={
+                'verbose_name': 'Approval Job',
+                'verbose_name_plural': 'Approval Jobs',
+                'ordering': ['-c_time'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0004_approvaljob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='history_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='History Version'),
+        ),
+        migrations.CreateModel(
+            name='AssetHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(verbose_name='Version')),
+                ('kind', models.CharField(choices=[('snapshot', 'Snapshot'), ('delta', 'Delta')], max_length=16, verbose_name='Kind')),
+                ('data', models.TextField(verbose_name='Data')),
+                ('time', models.DateTimeField(verbose_name='Change Time')),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='assets.asset')),
+            ],
+            options={
+                'verbose_name': 'Asset History',
+                'verbose_name_plural': 'Asset History',
+                'unique_together': {('asset', 'version')},
+                'index_together': {('asset', 'time')},
+            },
+        ),
+    ]
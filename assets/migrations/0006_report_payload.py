@@ -0,0 +1,67 @@
+import json
+
+from django.db import migrations, models
+
+
+def pack_reports(apps, schema_editor):
+    from assets.report_payload import pack
+
+    NewAssetApprovalZone = apps.get_model('assets', 'NewAssetApprovalZone')
+    ReportSection = apps.get_model('assets', 'ReportSection')
+    for new_asset in NewAssetApprovalZone.objects.only('id', 'data').iterator():
+        try:
+            data = json.loads(new_asset.data)
+        except ValueError:
+            data = {}
+        payload, sections = pack(data)
+        ReportSection.objects.bulk_create([ReportSection(digest=digest, data=section)
+                                           for digest, section in sections.items()], ignore_conflicts=True)
+        NewAssetApprovalZone.objects.filter(pk=new_asset.pk).update(payload=payload)
+
+
+def unpack_reports(apps, schema_editor):
+    from assets.report_payload import manifest, refs, unpack
+
+    NewAssetApprovalZone = apps.get_model('assets', 'NewAssetApprovalZone')
+    ReportSection = apps.get_model('assets', 'ReportSection')
+    for new_asset in NewAssetApprovalZone.objects.only('id', 'payload').iterator():
+        data = manifest(new_asset.payload)
+        data = unpack(data, ReportSection.objects.in_bulk(refs(data)))
+        NewAssetApprovalZone.objects.filter(pk=new_asset.pk).update(data=json.dumps(data))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0005_asset_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSection',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA256')),
+                ('data', models.BinaryField(verbose_name='Section Data')),
+            ],
+            options={
+                'verbose_name': 'Report Section',
+                'verbose_name_plural': 'Report Sections',
+            },
+        ),
+        migrations.AddField(
+            model_name='newassetapprovalzone',
+            name='payload',
+            field=models.BinaryField(default=b'', verbose_name='Asset Data'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='newassetapprovalzone',
+            name='data',
+            field=models.TextField(default='{}', verbose_name='Asset Data'),
+        ),
+        migrations.RunPython(pack_reports, unpack_reports),
+        migrations.RemoveField(
+            model_name='newassetapprovalzone',
+            name='data',
+        ),
+    ]
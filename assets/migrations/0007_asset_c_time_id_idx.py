@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0006_report_payload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['c_time', 'id'], name='asset_c_time_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:27
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_assets(apps, schema_editor):
+    Asset = apps.get_model('assets', 'Asset')
+    AssetCounter = apps.get_model('assets', 'AssetCounter')
+    rows = Asset.objects.values('asset_type', 'status', 'idc_id', 'business_unit_id').annotate(n=Count('id')).order_by()
+    AssetCounter.objects.bulk_create([
+        AssetCounter(asset_type=row['asset_type'], status=row['status'], idc_id=row['idc_id'] or 0,
+                     business_unit_id=row['business_unit_id'] or 0, count=row['n']) for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0007_asset_c_time_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_type', models.CharField(max_length=64, verbose_name='Asset Type')),
+                ('status', models.SmallIntegerField(verbose_name='Asset Status')),
+                ('idc_id', models.IntegerField(default=0, verbose_name='IDC ID')),
+                ('business_unit_id', models.IntegerField(default=0, verbose_name='Business Unit ID')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+            ],
+            options={
+                'verbose_name': 'Asset Counter',
+                'verbose_name_plural': 'Asset Counters',
+                'unique_together': {('asset_type', 'status', 'idc_id', 'business_unit_id')},
+            },
+        ),
+        migrations.RunPython(count_assets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+# The table as it was at this migration, not as assets.search_index has it now.
+CREATE_SQL = ("CREATE VIRTUAL TABLE IF NOT EXISTS assets_search "
+              "USING fts5(sn, name, model, network, components, tokenize='trigram')")
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    Asset = apps.get_model('assets', 'Asset')
+    if Asset.objects.exists():
+        # Only sn and name here, `python manage.py rebuild_search_index` adds the components.
+        schema_editor.execute('INSERT INTO assets_search (rowid, sn, name) SELECT id, sn, name FROM assets_asset')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS assets_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0008_assetcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
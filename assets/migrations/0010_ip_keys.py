@@ -0,0 +1,35 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+from assets.models import ip_key
+
+
+def fill_ip_keys(apps, schema_editor):
+    Asset = apps.get_model('assets', 'Asset')
+    NIC = apps.get_model('assets', 'NIC')
+    for model, field, key_field in ((Asset, 'manage_ip', 'manage_ip_key'), (NIC, 'ip_address', 'ip_key')):
+        rows = model.objects.exclude(**{field: None}).values_list('id', field)
+        for pk, value in rows.iterator():
+            model.objects.filter(pk=pk).update(**{key_field: ip_key(value)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0009_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='manage_ip_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, null=True, verbose_name='IP Management Key'),
+        ),
+        migrations.AddField(
+            model_name='nic',
+            name='ip_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, null=True, verbose_name='IP Address Key'),
+        ),
+        migrations.RunPython(fill_ip_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:41
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_rollups(apps, schema_editor):
+    CapacityRollup = apps.get_model('assets', 'CapacityRollup')
+    totals = dict()
+    for model_name, name, field in (('RAM', 'ram', 'capacity'), ('Disk', 'disk', 'capacity'),
+                                    ('CPU', 'cores', 'cpu_core_count')):
+        rows = apps.get_model('assets', model_name).objects.values('asset__idc_id', 'asset__business_unit_id') \
+            .annotate(total=Sum(field)).order_by()
+        for row in rows:
+            group = (row['asset__idc_id'] or 0, row['asset__business_unit_id'] or 0)
+            totals.setdefault(group, {'ram': 0, 'disk': 0, 'cores': 0})[name] += row['total'] or 0
+    CapacityRollup.objects.bulk_create([CapacityRollup(idc_id=idc_id, business_unit_id=business_unit_id, **values)
+                                        for (idc_id, business_unit_id), values in totals.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0010_ip_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapacityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idc_id', models.IntegerField(default=0, verbose_name='IDC ID')),
+                ('business_unit_id', models.IntegerField(default=0, verbose_name='Business Unit ID')),
+                ('ram', models.BigIntegerField(default=0, verbose_name='RAM Capacity(GB)')),
+                ('disk', models.FloatField(default=0, verbose_name='Disk Capacity(GB)')),
+                ('cores', models.BigIntegerField(default=0, verbose_name='CPU Cores')),
+            ],
+            options={
+                'verbose_name': 'Capacity Rollup',
+                'verbose_name_plural': 'Capacity Rollups',
+                'unique_together': {('idc_id', 'business_unit_id')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_closure(apps, schema_editor):
+    BusinessUnit = apps.get_model('assets', 'BusinessUnit')
+    BusinessUnitClosure = apps.get_model('assets', 'BusinessUnitClosure')
+    parents = dict(BusinessUnit.objects.values_list('id', 'parent_unit_id'))
+    rows = []
+    for unit_id in parents:
+        ancestor_id, depth, seen = unit_id, 0, set()
+        while ancestor_id and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append(BusinessUnitClosure(ancestor_id=ancestor_id, descendant_id=unit_id, depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    BusinessUnitClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0011_capacityrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusinessUnitClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(default=0, verbose_name='Depth')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='assets.businessunit')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='assets.businessunit')),
+            ],
+            options={
+                'verbose_name': 'Business Unit Closure',
+                'verbose_name_plural': 'Business Unit Closure',
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(fill_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0012_businessunitclosure'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventlog',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Event Time'),
+        ),
+        migrations.AlterField(
+            model_name='newassetapprovalzone',
+            name='c_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Asset create time'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['asset_type', 'status'], name='asset_type_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventlog',
+            index=models.Index(fields=['event_type', 'date'], name='eventlog_type_date_idx'),
+        ),
+    ]
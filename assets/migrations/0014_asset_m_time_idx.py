@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0013_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['m_time'], name='asset_m_time_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0014_asset_m_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportsection',
+            name='m_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last stored'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 22:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0015_reportsection_m_time'),
+    ]
+
+    operations = [
+        # Only the Python default changes, the column stays as it is: SQLite would rebuild the whole event log.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='eventlog',
+                name='date',
+                field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False,
+                                           verbose_name='Event Time'),
+            ),
+        ]),
+    ]
@@ -1,10 +1,43 @@
+import ipaddress
+
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def ip_key(value):
+    """
+    Sortable fixed-width key of an IP address: its 128-bit value as 32 hex digits, IPv4 mapped into ::ffff:0:0/96.
+    Range scans on the key select subnets. None for empty or invalid addresses.
+    """
+    if not value:
+        return None
+    try:
+        ip = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    number = int(ip) + (0xffff << 32 if ip.version == 4 else 0)
+    return '%032x' % number
 
 
 # Create your models here.
 
 
+class ReportSection(models.Model):
+    """A compressed component list of a new asset's report less its serials, shared by every report with the same list."""
+    digest = models.CharField('SHA256', max_length=64, primary_key=True)
+    data = models.BinaryField('Section Data')
+    m_time = models.DateTimeField('Last stored', default=timezone.now)
+
+    def __str__(self):
+        return self.digest
+
+    class Meta:
+        verbose_name = 'Report Section'
+        verbose_name_plural = 'Report Sections'
+
+
 class Asset(models.Model):
     asset_type_choice = (
         ('server', 'Server'),
@@ -32,6 +65,8 @@ class Asset(models.Model):
     manufacturer = models.ForeignKey('Manufacturer', null=True, blank=True, verbose_name='Manufacturer',
                                      on_delete=models.SET_NULL)
     manage_ip = models.GenericIPAddressField(null=True, blank=True, verbose_name='IP Management')
+    manage_ip_key = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True,
+                                     verbose_name='IP Management Key')
     tags = models.ManyToManyField('Tag', blank=True, verbose_name='Tag')
     admin = models.ForeignKey(User, null=True, verbose_name='Asset Administrator', related_name='admin',
                               on_delete=models.SET_NULL)
@@ -48,14 +83,28 @@ class Asset(models.Model):
     memo = models.TextField(null=True, blank=True, verbose_name='Memo')
     c_time = models.DateTimeField(auto_now_add=True, verbose_name='Approved Date')
     m_time = models.DateTimeField(auto_now=True, verbose_name='Updated Date')
+    report_hash = models.CharField(max_length=64, null=True, blank=True, editable=False,
+                                   verbose_name='Last Report Hash')
+    last_seen = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Last Report Time')
+    history_version = models.PositiveIntegerField(default=0, editable=False, verbose_name='History Version')
 
     def __str__(self):
         return '<%s> %s' % (self.get_asset_type_display(), self.name)
 
+    def save(self, *args, **kwargs):
+        self.manage_ip_key = ip_key(self.manage_ip)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'manage_ip' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'manage_ip_key'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Assets Sheet'
         verbose_name_plural = 'Assets Sheets'
         ordering = ['-c_time']
+        indexes = [models.Index(fields=['c_time', 'id'], name='asset_c_time_id_idx'),
+                   models.Index(fields=['asset_type', 'status'], name='asset_type_status_idx'),
+                   models.Index(fields=['m_time'], name='asset_m_time_idx')]
 
 
 class Server(models.Model):
@@ -215,11 +264,31 @@ class BusinessUnit(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        if self.pk and self.parent_unit_id and BusinessUnitClosure.objects.filter(
+                ancestor_id=self.pk, descendant_id=self.parent_unit_id).exists():
+            raise ValidationError({'parent_unit': 'A business unit can not be moved under itself.'})
+
     class Meta:
         verbose_name = 'Business Line'
         verbose_name_plural = 'Business Lines'
 
 
+class BusinessUnitClosure(models.Model):
+    """
+    Every (ancestor, descendant) pair of the business unit tree, each unit included as its own ancestor at depth 0.
+    Kept up to date by assets.unit_tree, subtree queries are one indexed join on it.
+    """
+    ancestor = models.ForeignKey('BusinessUnit', related_name='descendant_links', on_delete=models.CASCADE)
+    descendant = models.ForeignKey('BusinessUnit', related_name='ancestor_links', on_delete=models.CASCADE)
+    depth = models.PositiveSmallIntegerField('Depth', default=0)
+
+    class Meta:
+        verbose_name = 'Business Unit Closure'
+        verbose_name_plural = 'Business Unit Closure'
+        unique_together = ('ancestor', 'descendant')
+
+
 class Contract(models.Model):
     sn = models.CharField('Contract SN', max_length=128, unique=True)
     name = models.CharField('Contract Name', max_length=64)
@@ -316,12 +385,21 @@ class NIC(models.Model):
     model = models.CharField('NIC Model', max_length=128)
     mac = models.CharField('MAC Address', max_length=64)
     ip_address = models.GenericIPAddressField('IP Address', blank=True, null=True)
+    ip_key = models.CharField('IP Address Key', max_length=32, blank=True, null=True, editable=False, db_index=True)
     net_mask = models.CharField('Net Mask', max_length=64, blank=True, null=True)
     bonding = models.CharField('Bonding', max_length=64, blank=True, null=True)
 
     def __str__(self):
         return '%s: %s: %s' % (self.asset.name, self.model, self.mac)
 
+    def save(self, *args, **kwargs):
+        # Bulk writes set it themselves, see asset_handler.nic_values.
+        self.ip_key = ip_key(self.ip_address)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'ip_address' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'ip_key'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'NIC'
         verbose_name_plural = 'NIC'
@@ -342,7 +420,8 @@ class EventLog(models.Model):
     event_type = models.SmallIntegerField('Event Type', choices=event_type_choice, default=0)
     component = models.CharField('Event Component', max_length=256, blank=True, null=True)
     detail = models.TextField('Event Details')
-    date = models.DateTimeField('Event Time', auto_now_add=True)
+    # Not auto_now_add: that would stamp buffered events with the time of their bulk_create.
+    date = models.DateTimeField('Event Time', default=timezone.now, editable=False, db_index=True)
     user = models.ForeignKey(User, blank=True, null=True, verbose_name='Event Executor', on_delete=models.SET_NULL)
     memo = models.TextField('Memo', blank=True, null=True)
 
@@ -352,6 +431,7 @@ class EventLog(models.Model):
     class Meta:
         verbose_name = 'Event Log'
         verbose_name_plural = 'Event Log'
+        indexes = [models.Index(fields=['event_type', 'date'], name='eventlog_type_date_idx')]
 
 
 class NewAssetApprovalZone(models.Model):
@@ -376,9 +456,10 @@ class NewAssetApprovalZone(models.Model):
     os_type = models.CharField('OS type', max_length=64, blank=True, null=True)
     os_release = models.CharField('OS version', max_length=64, blank=True, null=True)
 
-    data = models.TextField('Asset Data')
+    # zlib compressed JSON manifest, the RAM, disk and NIC lists live in ReportSection, see assets.report_payload.
+    payload = models.BinaryField('Asset Data')
 
-    c_time = models.DateTimeField('Asset create time', auto_now_add=True)
+    c_time = models.DateTimeField('Asset create time', auto_now_add=True, db_index=True)
     m_time = models.DateTimeField('Asset Modify time', auto_now=True)
     approved = models.BooleanField('Approval Status', default=False)
 
@@ -391,3 +472,95 @@ class NewAssetApprovalZone(models.Model):
         ordering = ['-c_time']
 
 # Create your models here.
+
+
+class ApprovalJob(models.Model):
+    status_choice = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    user = models.ForeignKey(User, blank=True, null=True, verbose_name='Approved By', on_delete=models.SET_NULL)
+    status = models.CharField('Job Status', choices=status_choice, max_length=16, default='pending')
+    new_asset_ids = models.TextField('New Asset IDs')
+    total = models.PositiveIntegerField('Total', default=0)
+    approved = models.PositiveIntegerField('Approved', default=0)
+    failed = models.PositiveIntegerField('Failed', default=0)
+    memo = models.TextField('Memo', blank=True, null=True)
+    c_time = models.DateTimeField('Job create time', auto_now_add=True)
+    m_time = models.DateTimeField('Job update time', auto_now=True)
+
+    def progress(self):
+        if not self.total:
+            return '-'
+        return '%s%%' % round((self.approved + self.failed) / self.total * 100)
+
+    def __str__(self):
+        return 'Approval job #%s' % self.id
+
+    class Meta:
+        verbose_name = 'Approval Job'
+        verbose_name_plural = 'Approval Jobs'
+        ordering = ['-c_time']
+
+
+class AssetHistory(models.Model):
+    """
+    One structural change of an asset: a full snapshot every ASSET_HISTORY_SNAPSHOT_EVERY versions,
+    the diff against the previous version otherwise.
+    """
+    kind_choice = (
+        ('snapshot', 'Snapshot'),
+        ('delta', 'Delta'),
+    )
+
+    asset = models.ForeignKey('Asset', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField('Version')
+    kind = models.CharField('Kind', choices=kind_choice, max_length=16)
+    data = models.TextField('Data')
+    time = models.DateTimeField('Change Time')
+
+    def __str__(self):
+        return '%s v%s' % (self.asset, self.version)
+
+    class Meta:
+        verbose_name = 'Asset History'
+        verbose_name_plural = 'Asset History'
+        unique_together = ('asset', 'version')
+        index_together = ('asset', 'time')
+
+
+class AssetCounter(models.Model):
+    """
+    Number of assets per type, status, IDC and business unit, kept up to date by assets.dashboard_counters.
+    IDC and business unit are plain ids with 0 for none, so every combination has exactly one row.
+    """
+    asset_type = models.CharField('Asset Type', max_length=64)
+    status = models.SmallIntegerField('Asset Status')
+    idc_id = models.IntegerField('IDC ID', default=0)
+    business_unit_id = models.IntegerField('Business Unit ID', default=0)
+    count = models.IntegerField('Count', default=0)
+
+    class Meta:
+        verbose_name = 'Asset Counter'
+        verbose_name_plural = 'Asset Counters'
+        unique_together = ('asset_type', 'status', 'idc_id', 'business_unit_id')
+
+
+class CapacityRollup(models.Model):
+    """
+    RAM, disk and CPU cores of all assets per IDC and business unit, kept up to date by assets.capacity_rollups.
+    Ids are plain integers with 0 for none, like AssetCounter.
+    """
+    idc_id = models.IntegerField('IDC ID', default=0)
+    business_unit_id = models.IntegerField('Business Unit ID', default=0)
+    ram = models.BigIntegerField('RAM Capacity(GB)', default=0)
+    disk = models.FloatField('Disk Capacity(GB)', default=0)
+    cores = models.BigIntegerField('CPU Cores', default=0)
+
+    class Meta:
+        verbose_name = 'Capacity Rollup'
+        verbose_name_plural = 'Capacity Rollups'
+        unique_together = ('idc_id', 'business_unit_id')
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from assets import models
+
+# Report keys stored as shared sections. A batch of identical machines reports the same
+# RAM, disk and NIC lists apart from serial numbers and addresses: those per-unit values stay in the manifest,
+# the rest of each list is stored once as a section.
+SECTIONS = ('ram', 'physical_disk_driver', 'nic')
+UNIT_KEYS = ('sn', 'mac', 'ip_address')
+REF = '$section'
+UNITS = '$units'
+
+
+def canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def split_entry(entry):
+    if not isinstance(entry, dict):
+        return entry, {}
+    shared = {key: value for key, value in entry.items() if key not in UNIT_KEYS}
+    return shared, {key: value for key, value in entry.items() if key in UNIT_KEYS}
+
+
+def pack(data):
+    """
+    Split a report into a compressed manifest and its content addressed sections.
+    Returns (payload, sections), sections maps sha256 digests to compressed section data.
+    """
+    manifest = dict(data)
+    sections = dict()
+    for key in SECTIONS:
+        value = manifest.get(key)
+        if not value or not isinstance(value, list):
+            continue
+        shared, units = zip(*(split_entry(entry) for entry in value))
+        raw = canonical(shared)
+        digest = hashlib.sha256(raw).hexdigest()
+        sections[digest] = zlib.compress(raw)
+        manifest[key] = {REF: digest, UNITS: units}
+    return zlib.compress(canonical(manifest)), sections
+
+
+def grace_period():
+    return timedelta(minutes=getattr(settings, 'REPORT_SECTION_GRACE_MINUTES', 60))
+
+
+def store_sections(sections):
+    if sections:
+        now = timezone.now()
+        models.ReportSection.objects.bulk_create(
+            [models.ReportSection(digest=digest, data=data, m_time=now) for digest, data in sections.items()],
+            ignore_conflicts=True)
+        # Sections stored before are in use again, they get a new grace period against prune_sections().
+        models.ReportSection.objects.filter(digest__in=list(sections), m_time__lt=now - grace_period() / 2) \
+            .update(m_time=now)
+
+
+def dump(data):
+    payload, sections = pack(data)
+    store_sections(sections)
+    return payload
+
+
+def manifest(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def refs(report_manifest):
+    return [report_manifest[key][REF] for key in SECTIONS if isinstance(report_manifest.get(key), dict)]
+
+
+def unpack(report_manifest, sections):
+    """Put the sections back into a manifest, sections maps digests to ReportSection rows."""
+    for key in SECTIONS:
+        value = report_manifest.get(key)
+        if not isinstance(value, dict):
+            continue
+        entries = json.loads(zlib.decompress(bytes(sections[value[REF]].data)))
+        # Manifests written before the per-unit values were split off have no UNITS, their sections are complete.
+        if UNITS in value:
+            entries = [dict(entry, **unit) if unit else entry for entry, unit in zip(entries, value[UNITS])]
+        report_manifest[key] = entries
+    return report_manifest
+
+
+def load_many(new_assets):
+    """
+    Decode the reports of approval zone rows, reading all their sections with one query.
+    Keyed by row id, rows whose sections are missing are left out.
+    """
+    manifests = {new_asset.id: manifest(new_asset.payload) for new_asset in new_assets}
+    digests = {digest for m in manifests.values() for digest in refs(m)}
+    sections = models.ReportSection.objects.in_bulk(list(digests)) if digests else {}
+    reports = dict()
+    for new_asset_id, m in manifests.items():
+        if any(digest not in sections for digest in refs(m)):
+            continue
+        reports[new_asset_id] = unpack(m, sections)
+    return reports
+
+
+def load(new_asset):
+    reports = load_many([new_asset])
+    if new_asset.id not in reports:
+        raise ValueError("Report sections of %s are missing" % new_asset.sn)
+    return reports[new_asset.id]
+
+
+def prune_sections(grace=None):
+    """
+    Delete sections no approval zone row refers to any more. Returns the number deleted.
+    Sections stored within the grace period (REPORT_SECTION_GRACE_MINUTES) are kept,
+    a report may have stored them and not have written its approval zone row yet.
+    """
+    cutoff = timezone.now() - (grace_period() if grace is None else grace)
+    used = set()
+    for payload in models.NewAssetApprovalZone.objects.values_list('payload', flat=True).iterator():
+        used.update(refs(manifest(payload)))
+    unused = [digest for digest in models.ReportSection.objects.filter(m_time__lt=cutoff)
+              .values_list('digest', flat=True).iterator() if digest not in used]
+    deleted = 0
+    for i in range(0, len(unused), 500):
+        # Checked again on delete, a report may have stored the section again since.
+        deleted += models.ReportSection.objects.filter(digest__in=unused[i:i + 500], m_time__lt=cutoff).delete()[0]
+    return deleted
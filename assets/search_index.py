@@ -0,0 +1,249 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from assets import models
+
+# One FTS5 document per asset, rowid = asset id. The trigram tokenizer matches any substring
+# of three or more characters, so partial serials, MACs and IPs hit the index (SQLite >= 3.34).
+TABLE = 'assets_search'
+COLUMNS = ('sn', 'name', 'model', 'network', 'components')
+# bm25 weights in column order: serial numbers and addresses first.
+WEIGHTS = (10.0, 5.0, 2.0, 8.0, 3.0)
+CREATE_SQL = "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='trigram')" % (TABLE, ', '.join(COLUMNS))
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def documents(asset_ids):
+    """(asset id, column values) of the given assets, one query per source table."""
+    docs = dict()
+    for row in models.Asset.objects.filter(id__in=asset_ids).values_list(
+            'id', 'sn', 'name', 'server__model', 'manufacturer__name', 'cpu__cpu_model'):
+        docs[row[0]] = {'sn': [row[1]], 'name': [row[2]], 'model': [v for v in row[3:] if v],
+                        'network': [], 'components': []}
+    for asset_id, name, model, mac, ip_address in models.NIC.objects.filter(asset_id__in=docs).values_list(
+            'asset_id', 'name', 'model', 'mac', 'ip_address'):
+        docs[asset_id]['network'] += [v for v in (mac, mac.replace(':', '').replace('-', ''), ip_address) if v]
+        docs[asset_id]['components'] += [v for v in (name, model) if v]
+    for model in (models.Disk, models.RAM):
+        for asset_id, sn, component_model in model.objects.filter(asset_id__in=docs).values_list(
+                'asset_id', 'sn', 'model'):
+            docs[asset_id]['components'] += [v for v in (sn, component_model) if v]
+    return {asset_id: [' '.join(doc[c]) for c in COLUMNS] for asset_id, doc in docs.items()}
+
+
+def reindex(asset_ids):
+    """Bring the documents of these assets up to date, dropping the ones of deleted assets."""
+    asset_ids = list(asset_ids)
+    if not asset_ids or not available():
+        return
+    for i in range(0, len(asset_ids), 500):
+        chunk = asset_ids[i:i + 500]
+        docs = documents(chunk)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (TABLE, ', '.join(['%s'] * len(chunk))), chunk)
+            cursor.executemany('INSERT INTO %s (rowid, %s) VALUES (%s)' % (
+                TABLE, ', '.join(COLUMNS), ', '.join(['%s'] * (len(COLUMNS) + 1))),
+                [[asset_id] + values for asset_id, values in docs.items()])
+
+
+def rebuild(chunk_size=1000):
+    """Reindex every asset. Returns the number of documents."""
+    if not available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % TABLE)
+    last_id = 0
+    count = 0
+    while True:
+        ids = list(models.Asset.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return count
+        reindex(ids)
+        count += len(ids)
+        last_id = ids[-1]
+
+
+class Indexer:
+    """
+    Ids of the assets waiting to be reindexed, for the whole process.
+    Committed changes add their ids, the timer thread of start() reindexes them SEARCH_INDEX_DELAY seconds
+    after the first one, so the reports of those seconds share one reindex and none of them waits for it.
+    Without the timer (management commands) the ids are reindexed when the first is that old, checked on
+    every add and at the end of every request, and at exit. With a delay of 0 every commit reindexes its own ids.
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.first_time = None
+        self.lock = threading.Lock()
+        self.timer = None
+        self.wakeup = threading.Event()
+
+    def delay(self):
+        return getattr(settings, 'SEARCH_INDEX_DELAY', 2)
+
+    def add(self, asset_ids):
+        with self.lock:
+            first = not self.ids
+            if first:
+                self.first_time = time.monotonic()
+            self.ids.update(asset_ids)
+        if self.delay() <= 0 or (not self.running() and self.expired()):
+            self.flush()
+        elif first:
+            self.wakeup.set()
+
+    def expired(self):
+        with self.lock:
+            return bool(self.ids) and time.monotonic() - self.first_time >= self.delay()
+
+    def seconds_left(self):
+        with self.lock:
+            if not self.ids:
+                return self.delay()
+            return max(0, self.first_time + self.delay() - time.monotonic())
+
+    def running(self):
+        return self.timer is not None and self.timer.is_alive()
+
+    def start(self):
+        """Reindex on time from a background thread, with its own connection."""
+        with self.lock:
+            if self.running():
+                return
+            self.timer = threading.Thread(target=self._run_timer, name='cmdb-search-index', daemon=True)
+            self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            self.wakeup.set()
+            timer.join()
+
+    def _run_timer(self):
+        try:
+            while self.timer is threading.current_thread():
+                self.wakeup.wait(self.seconds_left())
+                self.wakeup.clear()
+                if self.expired():
+                    self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Reindex the waiting ids now. Returns how many were reindexed."""
+        with self.lock:
+            ids, self.ids = self.ids, set()
+        if not ids:
+            return 0
+        try:
+            reindex(ids)
+        except DatabaseError as e:
+            # Tried again on the next flush.
+            with self.lock:
+                self.ids |= ids
+                self.first_time = time.monotonic()
+            print(e)
+            return 0
+        return len(ids)
+
+
+indexer = Indexer()
+pending = threading.local()
+
+
+def mark(*asset_ids):
+    """
+    Reindex the assets once the current transaction commits (right away in autocommit), see Indexer.
+    The ids of one transaction are handed over together by its first callback, the others find nothing left.
+    Ids of a rolled back transaction join the next commit of the thread, an extra reindex is harmless.
+    """
+    if not hasattr(pending, 'ids'):
+        pending.ids = set()
+    pending.ids.update(asset_ids)
+    transaction.on_commit(hand_over)
+
+
+def hand_over():
+    ids = getattr(pending, 'ids', None)
+    if ids:
+        pending.ids = set()
+        indexer.add(ids)
+
+
+def _flush_at_exit():
+    indexer.stop()
+    try:
+        indexer.flush()
+    except Exception as e:
+        print(e)
+
+
+atexit.register(_flush_at_exit)
+
+
+@receiver(request_finished)
+def flush_expired(sender, **kwargs):
+    if not indexer.running() and indexer.expired() and not transaction.get_connection().in_atomic_block:
+        indexer.flush()
+
+
+def match_expression(query):
+    """FTS5 query ANDing the terms of the user query, None when no term is long enough for the trigram index."""
+    terms = ['"%s"' % term.replace('"', '""') for term in query.split() if len(term) >= 3]
+    return ' AND '.join(terms) or None
+
+
+def ranked_ids(query, limit=50):
+    """(asset id, score) of the best matches, one query on the index. None without an FTS5 index."""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    if not available():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT rowid, bm25(%s, %s) AS score FROM %s WHERE %s MATCH %%s ORDER BY score LIMIT %%s' % (
+            TABLE, ', '.join(str(w) for w in WEIGHTS), TABLE, TABLE), [expression, limit])
+        return cursor.fetchall()
+
+
+def search(query, limit=50, queryset=None):
+    """
+    Assets matching every term of the query, best first, as (asset, score) pairs; lower scores rank higher.
+    The assets are read with queryset, so callers can join or prefetch what they show.
+    """
+    if queryset is None:
+        queryset = models.Asset.objects.select_related('idc', 'business_unit')
+    ranked = ranked_ids(query, limit)
+    if ranked is None:
+        assets = queryset.filter(Q(sn__icontains=query) | Q(name__icontains=query))[:limit]
+        return [(asset, 0.0) for asset in assets]
+    assets = queryset.in_bulk([asset_id for asset_id, _ in ranked])
+    return [(assets[asset_id], score) for asset_id, score in ranked if asset_id in assets]
+
+
+@receiver(post_save, sender=models.Asset)
+@receiver(post_delete, sender=models.Asset)
+def asset_changed(sender, instance, **kwargs):
+    mark(instance.pk)
+
+
+@receiver(post_save, sender=models.Server)
+@receiver(post_save, sender=models.NIC)
+@receiver(post_save, sender=models.Disk)
+@receiver(post_save, sender=models.RAM)
+def component_changed(sender, instance, **kwargs):
+    # Like fragment_cache, no post_delete here: UpdateAsset's component deletes are followed by an asset save.
+    mark(instance.asset_id)
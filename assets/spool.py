@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+# Spool files whose schema this process has set up.
+ready_paths = set()
+ready_lock = threading.Lock()
+
+
+class ReportSpool:
+    """
+    Durable local queue of accepted reports, kept in its own SQLite file so that
+    appending never waits on the CMDB database.
+    A claimed entry that is not acked within visibility_timeout seconds is handed out again.
+    Every claim counts as an attempt, an entry that failed max_attempts times moves to the dead_letter table.
+    """
+
+    def __init__(self, path=None, visibility_timeout=None, max_attempts=None):
+        self.path = str(path or getattr(settings, 'REPORT_SPOOL_PATH', settings.BASE_DIR / 'spool.sqlite3'))
+        self.visibility_timeout = visibility_timeout or getattr(settings, 'REPORT_SPOOL_VISIBILITY_TIMEOUT', 300)
+        self.max_attempts = max_attempts or getattr(settings, 'REPORT_SPOOL_MAX_ATTEMPTS', 5)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        # FULL: a report is acknowledged with 202 once it is here, under WAL NORMAL could lose it on a power cut.
+        conn.execute('PRAGMA synchronous=FULL')
+        with ready_lock:
+            if self.path not in ready_paths:
+                self._create_schema(conn)
+                ready_paths.add(self.path)
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        # WAL is a property of the file, the rest only has to exist once.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS spool ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'body TEXT NOT NULL, '
+                     'received_at REAL NOT NULL, '
+                     'claimed_at REAL, '
+                     'claimed_by INTEGER, '
+                     'attempts INTEGER NOT NULL DEFAULT 0)')
+        if 'attempts' not in [row[1] for row in conn.execute('PRAGMA table_info(spool)')]:
+            conn.execute('ALTER TABLE spool ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE TABLE IF NOT EXISTS dead_letter ('
+                     'id INTEGER PRIMARY KEY, '
+                     'body TEXT NOT NULL, '
+                     'received_at REAL NOT NULL, '
+                     'attempts INTEGER NOT NULL, '
+                     'failed_at REAL NOT NULL, '
+                     'error TEXT)')
+
+    def append(self, data):
+        self.append_many([data])
+
+    def append_many(self, reports):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('INSERT INTO spool (body, received_at) VALUES (?, ?)',
+                                 [(json.dumps(data), now) for data in reports])
+        finally:
+            conn.close()
+
+    def claim(self, limit):
+        """
+        Take up to limit entries for this process, oldest first.
+        Returns a list of (id, report) tuples.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                rows = conn.execute('SELECT id, body FROM spool WHERE claimed_at IS NULL OR claimed_at < ? '
+                                    'ORDER BY id LIMIT ?', (now - self.visibility_timeout, limit)).fetchall()
+                conn.executemany('UPDATE spool SET claimed_at = ?, claimed_by = ?, attempts = attempts + 1 '
+                                 'WHERE id = ?',
+                                 [(now, os.getpid(), row[0]) for row in rows])
+        finally:
+            conn.close()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, ids):
+        self._execute_for_ids('DELETE FROM spool WHERE id IN (%s)', ids)
+
+    def release(self, ids):
+        self._execute_for_ids('UPDATE spool SET claimed_at = NULL, claimed_by = NULL WHERE id IN (%s)', ids)
+
+    def fail(self, ids, error):
+        """
+        Give failed entries back to the spool, or move them to dead_letter once they have used up their attempts.
+        Returns the number of entries moved.
+        """
+        if not ids:
+            return 0
+        ids = list(ids)
+        marks = ','.join('?' * len(ids))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                dead = conn.execute('INSERT INTO dead_letter (id, body, received_at, attempts, failed_at, error) '
+                                    'SELECT id, body, received_at, attempts, ?, ? FROM spool '
+                                    'WHERE id IN (%s) AND attempts >= ?' % marks,
+                                    [time.time(), str(error)] + ids + [self.max_attempts]).rowcount
+                conn.execute('DELETE FROM spool WHERE id IN (%s) AND attempts >= ?' % marks, ids + [self.max_attempts])
+                conn.execute('UPDATE spool SET claimed_at = NULL, claimed_by = NULL WHERE id IN (%s)' % marks, ids)
+        finally:
+            conn.close()
+        return dead
+
+    def requeue_dead(self):
+        """Put every dead letter back in the spool with fresh attempts, returns their number."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                count = conn.execute('INSERT INTO spool (id, body, received_at) '
+                                     'SELECT id, body, received_at FROM dead_letter').rowcount
+                conn.execute('DELETE FROM dead_letter')
+        finally:
+            conn.close()
+        return count
+
+    def _execute_for_ids(self, sql, ids):
+        if not ids:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(sql % ','.join('?' * len(ids)), list(ids))
+        finally:
+            conn.close()
+
+    def stats(self):
+        """
+        depth: entries waiting or in flight, in_flight: entries claimed by a worker,
+        lag: age in seconds of the oldest entry, dead: entries moved to dead_letter.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            depth, oldest = conn.execute('SELECT COUNT(*), MIN(received_at) FROM spool').fetchone()
+            in_flight = conn.execute('SELECT COUNT(*) FROM spool WHERE claimed_at >= ?',
+                                     (now - self.visibility_timeout,)).fetchone()[0]
+            dead = conn.execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'depth': depth,
+            'in_flight': in_flight,
+            'lag': round(now - oldest, 3) if oldest else 0,
+            'dead': dead,
+        }
+
+
+def run_reports(reports):
+    """
+    Run reports through the asset handler, returns the error of each one that failed as {index: error}.
+    """
+    from assets import asset_handler
+
+    results = {result['sn']: result for result in asset_handler.BatchReport(None, reports).run() if result['sn']}
+    errors = dict()
+    for i, data in enumerate(reports):
+        result = results.get(str(data['sn'])) if isinstance(data, dict) and data.get('sn') else None
+        if result is None:
+            errors[i] = 'No Asset SN, Please check Data!'
+        elif result['status'] == 'failed':
+            errors[i] = result['msg']
+    return errors
+
+
+def drain_batch(spool, batch_size):
+    """
+    Run one batch from the spool through the asset handler, returns the number of reports processed.
+    The batch is written in one go; if that raises, entry by entry so one bad report doesn't hold back the others.
+    Entries are acked as they succeed, failed ones go back to the spool or to the dead letters.
+    """
+    from assets import event_sink
+
+    entries = spool.claim(batch_size)
+    if not entries:
+        return 0
+    reports = [data for _, data in entries]
+    try:
+        errors = run_reports(reports)
+    except Exception:
+        errors = dict()
+        for i, data in enumerate(reports):
+            try:
+                error = run_reports([data]).get(0)
+            except Exception as e:
+                error = e
+            if error is not None:
+                errors[i] = error
+    # Worker processes end without atexit, write the batch's events before acking it.
+    event_sink.sink.flush()
+    spool.ack([entry_id for i, (entry_id, _) in enumerate(entries) if i not in errors])
+    for i, error in errors.items():
+        spool.fail([entries[i][0]], error)
+    return len(entries)
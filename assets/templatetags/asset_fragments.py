@@ -0,0 +1,69 @@
+from django import template
+
+from assets import fragment_cache
+
+register = template.Library()
+
+
+def page_key(name):
+    return 'assetcache-page:%s' % name
+
+
+class AssetCacheNode(template.Node):
+    def __init__(self, nodelist, name, asset):
+        self.nodelist = nodelist
+        self.name = name
+        self.asset = asset
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        asset = self.asset.resolve(context)
+        page = context.render_context.get(page_key(name))
+        if page is None:
+            return fragment_cache.get_or_render(name, asset, lambda: self.nodelist.render(context))
+        return page.get_or_render(asset, lambda: self.nodelist.render(context))
+
+
+class AssetCachePageNode(template.Node):
+    def __init__(self, nodelist, name, assets):
+        self.nodelist = nodelist
+        self.name = name
+        self.assets = assets
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        page = fragment_cache.Page(name, self.assets.resolve(context))
+        context.render_context[page_key(name)] = page
+        try:
+            return self.nodelist.render(context)
+        finally:
+            del context.render_context[page_key(name)]
+            page.save()
+
+
+@register.tag
+def assetcache(parser, token):
+    """
+    {% assetcache "row" asset %}...{% endassetcache %}
+    Cache the enclosed markup per asset until the asset changes, see assets.fragment_cache.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError("'%s' takes a fragment name and an asset" % bits[0])
+    nodelist = parser.parse(('endassetcache',))
+    parser.delete_first_token()
+    return AssetCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
+
+
+@register.tag
+def assetcachepage(parser, token):
+    """
+    {% assetcachepage "row" assets %}...{% assetcache "row" asset %}...{% endassetcachepage %}
+    Read the "row" fragments of all the assets with one cache query, and write the rendered misses with another.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError("'%s' takes a fragment name and a list of assets" % bits[0])
+    nodelist = parser.parse(('endassetcachepage',))
+    parser.delete_first_token()
+    return AssetCachePageNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
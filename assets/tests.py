@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import copy
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from assets import models
+from assets import asset_handler
+from assets import spool
+from assets import lookup_cache
+from assets import wire
+from assets import event_sink
+from assets import event_archive
+from assets import asset_history
+from assets import report_payload
+from assets import dashboard_counters
+from assets import fragment_cache
+from assets import ip_index
+from assets import capacity_rollups
+from assets import search_index
+from assets import unit_tree
+from assets import topology
+from assets import db_writer
+from Client.core import delta as client_delta
+
 
 # Create your tests here.
+
+def make_report(sn, ram_count=2, disk_count=2, nic_count=2, **extra):
+    data = {
+        'asset_type': 'server',
+        'sn': sn,
+        'manufacturer': 'Dell Inc.',
+        'model': 'PowerEdge R740',
+        'os_type': 'Linux',
+        'os_distribution': 'Ubuntu',
+        'os_release': 'Ubuntu 22.04 LTS',
+        'cpu_model': 'Intel(R) Xeon(R) Gold 6230',
+        'cpu_count': 2,
+        'cpu_core_count': 40,
+        'ram_size': 16 * ram_count,
+        'ram': [{'slot': 'A%s' % i, 'capacity': 16, 'model': 'DDR4', 'manufacturer': 'Samsung',
+                 'sn': 'RAM-%s-%s' % (sn, i)} for i in range(ram_count)],
+        'physical_disk_driver': [{'slot': str(i), 'sn': 'DISK-%s-%s' % (sn, i), 'model': 'ST4000',
+                                  'manufacturer': 'Seagate', 'capacity': 4000, 'interface_type': 'SAS'}
+                                 for i in range(disk_count)],
+        'nic': [{'name': 'eth%s' % i, 'model': 'Intel X710', 'mac': '00:11:22:33:44:%02x' % i,
+                 'ip_address': '10.0.0.%s' % (i + 1), 'net_mask': ['255.255.255.0']} for i in range(nic_count)],
+    }
+    data.update(extra)
+    return data
+
+
+def clear_buffers():
+    event_sink.sink.buffer = []
+    search_index.indexer.ids = set()
+    search_index.pending.ids = set()
+
+
+def tearDownModule():
+    # Don't let the exit flushes write test events and reindex test ids into the real database.
+    clear_buffers()
+
+
+class CacheResetMixin:
+    # The lookup cache, the event buffer and the search index ids outlive the rolled back test transactions.
+
+    def setUp(self):
+        super().setUp()
+        lookup_cache.clear()
+        clear_buffers()
+
+    def tearDown(self):
+        clear_buffers()
+        super().tearDown()
+
+
+def create_server(sn):
+    asset = models.Asset.objects.create(asset_type='server', name='server: %s' % sn, sn=sn)
+    models.Server.objects.create(asset=asset)
+    models.CPU.objects.create(asset=asset)
+    return asset
+
+
+class ReportBatchTest(CacheResetMixin, TestCase):
+
+    def post_batch(self, body, content_type='application/json'):
+        return self.client.post(reverse('assets:report_batch'), data=body, content_type=content_type)
+
+    def test_json_array_splits_new_and_updated_assets(self):
+        create_server('SN-OLD')
+        models.NewAssetApprovalZone.objects.create(sn='SN-WAITING', payload=report_payload.dump({}))
+        reports = [make_report('SN-OLD'), make_report('SN-NEW'), make_report('SN-WAITING'), {'asset_type': 'server'}]
+
+        response = self.post_batch(json.dumps(reports))
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [(r['sn'], r['status']) for r in response.json()['results']]
+        self.assertEqual(statuses, [('SN-OLD', 'updated'), ('SN-NEW', 'new'),
+                                    ('SN-WAITING', 'new'), (None, 'invalid')])
+        self.assertEqual(models.RAM.objects.filter(asset__sn='SN-OLD').count(), 2)
+        self.assertEqual(models.NewAssetApprovalZone.objects.count(), 2)
+        waiting = models.NewAssetApprovalZone.objects.get(sn='SN-WAITING')
+        self.assertEqual(report_payload.load(waiting)['model'], 'PowerEdge R740')
+
+    def test_ndjson_body(self):
+        body = '\n'.join(json.dumps(make_report('SN-%s' % i)) for i in range(3))
+
+        response = self.post_batch(body, content_type='application/x-ndjson')
+
+        self.assertEqual([r['status'] for r in response.json()['results']], ['new'] * 3)
+        self.assertEqual(models.NewAssetApprovalZone.objects.count(), 3)
+
+    def test_known_assets_are_updated_in_bulk(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lookup_cache.manufacturer_id('Dell Inc.')
+        counts = []
+        for size in (2, 6):
+            sns = ['SN-%s-%s' % (size, i) for i in range(size)]
+            for sn in sns:
+                create_server(sn)
+            self.post_batch(json.dumps([make_report(sn) for sn in sns]))
+            reports = [make_report(sn, ram_count=3, nic_count=1, model='PowerEdge R750') for sn in sns]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_batch(json.dumps(reports))
+            counts.append(len(queries))
+            self.assertEqual({r['status'] for r in response.json()['results']}, {'updated'})
+            self.assertEqual(models.RAM.objects.filter(asset__sn__in=sns).count(), 3 * size)
+            self.assertEqual(models.NIC.objects.filter(asset__sn__in=sns).count(), size)
+            self.assertEqual(set(models.Server.objects.filter(asset__sn__in=sns).values_list('model', flat=True)),
+                             {'PowerEdge R750'})
+            for sn in sns:
+                asset = models.Asset.objects.get(sn=sn)
+                self.assertEqual((asset.history_version, asset.report_hash),
+                                 (2, asset_handler.report_hash(reports[sns.index(sn)])))
+                state = asset_history.asset_state(asset.id)
+                self.assertEqual((state['fields']['model'], len(state['ram'])), ('PowerEdge R750', 3))
+        self.assertEqual(counts[0], counts[1])
+
+        # Unchanged reports only touch last_seen, bad ones fail alone.
+        sns = ['SN-6-%s' % i for i in range(6)]
+        reports = [make_report(sn, ram_count=3, nic_count=1, model='PowerEdge R750') for sn in sns]
+        reports[1] = dict(make_report(sns[1]), ram=[{'capacity': 8}])
+        statuses = [r['status'] for r in self.post_batch(json.dumps(reports)).json()['results']]
+        self.assertEqual(statuses, ['unchanged', 'failed'] + ['unchanged'] * 4)
+
+    def test_batch_body_limit(self):
+        body = json.dumps([make_report('SN-%s' % i) for i in range(3)])
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000):
+            self.assertEqual(self.post_batch(body).status_code, 200)
+            with self.settings(REPORT_BATCH_MAX_BYTES=1000):
+                self.assertEqual(self.post_batch(body).status_code, 413)
+
+    def test_invalid_body(self):
+        self.assertEqual(self.post_batch('{not json').status_code, 400)
+        self.assertEqual(self.post_batch('[]').status_code, 400)
+
+
+class ReportHashTest(CacheResetMixin, TestCase):
+
+    def report(self, data):
+        return self.client.post(reverse('assets:report'), {'asset_data': json.dumps(data)})
+
+    def test_identical_report_skips_component_sync(self):
+        asset = create_server('SN-HASH')
+        self.assertEqual(self.report(make_report('SN-HASH')).content, b'Assets Data Updated!')
+        events = models.EventLog.objects.count()
+        asset.refresh_from_db()
+        m_time = asset.m_time
+
+        # Same document with a different key order hashes the same.
+        data = dict(reversed(list(make_report('SN-HASH').items())))
+        # Asset lookup, then the last_seen update.
+        with self.assertNumQueries(2):
+            response = self.report(data)
+        # The lookup is cached from now on.
+        with self.assertNumQueries(1):
+            self.report(data)
+        self.assertEqual(lookup_cache.stats()['assets']['hits'], 1)
+
+        self.assertEqual(response.content, b'Assets Data Unchanged!')
+        self.assertEqual(models.EventLog.objects.count(), events)
+        asset.refresh_from_db()
+        self.assertEqual(asset.m_time, m_time)
+        self.assertGreater(asset.last_seen, m_time)
+
+    def test_changed_report_is_applied(self):
+        create_server('SN-HASH')
+        self.report(make_report('SN-HASH'))
+
+        response = self.report(make_report('SN-HASH', ram_count=4))
+
+        self.assertEqual(response.content, b'Assets Data Updated!')
+        self.assertEqual(models.RAM.objects.filter(asset__sn='SN-HASH').count(), 4)
+
+
+class ComponentSyncTest(CacheResetMixin, TestCase):
+
+    def changed_report(self, sn, count):
+        # One row of each table removed, one added and one modified.
+        data = make_report(sn, ram_count=count + 1, disk_count=count + 1, nic_count=count + 1)
+        for key, field in (('ram', 'model'), ('physical_disk_driver', 'model'), ('nic', 'name')):
+            del data[key][0]
+            data[key][0][field] = 'replaced'
+        return data
+
+    def assert_update_queries(self, count):
+        sn = 'SN-%s' % count
+        asset = create_server(sn)
+        asset_handler.UpdateAsset(None, asset, make_report(sn, ram_count=count, disk_count=count, nic_count=count))
+
+        asset = models.Asset.objects.get(sn=sn)
+        with self.captureOnCommitCallbacks(execute=True):
+            lookup_cache.manufacturer_id('Dell Inc.')
+        # savepoint, server, cpu, 4 per component table, version, history, asset, release; the event log is buffered
+        with self.assertNumQueries(21):
+            update_asset = asset_handler.UpdateAsset(None, asset, self.changed_report(sn, count))
+
+        self.assertTrue(update_asset.result)
+        self.assertEqual(models.RAM.objects.filter(asset=asset).count(), count)
+        self.assertEqual(models.Disk.objects.filter(asset=asset, model='replaced').count(), 1)
+        self.assertFalse(models.NIC.objects.filter(asset=asset, mac='00:11:22:33:44:00').exists())
+        self.assertTrue(models.NIC.objects.filter(asset=asset, mac='00:11:22:33:44:%02x' % count).exists())
+
+    def test_query_count_does_not_depend_on_component_count(self):
+        self.assert_update_queries(3)
+        self.assert_update_queries(24)
+
+    def test_unchanged_components_are_not_written(self):
+        asset = create_server('SN-SAME')
+        data = make_report('SN-SAME')
+        asset_handler.UpdateAsset(None, asset, data)
+        data = dict(data, model='PowerEdge R750')
+
+        asset = models.Asset.objects.get(sn='SN-SAME')
+        # savepoint, manufacturer, server, cpu, one select per component table, version, history, asset, release
+        with self.assertNumQueries(13):
+            asset_handler.UpdateAsset(None, asset, data)
+
+
+class AssetHistoryTest(CacheResetMixin, TestCase):
+
+    def test_states_are_rebuilt_from_snapshots_and_deltas(self):
+        create_server('SN-HIST')
+        reports = [make_report('SN-HIST'), make_report('SN-HIST', ram_count=3),
+                   make_report('SN-HIST', ram_count=3, model='PowerEdge R750'),
+                   make_report('SN-HIST', ram_count=3, model='PowerEdge R750', nic_count=1)]
+        reports.append(copy.deepcopy(reports[-1]))
+        reports[-1]['ram'][0]['capacity'] = 32
+        reports.append(dict(reports[-1], ram_size=999))
+        states = []
+        with self.settings(ASSET_HISTORY_SNAPSHOT_EVERY=3):
+            for data in reports:
+                asset = models.Asset.objects.select_related('server', 'cpu').get(sn='SN-HIST')
+                self.assertTrue(asset_handler.UpdateAsset(None, asset, data).result)
+                asset = models.Asset.objects.select_related('server', 'cpu').get(sn='SN-HIST')
+                states.append(json.loads(json.dumps(asset_history.snapshot(asset))))
+
+        entries = models.AssetHistory.objects.filter(asset=asset).order_by('version')
+        # The last report changes nothing structural.
+        self.assertEqual([e.kind for e in entries], ['snapshot', 'delta', 'delta', 'snapshot', 'delta'])
+        self.assertEqual(json.loads(entries[1].data), {'ram': {'added': {'["A2"]': {
+            'sn': 'RAM-SN-HIST-2', 'model': 'DDR4', 'manufacturer': 'Samsung', 'capacity': 16}}}})
+        start = timezone.now() - timedelta(days=10)
+        for entry in entries:
+            models.AssetHistory.objects.filter(pk=entry.pk).update(time=start + timedelta(days=entry.version))
+        for version, state in enumerate(states[:5], 1):
+            self.assertEqual(asset_history.asset_state(asset.id, at=start + timedelta(days=version)), state)
+        self.assertEqual(asset_history.asset_state(asset.id), states[-1])
+        self.assertIsNone(asset_history.asset_state(asset.id, at=start))
+
+    def test_updates_from_stale_copies_get_distinct_versions(self):
+        create_server('SN-RACE')
+        # Two reports of the same asset handled at the same time, both loaded before either was written.
+        first, second = [models.Asset.objects.select_related('server', 'cpu').get(sn='SN-RACE') for _ in range(2)]
+        self.assertTrue(asset_handler.UpdateAsset(None, first, make_report('SN-RACE')).result)
+        self.assertTrue(asset_handler.UpdateAsset(None, second, make_report('SN-RACE', ram_count=3)).result)
+        # And one without structural change from a stale copy doesn't move the version back.
+        third = models.Asset.objects.select_related('server', 'cpu').get(sn='SN-RACE')
+        third.history_version = 1
+        asset_handler.UpdateAsset(None, third, dict(make_report('SN-RACE', ram_count=3), ram_size=1))
+
+        self.assertEqual(list(models.AssetHistory.objects.filter(asset__sn='SN-RACE').order_by('version')
+                              .values_list('version', flat=True)), [1, 2])
+        self.assertEqual(models.Asset.objects.get(sn='SN-RACE').history_version, 2)
+
+
+class ReportPayloadTest(CacheResetMixin, TestCase):
+
+    def test_identical_hardware_is_stored_once(self):
+        reports = [make_report('SN-%s' % i) for i in range(3)]
+        for entry in reports[2]['ram']:
+            entry['model'] = 'DDR5'
+        asset_handler.BatchReport(None, reports).run()
+
+        # Every serial, MAC and IP differs: the RAM lists of both models, the disk list, the NIC list.
+        self.assertEqual(models.ReportSection.objects.count(), 2 + 1 + 1)
+        new_asset = models.NewAssetApprovalZone.objects.get(sn='SN-1')
+        self.assertLess(len(new_asset.payload), len(json.dumps(reports[1])) / 2)
+        self.assertEqual(report_payload.load(new_asset), reports[1])
+
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('admin:assets_newassetapprovalzone_changelist'))
+        self.assertFalse([q for q in queries if 'payload' in q['sql']])
+
+        models.NewAssetApprovalZone.objects.filter(sn='SN-2').delete()
+        self.assertEqual(report_payload.prune_sections(), 0)
+        self.assertEqual(report_payload.prune_sections(grace=timedelta(0)), 1)
+        self.assertEqual(report_payload.load(models.NewAssetApprovalZone.objects.get(sn='SN-0')), reports[0])
+
+    def test_prune_spares_sections_stored_again(self):
+        report_payload.dump(make_report('SN-0'))
+        models.ReportSection.objects.update(m_time=timezone.now() - timedelta(hours=2))
+        # A report stored the same entries and hasn't written its approval zone row yet.
+        report_payload.dump(make_report('SN-1'))
+
+        self.assertEqual(report_payload.prune_sections(), 0)
+        self.assertEqual(report_payload.prune_sections(grace=timedelta(0)), 3)
+
+    def test_manifests_of_whole_lists_still_load(self):
+        data = make_report('SN-OLD')
+        payload, sections = report_payload.pack(dict(data, ram=None))
+        ram = report_payload.canonical(data['ram'])
+        digest = hashlib.sha256(ram).hexdigest()
+        sections[digest] = zlib.compress(ram)
+        m = report_payload.manifest(payload)
+        m['ram'] = {report_payload.REF: digest}
+        report_payload.store_sections(sections)
+        new_asset = models.NewAssetApprovalZone.objects.create(sn='SN-OLD', payload=zlib.compress(
+            report_payload.canonical(m)))
+
+        self.assertEqual(report_payload.load(new_asset), data)
+        self.assertEqual(report_payload.prune_sections(grace=timedelta(0)), 0)
+
+
+class EventSinkTest(CacheResetMixin, TransactionTestCase):
+    # Events wait for real commits, and SQLite checks foreign keys at commit.
+
+    def test_events_are_written_in_bulk(self):
+        asset = create_server('SN-LOG')
+        with self.settings(EVENT_LOG_BUFFER_SIZE=3, EVENT_LOG_BUFFER_SECONDS=60):
+            # One bulk insert, in its own transaction.
+            with self.assertNumQueries(2):
+                for i in range(3):
+                    asset_handler.log('update', asset=asset)
+            self.assertEqual(models.EventLog.objects.count(), 3)
+
+            with transaction.atomic():
+                event_sink.sink.add(models.EventLog(name='commit', detail='committed', asset=asset))
+                self.assertEqual(event_sink.sink.buffer, [])
+            self.assertEqual(len(event_sink.sink.buffer), 1)
+
+            # Events of rolled back work are dropped, also when only a savepoint rolls back.
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    event_sink.sink.add(models.EventLog(name='rollback', detail='rolled back', asset=asset))
+                    raise ValueError
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        event_sink.sink.add(models.EventLog(name='savepoint', detail='rolled back', asset=asset))
+                        raise ValueError
+                except ValueError:
+                    pass
+                event_sink.sink.add(models.EventLog(name='commit', detail='committed', asset=asset))
+            self.assertEqual(event_sink.sink.flush(), 2)
+        self.assertEqual(models.EventLog.objects.filter(detail='committed').count(), 2)
+        self.assertFalse(models.EventLog.objects.filter(detail='rolled back').exists())
+
+    def test_buffered_events_keep_their_time(self):
+        asset = create_server('SN-TIME')
+        with self.settings(EVENT_LOG_BUFFER_SIZE=100, EVENT_LOG_BUFFER_SECONDS=60):
+            asset_handler.log('update', asset=asset)
+            added = timezone.now()
+            time.sleep(0.05)
+            flushed = timezone.now()
+            event_sink.sink.flush()
+        date = models.EventLog.objects.get(asset=asset).date
+        self.assertLessEqual(date, added)
+        self.assertLess(date, flushed)
+
+    def test_timer_flushes_an_idle_buffer(self):
+        asset = create_server('SN-IDLE')
+        with self.settings(EVENT_LOG_BUFFER_SECONDS=0.05):
+            event_sink.sink.start()
+            self.addCleanup(event_sink.sink.stop)
+            event_sink.sink.add(models.EventLog(name='idle', detail='idle', asset=asset))
+            for _ in range(100):
+                if not event_sink.sink.buffer:
+                    break
+                time.sleep(0.02)
+        self.assertEqual(event_sink.sink.buffer, [])
+        event_sink.sink.stop()
+        self.assertTrue(models.EventLog.objects.filter(detail='idle').exists())
+
+    def test_event_of_missing_asset_is_dropped(self):
+        asset = create_server('SN-GONE')
+        event_sink.sink.add(models.EventLog(name='kept', detail='kept', asset=asset))
+        event_sink.sink.add(models.EventLog(name='gone', detail='gone', asset_id=asset.id + 1))
+
+        self.assertEqual(event_sink.sink.flush(), 1)
+        self.assertEqual(list(models.EventLog.objects.values_list('detail', flat=True)), ['kept'])
+        self.assertEqual(event_sink.sink.buffer, [])
+
+
+class EventArchiveTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.archive = event_archive.EventArchive(self.tmp_dir.name)
+
+    def test_old_events_are_archived_and_still_in_history(self):
+        asset = create_server('SN-OLD')
+        other = create_server('SN-OTHER')
+        now = timezone.now()
+        for days, target in ((40, asset), (40, other), (35, asset), (35, asset), (1, asset)):
+            event = models.EventLog.objects.create(name='event', detail='%s days' % days, asset=target)
+            models.EventLog.objects.filter(pk=event.pk).update(date=now - timedelta(days=days))
+
+        moved = event_archive.archive_events(before=now - timedelta(days=30), chunk_size=2, archive=self.archive)
+
+        self.assertEqual(moved, 4)
+        self.assertEqual(models.EventLog.objects.count(), 1)
+        self.assertEqual(len(self.archive.days()), 2)
+        first = self.archive.index(self.archive.days()[0])
+        self.assertEqual(set(first['assets']), {str(asset.id), str(other.id)})
+        history = event_archive.asset_history(asset.id, archive=self.archive)
+        self.assertEqual([row['detail'] for row in history], ['1 days', '35 days', '35 days', '40 days'])
+        since = (now - timedelta(days=36)).date()
+        self.assertEqual(len(event_archive.asset_history(asset.id, since=since, archive=self.archive)), 3)
+
+        # A rerun after a crash between writing and deleting doesn't duplicate the segment.
+        self.assertEqual(self.archive.append(self.archive.days()[0], [dict(history[-1], date='')]), {history[-1]['id']})
+        self.assertEqual(self.archive.index(self.archive.days()[0])['count'], 2)
+
+    def test_late_rows_with_lower_ids_are_archived(self):
+        asset = create_server('SN-LATE')
+        now = timezone.now()
+        events = [models.EventLog.objects.create(name='event', detail=str(i), asset=asset) for i in range(3)]
+        models.EventLog.objects.filter(pk__in=[events[0].pk, events[2].pk]).update(date=now - timedelta(days=40))
+        event_archive.archive_events(before=now - timedelta(days=30), archive=self.archive)
+        # Back-filled after the archive moved past its id.
+        models.EventLog.objects.filter(pk=events[1].pk).update(date=now - timedelta(days=40))
+
+        moved = event_archive.archive_events(before=now - timedelta(days=30), archive=event_archive.EventArchive(
+            self.tmp_dir.name))
+
+        self.assertEqual(moved, 1)
+        self.assertFalse(models.EventLog.objects.exists())
+        day = self.archive.days()[0]
+        self.assertEqual(self.archive.index(day)['assets'], {str(asset.id): [events[0].pk, events[2].pk]})
+        history = event_archive.asset_history(asset.id, archive=self.archive)
+        self.assertEqual(sorted(row['detail'] for row in history), ['0', '1', '2'])
+
+
+class ReportSpoolTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool_path = os.path.join(self.tmp_dir.name, 'spool.sqlite3')
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_acknowledged_reports_are_synced(self):
+        conn = spool.ReportSpool(self.spool_path)._connect()
+        self.addCleanup(conn.close)
+        # WAL, and an fsync on every commit: 2 is FULL.
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 2)
+
+    def test_claim_ack_and_stats(self):
+        report_spool = spool.ReportSpool(self.spool_path)
+        report_spool.append_many([make_report('SN-%s' % i) for i in range(3)])
+
+        entries = report_spool.claim(2)
+        self.assertEqual([data['sn'] for _, data in entries], ['SN-0', 'SN-1'])
+        self.assertEqual([data['sn'] for _, data in report_spool.claim(5)], ['SN-2'])
+        self.assertEqual(report_spool.stats()['in_flight'], 3)
+
+        report_spool.ack([entry_id for entry_id, _ in entries])
+        stats = report_spool.stats()
+        self.assertEqual(stats['depth'], 1)
+        self.assertGreaterEqual(stats['lag'], 0)
+
+    def test_report_is_spooled_then_drained(self):
+        create_server('SN-OLD')
+        with self.settings(REPORT_SPOOL_ENABLED=True, REPORT_SPOOL_PATH=self.spool_path):
+            response = self.client.post(reverse('assets:report'), {'asset_data': json.dumps(make_report('SN-NEW'))})
+            self.client.post(reverse('assets:report'), {'asset_data': json.dumps(make_report('SN-OLD'))})
+            self.assertEqual(response.status_code, 202)
+            self.assertFalse(models.NewAssetApprovalZone.objects.exists())
+            self.assertEqual(self.client.get(reverse('assets:spool_stats')).json()['depth'], 2)
+
+            call_command('drain_report_spool', workers=1, once=True, stdout=io.StringIO())
+
+            self.assertEqual(spool.ReportSpool().stats()['depth'], 0)
+        self.assertTrue(models.NewAssetApprovalZone.objects.filter(sn='SN-NEW').exists())
+        self.assertEqual(models.RAM.objects.filter(asset__sn='SN-OLD').count(), 2)
+
+
+    def test_poison_report_goes_to_dead_letters(self):
+        report_spool = spool.ReportSpool(self.spool_path, max_attempts=2)
+        # Breaks the bulk write of the whole batch.
+        report_spool.append_many([make_report('SN-POISON', cpu_count='many'), make_report('SN-GOOD')])
+
+        self.assertEqual(spool.drain_batch(report_spool, 10), 2)
+        self.assertTrue(models.NewAssetApprovalZone.objects.filter(sn='SN-GOOD').exists())
+        self.assertEqual((report_spool.stats()['depth'], report_spool.stats()['dead']), (1, 0))
+        spool.drain_batch(report_spool, 10)
+        self.assertEqual((report_spool.stats()['depth'], report_spool.stats()['dead']), (0, 1))
+        self.assertEqual(spool.drain_batch(report_spool, 10), 0)
+
+        self.assertEqual(report_spool.requeue_dead(), 1)
+        self.assertEqual([data['sn'] for _, data in report_spool.claim(10)], ['SN-POISON'])
+
+
+class IndexViewTest(TestCase):
+
+    def create_assets(self, count, idc):
+        tag = models.Tag.objects.get_or_create(name='prod')[0]
+        for i in range(count):
+            asset = create_server('SN-%s-%s' % (idc.name, i))
+            asset.idc = idc
+            asset.status = i % 2
+            asset.save()
+            asset.tags.add(tag)
+        network = models.Asset.objects.create(asset_type='networkdevice', name='switch-%s' % idc.name,
+                                              sn='NET-%s' % idc.name, idc=idc)
+        models.NetworkDevice.objects.create(asset=network)
+
+    def test_pages_cost_the_same_queries_at_any_size(self):
+        idc = models.IDC.objects.create(name='BJ')
+        self.create_assets(3, idc)
+        url = reverse('assets:index')
+        # ETag, assets, tags, IDC and business unit choices
+        with self.settings(INDEX_PAGE_SIZE=2), self.assertNumQueries(5):
+            first = self.client.get(url)
+        self.create_assets(8, models.IDC.objects.create(name='SH'))
+        with self.settings(INDEX_PAGE_SIZE=2), self.assertNumQueries(5):
+            self.client.get(url)
+
+        seen = []
+        with self.settings(INDEX_PAGE_SIZE=2):
+            response = self.client.get(url, {'idc': idc.id})
+            while True:
+                seen.extend(asset.sn for asset in response.context['assets'])
+                if not response.context['next_cursor']:
+                    break
+                response = self.client.get(url, {'idc': idc.id, 'after': response.context['next_cursor']})
+        self.assertEqual(seen, ['NET-BJ', 'SN-BJ-2', 'SN-BJ-1', 'SN-BJ-0'])
+        self.assertEqual(first.status_code, 200)
+
+        response = self.client.get(url, {'type': 'server', 'status': '1', 'idc': idc.id, 'after': 'bogus'})
+        self.assertEqual([asset.sn for asset in response.context['assets']], ['SN-BJ-1'])
+
+
+class DashboardCounterTest(CacheResetMixin, TestCase):
+
+    def recount(self):
+        counts = dashboard_counters.totals()
+        dashboard_counters.rebuild()
+        return counts, dashboard_counters.totals()
+
+    def test_counters_follow_asset_changes(self):
+        self.assertEqual(self.client.get(reverse('assets:dashboard')).status_code, 200)
+
+        idc = models.IDC.objects.create(name='BJ')
+        assets = [create_server('SN-%s' % i) for i in range(3)]
+        assets[0].status = 1
+        assets[0].save()
+        assets[1].idc = idc
+        assets[1].save()
+        models.Asset.objects.get(pk=assets[2].pk).delete()
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        asset_handler.NewAsset(None, make_report('SN-NEW')).add_to_new_assets_zone()
+        asset_handler.BulkApproveAsset(user, models.NewAssetApprovalZone.objects.values_list('id', flat=True)).run()
+
+        counts, recounted = self.recount()
+        self.assertEqual(counts, recounted)
+        self.assertEqual(counts, {('server', 0): 2, ('server', 1): 1})
+
+        idc.delete()
+        self.assertEqual(models.AssetCounter.objects.filter(idc_id=idc.id).count(), 0)
+        # counters, software, business units of the filter
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('assets:dashboard'))
+        self.assertEqual((response.context['total'], response.context['up_rate']), (3, 67))
+
+
+class CapacityRollupTest(CacheResetMixin, TestCase):
+
+    def capacity(self, by='idc'):
+        return {row['id']: (row['ram'], row['disk'], row['cores'])
+                for row in self.client.get(reverse('assets:capacity'), {'by': by}).json()['rows']}
+
+    def test_rollups_follow_component_changes(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        for sn in ('SN-0', 'SN-1'):
+            asset_handler.NewAsset(None, make_report(sn)).add_to_new_assets_zone()
+        asset_handler.BulkApproveAsset(user, models.NewAssetApprovalZone.objects.values_list('id', flat=True)).run()
+        asset_handler.NewAsset(None, make_report('SN-2', ram_count=1)).add_to_new_assets_zone()
+        request = type('Request', (), {'user': user})()
+        self.assertTrue(asset_handler.ApproveAsset(request, models.NewAssetApprovalZone.objects.get().id).asset_upline())
+        self.assertEqual(self.capacity(), {None: (80, 24000.0, 120)})
+
+        idc = models.IDC.objects.create(name='BJ')
+        asset = models.Asset.objects.get(sn='SN-1')
+        asset.idc = idc
+        asset.save()
+        report = make_report('SN-1', ram_count=3, disk_count=1, cpu_core_count=64)
+        asset_handler.UpdateAsset(None, models.Asset.objects.get(sn='SN-1'), report)
+        self.assertEqual(self.capacity(), {None: (48, 16000.0, 80), idc.id: (48, 4000.0, 64)})
+
+        delta = {'base_version': asset_handler.report_hash(report), 'version': 'v2', 'sections': {'cpu_core_count': 32},
+                 'ram': {'added': [{'slot': 'B0', 'capacity': 64}], 'removed': [{'slot': 'A0'}]}}
+        asset_handler.PatchAsset(None, models.Asset.objects.get(sn='SN-1'), delta)
+        self.assertEqual(self.capacity()[idc.id], (96, 4000.0, 32))
+
+        bu = models.BusinessUnit.objects.create(name='Games')
+        models.Asset.objects.filter(sn='SN-0').update(business_unit=bu)
+        self.assertEqual(self.capacity('business_unit'), {None: (144, 20000.0, 112)})
+        self.assertEqual(len(capacity_rollups.rebuild(check_only=True)), 2)
+        out = io.StringIO()
+        call_command('rebuild_capacity_rollups', stdout=out)
+        self.assertIn('2 groups drifted, rollups rebuilt', out.getvalue())
+        self.assertEqual(self.capacity('business_unit'), {None: (112, 12000.0, 72), bu.id: (32, 8000.0, 40)})
+
+        models.Asset.objects.get(sn='SN-0').delete()
+        models.RAM.objects.create(asset=models.Asset.objects.get(sn='SN-2'), slot='A9', capacity=8)
+        self.assertEqual(capacity_rollups.rebuild(check_only=True), [
+            ((0, 0), {'ram': 16, 'disk': 8000.0, 'cores': 40}, {'ram': 24, 'disk': 8000.0, 'cores': 40})])
+        self.assertEqual(self.client.get(reverse('assets:capacity'), {'by': 'rack'}).status_code, 400)
+
+
+class UnitTreeTest(CacheResetMixin, TestCase):
+
+    def closure(self):
+        return set(models.BusinessUnitClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def index_sns(self, unit):
+        return sorted(a.sn for a in self.client.get(reverse('assets:index'), {'bu': unit.id}).context['assets'])
+
+    def test_subtrees_follow_reparenting(self):
+        payments = models.BusinessUnit.objects.create(name='Payments')
+        cards = models.BusinessUnit.objects.create(name='Cards', parent_unit=payments)
+        fraud = models.BusinessUnit.objects.create(name='Fraud', parent_unit=cards)
+        wallet = models.BusinessUnit.objects.create(name='Wallet', parent_unit=payments)
+        games = models.BusinessUnit.objects.create(name='Games')
+        for sn, unit in (('SN-FRAUD', fraud), ('SN-WALLET', wallet), ('SN-GAMES', games)):
+            asset = create_server(sn)
+            asset_handler.UpdateAsset(None, asset, make_report(sn, ram_count=1))
+            asset.business_unit = unit
+            asset.save()
+
+        self.assertEqual(self.index_sns(payments), ['SN-FRAUD', 'SN-WALLET'])
+        self.assertEqual(sum(dashboard_counters.totals(payments.id).values()), 2)
+        self.assertEqual(capacity_rollups.rollup('idc', payments.id), {0: {'ram': 32, 'disk': 16000.0, 'cores': 80}})
+
+        # Pre-save lookup, cycle check, update, then one statement each to cut and to link the subtree.
+        cards = models.BusinessUnit.objects.get(pk=cards.pk)
+        cards.parent_unit = games
+        with self.assertNumQueries(5):
+            cards.save()
+        self.assertEqual(self.index_sns(payments), ['SN-WALLET'])
+        self.assertEqual(self.index_sns(games), ['SN-FRAUD', 'SN-GAMES'])
+        self.assertIn(('Games', 'Fraud', 2), self.closure())
+        self.assertFalse(models.BusinessUnitClosure.objects.filter(ancestor=payments, descendant=fraud).exists())
+
+        games.parent_unit = fraud
+        with self.assertRaises(ValueError):
+            games.save()
+        games.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            games.parent_unit = fraud
+            games.full_clean()
+
+        models.BusinessUnit.objects.get(pk=games.pk).delete()
+        self.assertEqual(self.index_sns(cards), ['SN-FRAUD'])
+        maintained = self.closure()
+        self.assertEqual(unit_tree.rebuild(), [])
+        self.assertEqual(self.closure(), maintained)
+
+        # A queryset update sends no signals, the command finds and repairs the drift.
+        models.BusinessUnit.objects.filter(pk=wallet.pk).update(parent_unit=cards)
+        out = io.StringIO()
+        call_command('rebuild_unit_tree', '--check', stdout=out)
+        self.assertIn('Business unit %s above %s: depth None -> 1' % (cards.id, wallet.id), out.getvalue())
+        self.assertIn('2 links drifted', out.getvalue())
+        self.assertIn(('Payments', 'Wallet', 1), self.closure())
+        call_command('rebuild_unit_tree', stdout=out)
+        self.assertIn(('Cards', 'Wallet', 1), self.closure())
+        self.assertEqual(unit_tree.rebuild(check_only=True), [])
+        self.assertEqual([unit.name for unit in unit_tree.ancestors(fraud.id)], ['Cards', 'Fraud'])
+
+
+class TopologyTest(CacheResetMixin, TestCase):
+
+    def build_fleet(self, prefix, host_count, vm_count):
+        """A chassis hosting host_count hypervisors with the VMs spread over them."""
+        chassis = create_server('%s-CHASSIS' % prefix)
+        models.Asset.objects.bulk_create([models.Asset(asset_type='server', name=sn, sn=sn) for sn in
+                                          ['%s-HOST-%s' % (prefix, i) for i in range(host_count)] +
+                                          ['%s-VM-%s' % (prefix, i) for i in range(vm_count)]])
+        ids = dict(models.Asset.objects.filter(sn__startswith=prefix + '-').values_list('sn', 'id'))
+        models.Server.objects.bulk_create([models.Server(asset_id=ids['%s-HOST-%s' % (prefix, i)],
+                                                         hosted_on=chassis.server) for i in range(host_count)])
+        hosts = list(models.Server.objects.filter(hosted_on=chassis.server).order_by('id'))
+        models.Server.objects.bulk_create([models.Server(asset_id=ids['%s-VM-%s' % (prefix, i)],
+                                                         hosted_on=hosts[i % host_count]) for i in range(vm_count)])
+        models.RAM.objects.bulk_create([models.RAM(asset_id=ids['%s-VM-%s' % (prefix, i)], slot='A0', capacity=8)
+                                        for i in range(vm_count)])
+        return chassis, ids
+
+    def test_subtree_and_hosts(self):
+        chassis, ids = self.build_fleet('S', 3, 30)
+        vm = models.Asset.objects.get(sn='S-VM-4')
+        nested = create_server('S-NESTED')
+        nested.server.hosted_on = vm.server
+        nested.server.save()
+        asset_handler.UpdateAsset(None, nested, make_report('S-NESTED'))
+
+        self.assertEqual(topology.hosts(nested.id), [nested.id, vm.id, ids['S-HOST-1'], chassis.id])
+        self.assertEqual(len(topology.blast_radius(chassis.id)), 34)
+        self.assertEqual(topology.blast_radius(ids['S-HOST-1']), sorted(
+            [ids['S-VM-%s' % i] for i in range(1, 30, 3)] + [nested.id]))
+
+        # hosts, the servers, then ram, disk and nic
+        with self.assertNumQueries(5):
+            data = self.client.get(reverse('assets:topology', args=(chassis.id,))).json()
+        self.assertEqual(data['blast_radius'], 34)
+        self.assertEqual(data['totals']['ram'], 30 * 8 + 32)
+        self.assertEqual((data['totals']['disk_count'], data['totals']['cores']), (2, 40 + 1))
+        self.assertEqual([(node['sn'], node['depth']) for node in data['nodes'][:2]], [('S-CHASSIS', 0), ('S-HOST-0', 1)])
+        self.assertEqual(data['nodes'][-1]['host'], vm.id)
+
+        big, _ = self.build_fleet('B', 10, 500)
+        with self.assertNumQueries(5):
+            data = self.client.get(reverse('assets:topology', args=(big.id,))).json()
+        self.assertEqual(len(data['nodes']), 511)
+
+        # A hosted_on cycle ends at the depth cap, every server is reported once.
+        chassis.server.hosted_on = vm.server
+        chassis.server.save()
+        self.assertEqual(len(topology.subtree(chassis.id)), 35)
+        self.assertEqual(topology.hosts(chassis.id), [chassis.id, vm.id, ids['S-HOST-1']])
+        self.assertEqual(self.client.get(reverse('assets:topology', args=(0,))).status_code, 404)
+
+
+class AdminTest(CacheResetMixin, TestCase):
+
+    changelists = ('asset', 'server', 'cpu', 'ram', 'disk', 'nic', 'eventlog', 'assethistory', 'newassetapprovalzone',
+                   'approvaljob', 'businessunit', 'idc', 'manufacturer', 'contract', 'software', 'tag',
+                   'networkdevice', 'storagedevice', 'securitydevice')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def add_assets(self, start, count):
+        unit = models.BusinessUnit.objects.create(name='BU-%s' % start)
+        for i in range(start, start + count):
+            sn = 'SN-%s' % i
+            with self.captureOnCommitCallbacks(execute=True):
+                asset = create_server(sn)
+                asset_handler.UpdateAsset(None, asset, make_report(sn, nic_count=1))
+            asset.idc = models.IDC.objects.get_or_create(name='IDC-%s' % i)[0]
+            asset.business_unit = unit
+            asset.save()
+            asset_handler.NewAsset(None, make_report('NEW-%s' % i)).add_to_new_assets_zone()
+        event_sink.sink.flush()
+        search_index.indexer.flush()
+
+    def changelist_queries(self):
+        counts = dict()
+        # Without the cached table counts, so every list runs its COUNT.
+        cache.clear()
+        for name in self.changelists:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('admin:assets_%s_changelist' % name))
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_changelists_do_not_grow_with_rows(self):
+        self.add_assets(0, 2)
+        before = self.changelist_queries()
+        self.add_assets(2, 8)
+        self.assertEqual(self.changelist_queries(), before)
+
+    def test_search_uses_indexed_lookups(self):
+        self.add_assets(0, 3)
+        url = reverse('admin:assets_asset_changelist')
+        self.assertEqual([a.sn for a in self.client.get(url, {'q': '00:11:22:33:44:00'}).context['cl'].result_list],
+                         ['SN-2', 'SN-1', 'SN-0'])
+        self.assertEqual([a.sn for a in self.client.get(url, {'q': 'SN-1'}).context['cl'].result_list], ['SN-1'])
+        result = self.client.get(reverse('admin:assets_ram_changelist'), {'q': 'SN-2'}).context['cl'].result_list
+        self.assertEqual({ram.asset.sn for ram in result}, {'SN-2'})
+        result = self.client.get(reverse('admin:assets_nic_changelist'), {'q': '10.0.0.0/24'}).context['cl'].result_list
+        self.assertEqual(len(result), 3)
+
+    def test_estimated_count(self):
+        cache.clear()
+        self.add_assets(0, 3)
+        url = reverse('admin:assets_ram_changelist')
+        models.RAM.objects.filter(slot='A0').delete()
+        # Unfiltered: a cached COUNT, not thrown off by the deleted rows.
+        self.assertEqual(self.client.get(url).context['cl'].result_count, 3)
+        self.assertEqual(self.client.get(url, {'q': 'SN-1'}).context['cl'].result_count, 1)
+
+        ram_admin = admin.site._registry[models.RAM]
+        self.addCleanup(setattr, ram_admin, 'list_per_page', ram_admin.list_per_page)
+        ram_admin.list_per_page = 1
+        with self.settings(ADMIN_COUNT_LIMIT=1):
+            response = self.client.get(url, {'slot': 'A1'})
+            self.assertEqual(response.context['cl'].result_count, 2)
+            self.assertContains(response, '2+ ')
+            # Past the first count, the page is still there and the count grows with it.
+            response = self.client.get(url, {'slot': 'A1', 'p': 3})
+            self.assertEqual((response.context['cl'].result_count, len(response.context['cl'].result_list)), (3, 1))
+            self.assertEqual(str(response.context['cl'].result_count), '3')
+
+
+class ConditionalGetTest(CacheResetMixin, TestCase):
+
+    def revalidate(self, url, response, queries, **params):
+        with self.assertNumQueries(queries):
+            return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag']).status_code
+
+    def test_unchanged_pages_are_not_rendered(self):
+        fragment_cache.cache().clear()
+        asset = create_server('SN-0')
+        asset_handler.UpdateAsset(None, asset, make_report('SN-0'))
+        create_server('SN-1')
+
+        url = reverse('assets:index')
+        response = self.client.get(url, {'type': 'server'})
+        self.assertEqual(self.revalidate(url, response, 1, type='server'), 304)
+        self.assertEqual(self.revalidate(url, response, 5), 200)
+        models.Asset.objects.get(sn='SN-1').delete()
+        self.assertEqual(self.revalidate(url, response, 5, type='server'), 200)
+        response = self.client.get(url)
+        asset.tags.add(models.Tag.objects.create(name='db'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        url = reverse('assets:dashboard')
+        response = self.client.get(url)
+        # counters and software count
+        self.assertEqual(self.revalidate(url, response, 2), 304)
+        asset = models.Asset.objects.get(pk=asset.pk)
+        asset.status = 1
+        asset.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        url = reverse('assets:detail', args=(asset.id,))
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response, 1), 304)
+        ram = models.RAM.objects.filter(asset=asset).first()
+        ram.capacity = 64
+        ram.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(reverse('assets:detail', args=(0,))).status_code, 404)
+
+    def test_device_edits_move_the_index_etag(self):
+        asset = create_server('SN-0')
+        url = reverse('assets:index')
+        response = self.client.get(url)
+        server = models.Server.objects.get(asset=asset)
+        server.sub_asset_type = 1
+        server.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_is_not_revalidated_by_date(self):
+        asset = create_server('SN-0')
+        url = reverse('assets:detail', args=(asset.id,))
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        since = http_date()
+        models.NIC.objects.create(asset=asset, name='eth9', model='X540', mac='00:00:00:00:00:09')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('eth9', response.content.decode())
+
+    def test_report_acknowledgement_carries_the_version(self):
+        data = make_report('SN-ACK')
+        response = self.client.post(reverse('assets:report'), {'asset_data': json.dumps(data)})
+        self.assertEqual(response['ETag'], '"%s"' % asset_handler.report_hash(data))
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        fragment_cache.cache().clear()
+
+    def get_detail(self, asset):
+        return self.client.get(reverse('assets:detail', args=(asset.id,))).content.decode()
+
+    def test_fragments_are_reused_until_the_asset_changes(self):
+        asset = create_server('SN-FRAG')
+        models.RAM.objects.create(asset=asset, slot='A0', model='DDR4')
+        self.assertIn('DDR4', self.get_detail(asset))
+        before = fragment_cache.stats()
+        # Only the asset itself is read on a hit.
+        with self.assertNumQueries(1):
+            self.assertIn('DDR4', self.get_detail(asset))
+        self.assertEqual(fragment_cache.stats()['hits'], before['hits'] + 1)
+
+        # Component and tag edits show up, a queryset update of a tag's name through the global generation.
+        models.RAM.objects.filter(asset=asset).update(model='DDR5')
+        models.RAM.objects.get(asset=asset).save()
+        self.assertIn('DDR5', self.get_detail(asset))
+        asset.tags.add(models.Tag.objects.create(name='frag-tag'))
+        self.assertIn('frag-tag', self.get_detail(asset))
+        models.Tag.objects.filter(name='frag-tag').update(name='renamed-tag')
+        models.Tag.objects.get(name='renamed-tag').save()
+        self.assertIn('renamed-tag', self.client.get(reverse('assets:index')).content.decode())
+
+        asset.name = 'renamed-asset'
+        asset.save()
+        self.assertIn('renamed-asset', self.get_detail(asset))
+        self.assertEqual(self.client.get(reverse('assets:fragment_cache_stats')).json()['backend'], 'LocMemCache')
+
+    def test_component_edits_reach_processes_that_miss_the_generation(self):
+        asset = create_server('SN-FRAG')
+        ram = models.RAM.objects.create(asset=asset, slot='A0', model='DDR4')
+        self.assertIn('DDR4', self.get_detail(asset))
+        keys = [fragment_cache.GLOBAL_GENERATION, fragment_cache.generation_key(asset.id)]
+        old = fragment_cache.cache().get_many(keys)
+        ram.model = 'DDR5'
+        ram.save()
+        # Another process's locmem cache still holds the old generations, the new m_time misses its fragment.
+        fragment_cache.cache().set_many(old, None)
+        self.assertIn('DDR5', self.get_detail(asset))
+
+    def test_index_page_reads_its_fragments_at_once(self):
+        caches = dict(settings.CACHES, shared=settings.FRAGMENT_CACHE_BACKENDS['db'])
+        with self.settings(CACHES=caches, FRAGMENT_CACHE_ALIAS='shared'):
+            call_command('createcachetable', 'cmdb_fragment_cache', verbosity=0)
+            table = settings.FRAGMENT_CACHE_BACKENDS['db']['LOCATION']
+            for count in (3, 6):
+                while models.Asset.objects.count() < count:
+                    create_server('SN-PAGE-%s' % models.Asset.objects.count())
+                self.client.get(reverse('assets:index'))
+                before = fragment_cache.stats()
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('assets:index'))
+                self.assertEqual(fragment_cache.stats()['hits'], before['hits'] + count)
+                # The generations of the ETag, then every fragment of the page.
+                self.assertEqual(len([q for q in queries if table in q['sql']]), 2)
+
+
+class ExportTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            asset_handler.UpdateAsset(None, create_server('SN-%s' % i), make_report('SN-%s' % i, ram_count=i))
+
+    def test_ndjson_streams_assets_with_components(self):
+        # Per chunk: assets, RAM, disks, NICs.
+        with self.settings(EXPORT_CHUNK_SIZE=2), self.assertNumQueries(3 * 4 + 1):
+            response = self.client.get(reverse('assets:export'))
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        assets = [json.loads(line) for line in lines]
+        self.assertEqual([asset['sn'] for asset in assets], ['SN-%s' % i for i in range(5)])
+        self.assertEqual([len(asset['ram']) for asset in assets], [0, 1, 2, 3, 4])
+        self.assertEqual(assets[3]['model'], 'PowerEdge R740')
+        self.assertEqual(assets[3]['nic'][1]['mac'], '00:11:22:33:44:01')
+
+    def test_csv_and_command(self):
+        response = self.client.get(reverse('assets:export'), {'format': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual((rows[2]['sn'], rows[2]['ram_count'], rows[2]['ram_capacity']), ('SN-2', '2', '32'))
+        self.assertEqual(self.client.get(reverse('assets:export'), {'format': 'xml'}).status_code, 400)
+
+        out = io.StringIO()
+        call_command('export_assets', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+
+class SearchIndexTest(CacheResetMixin, TestCase):
+
+    def search(self, q):
+        return [r['sn'] for r in self.client.get(reverse('assets:search_api'), {'q': q}).json()['results']]
+
+    def test_assets_are_found_by_serial_mac_ip_and_model(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                asset = create_server('SRV-%s' % i)
+                asset_handler.UpdateAsset(None, asset, make_report('SRV-%s' % i, nic_count=i + 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            asset_handler.UpdateAsset(None, models.Asset.objects.get(sn='SRV-2'),
+                                      make_report('SRV-2', nic_count=1, model='PowerEdge R750'))
+        # Without the timer thread of the servers, the test reindexes the waiting ids itself.
+        self.assertEqual(search_index.indexer.flush(), 3)
+
+        self.assertEqual(self.search('RV-1'), ['SRV-1'])
+        self.assertEqual(self.search('00:11:22:33:44:01'), ['SRV-1'])
+        self.assertEqual(self.search('001122334401'), ['SRV-1'])
+        self.assertEqual(self.search('10.0.0.2'), ['SRV-1'])
+        self.assertEqual(self.search('R750'), ['SRV-2'])
+        self.assertEqual(sorted(self.search('DISK-SRV')), ['SRV-0', 'SRV-1', 'SRV-2'])
+        self.assertEqual(self.search('R740 SRV-0'), ['SRV-0'])
+        self.assertEqual(self.search('ab'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Asset.objects.get(sn='SRV-1').delete()
+        search_index.indexer.flush()
+        self.assertEqual(self.search('00:11:22:33:44:01'), [])
+        self.assertEqual(self.client.get(reverse('assets:search'), {'q': 'SRV-2'}).context['assets'][0].sn, 'SRV-2')
+
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(sorted(self.search('SRV')), ['SRV-0', 'SRV-2'])
+
+    def test_search_page_query_count_does_not_depend_on_hits(self):
+        fragment_cache.cache().clear()
+        for count in (3, 6):
+            with self.captureOnCommitCallbacks(execute=True):
+                while models.Asset.objects.count() < count:
+                    asset = create_server('SRV-%s' % models.Asset.objects.count())
+                    asset.tags.add(models.Tag.objects.get_or_create(name='search')[0])
+            search_index.indexer.flush()
+            # The index, the assets with their devices, IDC and business unit, their tags, the filter choices.
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('assets:search'), {'q': 'SRV'})
+            self.assertEqual(len(response.context['assets']), count)
+
+    def test_reports_leave_the_reindex_to_the_timer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            asset = create_server('SRV-0')
+            asset_handler.UpdateAsset(None, asset, make_report('SRV-0'))
+        search_index.indexer.flush()
+        data = {'asset_data': json.dumps(make_report('SRV-0', nic_count=1))}
+        # The report, the history, the components and the asset; the on_commit callbacks don't query.
+        with self.assertNumQueries(13):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('assets:report'), data)
+        self.assertEqual(search_index.indexer.ids, {asset.id})
+        self.assertEqual(self.search('00:11:22:33:44:01'), ['SRV-0'])
+        self.assertEqual(search_index.indexer.flush(), 1)
+        self.assertEqual(self.search('00:11:22:33:44:01'), [])
+
+        with self.settings(SEARCH_INDEX_DELAY=0), self.assertNumQueries(13 + 6):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('assets:report'), {'asset_data': json.dumps(make_report('SRV-0'))})
+        self.assertEqual(self.search('00:11:22:33:44:01'), ['SRV-0'])
+
+
+class IPIndexTest(CacheResetMixin, TestCase):
+
+    def lookup(self, cidr):
+        return self.client.get(reverse('assets:ip_lookup'), {'cidr': cidr})
+
+    def test_cidr_lookup_and_conflicts(self):
+        first = create_server('SRV-A')
+        asset_handler.UpdateAsset(None, first, make_report('SRV-A', nic_count=2))
+        second = create_server('SRV-B')
+        report = make_report('SRV-B', nic_count=1)
+        report['nic'].append({'name': 'eth1', 'model': 'Intel X710', 'mac': '00:11:22:33:55:01',
+                              'ip_address': '2001:db8::10', 'net_mask': ['ffff:ffff::']})
+        asset_handler.UpdateAsset(None, second, report)
+        models.Asset.objects.filter(pk=second.pk).update(manage_ip='192.168.1.9')
+        manager = create_server('SRV-C')
+        manager.manage_ip = '10.0.0.200'
+        manager.save()
+
+        self.assertEqual(models.NIC.objects.get(ip_address='10.0.0.2').ip_key, '00000000000000000000ffff0a000002')
+        data = self.lookup('10.0.0.0/24').json()
+        self.assertEqual([nic['ip_address'] for nic in data['nics']], ['10.0.0.1', '10.0.0.1', '10.0.0.2'])
+        self.assertEqual([asset['sn'] for asset in data['assets']], ['SRV-A', 'SRV-B', 'SRV-C'])
+        self.assertEqual([nic['asset__sn'] for nic in self.lookup('10.0.0.2/32').json()['nics']], ['SRV-A'])
+        self.assertEqual([nic['asset__sn'] for nic in self.lookup('2001:db8::/32').json()['nics']], ['SRV-B'])
+        self.assertEqual(self.lookup('10.0.0.0/24').json()['nics'], self.lookup('10.0.0.7/24').json()['nics'])
+        # The manage_ip update above went through a queryset, only saves maintain the key.
+        self.assertEqual(self.lookup('192.168.0.0/16').json()['assets'], [])
+        self.assertEqual(self.lookup('10.0.0.0/33').status_code, 400)
+
+        conflicts = self.client.get(reverse('assets:ip_conflicts')).json()['conflicts']
+        self.assertEqual([c['ip_address'] for c in conflicts], ['10.0.0.1'])
+        self.assertEqual(sorted(a['sn'] for a in conflicts[0]['assets']), ['SRV-A', 'SRV-B'])
+
+        manager.manage_ip = '10.0.0.2'
+        manager.save(update_fields=['manage_ip'])
+        self.assertEqual([c['ip_address'] for c in ip_index.conflicts()], ['10.0.0.1', '10.0.0.2'])
+        out = io.StringIO()
+        call_command('ip_conflicts', stdout=out)
+        self.assertIn('2 conflicting addresses', out.getvalue())
+
+
+class AsyncViewsTest(CacheResetMixin, TransactionTestCase):
+    # The ORM work runs in executor threads with their own connections, so no wrapping transaction.
+
+    def test_async_report_and_read_views(self):
+        asset = create_server('SN-OLD')
+        response = self.client.post(reverse('assets:report_async'), {'asset_data': json.dumps(make_report('SN-NEW'))})
+        self.assertEqual(response.content, 'Asset has been added in New Asset Zone！'.encode())
+        response = self.client.post(reverse('assets:report_async'), {'asset_data': json.dumps(make_report('SN-OLD'))})
+        self.assertEqual(response.content, b'Assets Data Updated!')
+        self.assertEqual(models.RAM.objects.filter(asset=asset).count(), 2)
+
+        self.assertEqual(self.client.get(reverse('assets:index_async')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('assets:detail_async', args=(asset.id,))).status_code, 200)
+
+
+class DBWriterTest(CacheResetMixin, TransactionTestCase):
+    # The writer thread has its own connection, so no wrapping transaction.
+
+    def setUp(self):
+        super().setUp()
+        db_writer.stats.reset()
+        self.addCleanup(db_writer.writer.stop)
+
+    def test_pragmas_run_on_new_connections(self):
+        with self.settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            db_writer.tune_connection(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 1234)
+
+    def test_locked_write_is_retried(self):
+        calls = []
+
+        def locked_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return 'written'
+
+        def always_locked():
+            raise OperationalError('database is locked')
+
+        with self.settings(SQLITE_RETRY_DELAY=0):
+            self.assertEqual(db_writer.write(locked_once), 'written')
+            with self.assertRaises(OperationalError):
+                db_writer.write(always_locked)
+        stats = db_writer.stats.as_dict()
+        self.assertEqual((stats['writes'], stats['retries'], stats['failures']), (1, 4, 1))
+
+    def test_reports_go_through_the_writer_thread(self):
+        asset = create_server('SN-OLD')
+        with self.settings(SQLITE_WRITE_QUEUE=True):
+            response = self.client.post(reverse('assets:report'), {'asset_data': json.dumps(make_report('SN-OLD'))})
+            self.assertEqual(response.content, b'Assets Data Updated!')
+            self.assertTrue(db_writer.writer.thread.is_alive())
+        self.assertEqual(models.RAM.objects.filter(asset=asset).count(), 2)
+        stats = self.client.get(reverse('assets:db_writer_stats')).json()
+        self.assertEqual((stats['writes'], stats['queued']), (1, 0))
+
+        db_writer.writer.stop()
+        self.assertIsNone(db_writer.writer.thread)
+
+    def test_update_waits_for_a_real_lock(self):
+        asset = create_server('SN-LOCK')
+        asset_handler.UpdateAsset(None, asset, make_report('SN-LOCK'))
+        # Another connection to the same database writes to the RAM table and holds the lock for a moment,
+        # the update reads that table inside its transaction.
+        other = sqlite3.connect(connection.settings_dict['NAME'], uri=True, isolation_level=None,
+                                check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        other.execute("INSERT INTO assets_ram (asset_id, slot, capacity) VALUES (%s, 'X', 1)" % asset.id)
+        release = threading.Timer(0.1, other.execute, ['ROLLBACK'])
+        release.start()
+        self.addCleanup(release.join)
+
+        with self.settings(SQLITE_WRITE_RETRIES=6, SQLITE_RETRY_DELAY=0.02):
+            response = self.client.post(reverse('assets:report'),
+                                        {'asset_data': json.dumps(make_report('SN-LOCK', ram_count=3))})
+        self.assertEqual(response.content, b'Assets Data Updated!')
+        self.assertGreater(db_writer.stats.as_dict()['retries'], 0)
+        self.assertEqual(models.RAM.objects.filter(asset=asset).count(), 3)
+        event_sink.sink.flush()
+        self.assertFalse(models.EventLog.objects.filter(detail__startswith='Update failed').exists())
+
+
+class WireFormatTest(CacheResetMixin, TestCase):
+
+    def post_report(self, body, content_type, **headers):
+        return self.client.post(reverse('assets:report'), data=body, content_type=content_type, **headers)
+
+    def test_server_advertises_formats(self):
+        response = self.client.get(reverse('assets:report'))
+        self.assertIn('application/json', response['Accept-Post'])
+        self.assertEqual(response['Accept-Encoding'], 'gzip')
+
+    def test_raw_and_gzipped_json(self):
+        body = json.dumps(make_report('SN-JSON')).encode()
+        response = self.post_report(body, 'application/json')
+        self.assertEqual(response.content, 'Asset has been added in New Asset Zone！'.encode())
+
+        body = json.dumps(make_report('SN-GZIP')).encode()
+        self.post_report(gzip.compress(body), 'application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(models.NewAssetApprovalZone.objects.count(), 2)
+
+    def test_gzipped_form(self):
+        body = urllib.parse.urlencode({'asset_data': json.dumps(make_report('SN-FORM'))}).encode()
+        self.post_report(gzip.compress(body), 'application/x-www-form-urlencoded', HTTP_CONTENT_ENCODING='gzip')
+        self.assertTrue(models.NewAssetApprovalZone.objects.filter(sn='SN-FORM').exists())
+
+    @unittest.skipIf(wire.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        body = wire.msgpack.packb(make_report('SN-PACK'), use_bin_type=True)
+        self.post_report(body, 'application/msgpack')
+        self.assertTrue(models.NewAssetApprovalZone.objects.filter(sn='SN-PACK').exists())
+
+    def test_rejected_bodies(self):
+        self.assertEqual(self.post_report(b'<xml/>', 'text/xml').status_code, 415)
+        self.assertEqual(self.post_report(b'{}', 'application/json', HTTP_CONTENT_ENCODING='br').status_code, 415)
+        self.assertEqual(self.post_report(b'not gzip', 'application/json',
+                                          HTTP_CONTENT_ENCODING='gzip').status_code, 400)
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000):
+            bomb = gzip.compress(b' ' * 10000)
+            self.assertEqual(self.post_report(bomb, 'application/json',
+                                              HTTP_CONTENT_ENCODING='gzip').status_code, 413)
+
+
+class DeltaReportTest(CacheResetMixin, TestCase):
+
+    def post(self, name, data):
+        return self.client.post(reverse(name), data=json.dumps(data), content_type='application/json')
+
+    def test_delta_applies_on_acknowledged_version(self):
+        asset = create_server('SN-DELTA')
+        old = make_report('SN-DELTA', ram_count=3)
+        version = self.post('assets:report', old)['X-Report-Version']
+
+        new = make_report('SN-DELTA', ram_count=3, os_release='Ubuntu 24.04 LTS')
+        del new['ram'][0]
+        new['ram'].append({'slot': 'B0', 'capacity': 32})
+        new['nic'][1]['ip_address'] = '10.0.1.2'
+        delta = client_delta.build_delta(old, new, version)
+        self.assertEqual(delta['sections'], {'os_release': 'Ubuntu 24.04 LTS'})
+        self.assertNotIn('physical_disk_driver', delta)
+
+        response = self.post('assets:report_delta', delta)
+
+        self.assertEqual(response.content, b'Assets Data Updated!')
+        self.assertEqual(response['X-Report-Version'], asset_handler.report_hash(new))
+        asset.refresh_from_db()
+        self.assertEqual(asset.report_hash, asset_handler.report_hash(new))
+        self.assertEqual(asset.server.os_release, 'Ubuntu 24.04 LTS')
+        self.assertEqual(sorted(asset.ram_set.values_list('slot', flat=True)), ['A1', 'A2', 'B0'])
+        self.assertEqual(asset.nic_set.get(name='eth1').ip_address, '10.0.1.2')
+        self.assertEqual(asset.disk_set.count(), 2)
+        # A full report of the same document is now recognised as unchanged.
+        self.assertEqual(self.post('assets:report', new).content, b'Assets Data Unchanged!')
+
+    def test_version_mismatch_asks_for_full_report(self):
+        create_server('SN-DELTA')
+        old = make_report('SN-DELTA')
+        self.post('assets:report', old)
+
+        delta = client_delta.build_delta(old, make_report('SN-DELTA', ram_count=1), 'stale')
+        self.assertEqual(self.post('assets:report_delta', delta).status_code, 409)
+        delta['sn'] = 'SN-UNKNOWN'
+        self.assertEqual(self.post('assets:report_delta', delta).status_code, 409)
+
+
+class BulkApproveTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        for i in range(5):
+            asset_handler.NewAsset(None, make_report('SN-%s' % i)).add_to_new_assets_zone()
+
+    def test_chunks_with_failures_isolated(self):
+        bad = models.NewAssetApprovalZone.objects.get(sn='SN-1')
+        bad.payload = report_payload.dump(make_report('SN-1', ram=[{'capacity': 8}]))
+        bad.save()
+        # Already online under the same name, fails inside the bulk write of its chunk.
+        models.Asset.objects.create(name='server: SN-3', sn='SN-3-OLD')
+        ids = models.NewAssetApprovalZone.objects.values_list('id', flat=True)
+        progress = []
+
+        with self.captureOnCommitCallbacks(execute=True):
+            approved, failed = asset_handler.BulkApproveAsset(
+                self.user, ids, chunk_size=2, progress=lambda *args: progress.append(args)).run()
+        event_sink.sink.flush()
+
+        self.assertEqual((approved, failed), (3, 2))
+        self.assertEqual(progress[-1], (3, 2))
+        self.assertEqual(sorted(models.NewAssetApprovalZone.objects.values_list('sn', flat=True)), ['SN-1', 'SN-3'])
+        asset = models.Asset.objects.get(sn='SN-4')
+        self.assertEqual(asset.approved_by, self.user)
+        self.assertEqual(asset.manufacturer.name, 'Dell Inc.')
+        self.assertEqual(asset.cpu.cpu_core_count, 40)
+        self.assertEqual(asset.server.model, 'PowerEdge R740')
+        self.assertEqual((asset.ram_set.count(), asset.disk_set.count(), asset.nic_set.count()), (2, 2, 2))
+        self.assertEqual(asset.report_hash, asset_handler.report_hash(make_report('SN-4')))
+        state = asset_history.asset_state(asset.id)
+        self.assertEqual((state['fields']['model'], len(state['ram']), len(state['nic'])), ('PowerEdge R740', 2, 2))
+        self.assertEqual(models.EventLog.objects.filter(asset__isnull=False).count(), 3)
+        self.assertEqual(models.EventLog.objects.filter(new_asset__isnull=False).count(), 2)
+
+    def test_admin_action_approves_across_pages(self):
+        self.client.force_login(self.user)
+        with self.settings(APPROVAL_JOB_IN_THREAD=False):
+            self.client.post(reverse('admin:assets_newassetapprovalzone_changelist'), {
+                'action': 'approve_selected_new_assets', 'select_across': '1',
+                '_selected_action': [models.NewAssetApprovalZone.objects.first().id]})
+        job = models.ApprovalJob.objects.get()
+        self.assertEqual((job.status, job.total), ('pending', 5))
+
+        call_command('run_approval_jobs', stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.approved, job.failed, job.progress()), ('done', 5, 0, '100%'))
+        self.assertFalse(models.NewAssetApprovalZone.objects.exists())
+
+    def test_stale_job_resumes_with_its_counts(self):
+        ids = sorted(models.NewAssetApprovalZone.objects.values_list('id', flat=True))
+        job = models.ApprovalJob.objects.create(user=self.user, new_asset_ids=json.dumps(ids), total=len(ids))
+        # The first worker approved two assets, then stopped reporting.
+        asset_handler.BulkApproveAsset(self.user, ids[:2]).run()
+        models.ApprovalJob.objects.filter(pk=job.pk).update(
+            status='running', approved=2, m_time=timezone.now() - timedelta(hours=1))
+        live = models.ApprovalJob.objects.create(user=self.user, new_asset_ids=json.dumps(ids[2:]), status='running')
+
+        call_command('run_approval_jobs', stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.approved, job.failed, job.progress()), ('done', 5, 5, 0, '100%'))
+        live.refresh_from_db()
+        self.assertEqual((live.status, live.approved), ('running', 0))
+
+    def test_job_is_claimed_once(self):
+        job = models.ApprovalJob.objects.create(user=self.user, new_asset_ids='[]')
+        heartbeat = asset_handler.claim_approval_job(job.id)
+        self.assertIsNotNone(heartbeat)
+        self.assertIsNone(asset_handler.claim_approval_job(job.id))
+        self.assertIsNone(asset_handler.claim_approval_job(job.id, stale_before=heartbeat))
+        # Taken over once the heartbeat is stale, the first worker can't write to the job any more.
+        self.assertIsNotNone(asset_handler.claim_approval_job(job.id, stale_before=heartbeat + timedelta(seconds=1)))
+        self.assertFalse(models.ApprovalJob.objects.filter(pk=job.id, m_time=heartbeat).exists())
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.db import connection
+
+from assets import models
+
+SERVER = models.Server._meta.db_table
+ASSET = models.Asset._meta.db_table
+CPU = models.CPU._meta.db_table
+
+# The start server at depth 0, then one step per level. The depth cap also stops hosted_on cycles.
+# Down follows the VMs hosted on a server, parent_asset_id is the host they were reached from.
+DOWN = '''WITH RECURSIVE tree(server_id, asset_id, parent_asset_id, depth) AS (
+    SELECT id, asset_id, NULL, 0 FROM {server} WHERE asset_id = %s
+    UNION ALL
+    SELECT s.id, s.asset_id, tree.asset_id, tree.depth + 1
+    FROM {server} s JOIN tree ON s.hosted_on_id = tree.server_id WHERE tree.depth < %s
+)'''.format(server=SERVER)
+
+# Up follows hosted_on.
+UP = '''WITH RECURSIVE tree(server_id, asset_id, host_id, depth) AS (
+    SELECT id, asset_id, hosted_on_id, 0 FROM {server} WHERE asset_id = %s
+    UNION ALL
+    SELECT s.id, s.asset_id, s.hosted_on_id, tree.depth + 1
+    FROM {server} s JOIN tree ON s.id = tree.host_id WHERE tree.depth < %s
+)'''.format(server=SERVER)
+
+# Component totals per asset of the tree, one query per table.
+SUMMARIES = (
+    ('ram', models.RAM._meta.db_table, 'COUNT(*), SUM(capacity)'),
+    ('disk', models.Disk._meta.db_table, 'COUNT(*), SUM(capacity)'),
+    ('nic', models.NIC._meta.db_table, 'COUNT(*)'),
+)
+
+
+def max_depth():
+    return getattr(settings, 'TOPOLOGY_MAX_DEPTH', 16)
+
+
+def _fetch(cte, asset_id, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(cte + ' ' + sql, [asset_id, max_depth()])
+        return cursor.fetchall()
+
+
+def hosted(asset_id):
+    """
+    The server and everything transitively hosted on it as (asset id, host asset id, depth),
+    each server once at its smallest depth. One query.
+    """
+    seen = dict()
+    for row_asset_id, host_id, depth in _fetch(
+            DOWN, asset_id, 'SELECT asset_id, parent_asset_id, depth FROM tree ORDER BY depth'):
+        seen.setdefault(row_asset_id, (row_asset_id, host_id, depth))
+    return list(seen.values())
+
+
+def hosts(asset_id):
+    """Asset ids of the server and the chain of hosts it runs on, nearest first. One query."""
+    chain = []
+    for row in _fetch(UP, asset_id, 'SELECT asset_id FROM tree ORDER BY depth'):
+        if row[0] in chain:
+            break
+        chain.append(row[0])
+    return chain
+
+
+def blast_radius(asset_id):
+    """Asset ids that go down with this server, one query."""
+    rows = _fetch(DOWN, asset_id, 'SELECT DISTINCT asset_id FROM tree WHERE depth > 0')
+    return sorted(row[0] for row in rows if row[0] != asset_id)
+
+
+def subtree(asset_id):
+    """
+    The server and everything hosted on it with a summary of their components, parents before children.
+    The tree is walked once per query: one for the servers with their asset and CPU, one per component table.
+    """
+    nodes = dict()
+    for row in _fetch(DOWN, asset_id, '''
+            SELECT tree.asset_id, tree.parent_asset_id, tree.depth, a.sn, a.name, a.status, cpu.cpu_core_count
+            FROM tree JOIN {asset} a ON a.id = tree.asset_id LEFT JOIN {cpu} cpu ON cpu.asset_id = tree.asset_id
+            ORDER BY tree.depth, tree.asset_id'''.format(asset=ASSET, cpu=CPU)):
+        if row[0] in nodes:
+            continue
+        nodes[row[0]] = {'asset_id': row[0], 'host': row[1], 'depth': row[2], 'sn': row[3], 'name': row[4],
+                         'status': row[5], 'cores': row[6] or 0, 'ram_count': 0, 'ram': 0,
+                         'disk_count': 0, 'disk': 0, 'nic_count': 0}
+    if not nodes:
+        return []
+    for name, table, columns in SUMMARIES:
+        for row in _fetch(DOWN, asset_id, 'SELECT asset_id, %s FROM %s WHERE asset_id IN (SELECT asset_id FROM tree) '
+                                          'GROUP BY asset_id' % (columns, table)):
+            node = nodes[row[0]]
+            node['%s_count' % name] = row[1]
+            if len(row) > 2:
+                node[name] = row[2] or 0
+    return list(nodes.values())
+
+
+def totals(nodes):
+    """Summed component summaries of subtree() nodes."""
+    keys = ('cores', 'ram_count', 'ram', 'disk_count', 'disk', 'nic_count')
+    return {key: sum(node[key] for node in nodes) for key in keys}
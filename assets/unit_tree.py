@@ -0,0 +1,113 @@
+from django.db import connection, transaction
+from django.db.models.signals import post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from assets import models
+
+TABLE = models.BusinessUnitClosure._meta.db_table
+
+
+def subtree(unit_id):
+    """Ids of the unit and every unit below it, as a subquery for `business_unit_id__in=`."""
+    return models.BusinessUnitClosure.objects.filter(ancestor_id=unit_id).values('descendant_id')
+
+
+def ancestors(unit_id):
+    """The unit and its parents, root first."""
+    return [link.ancestor for link in models.BusinessUnitClosure.objects.filter(
+        descendant_id=unit_id).select_related('ancestor').order_by('-depth')]
+
+
+def insert(unit_id, parent_id):
+    """Link a new unit to itself and to every ancestor of its parent, one statement."""
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO %s (ancestor_id, descendant_id, depth) VALUES (%%s, %%s, 0)' % TABLE,
+                       [unit_id, unit_id])
+        if parent_id:
+            cursor.execute('INSERT INTO %s (ancestor_id, descendant_id, depth) '
+                           'SELECT ancestor_id, %%s, depth + 1 FROM %s WHERE descendant_id = %%s' % (TABLE, TABLE),
+                           [unit_id, parent_id])
+
+
+def detach(unit_id):
+    """Cut the links between the subtree of the unit and the units above it, one statement."""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE descendant_id IN (SELECT descendant_id FROM %s WHERE ancestor_id = %%s) '
+                       'AND ancestor_id NOT IN (SELECT descendant_id FROM %s WHERE ancestor_id = %%s)'
+                       % (TABLE, TABLE, TABLE), [unit_id, unit_id])
+
+
+def attach(unit_id, parent_id):
+    """Link every ancestor of parent_id to every unit of the subtree, one statement whatever the subtree size."""
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO %s (ancestor_id, descendant_id, depth) '
+                       'SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1 '
+                       'FROM %s above, %s below WHERE above.descendant_id = %%s AND below.ancestor_id = %%s'
+                       % (TABLE, TABLE, TABLE), [parent_id, unit_id])
+
+
+def move(unit_id, parent_id):
+    detach(unit_id)
+    if parent_id:
+        attach(unit_id, parent_id)
+
+
+def expected_links():
+    """{(ancestor id, descendant id): depth} computed from parent_unit, a parent cycle is cut where it closes."""
+    parents = dict(models.BusinessUnit.objects.values_list('id', 'parent_unit_id'))
+    links = dict()
+    for unit_id in parents:
+        ancestor_id, depth, seen = unit_id, 0, set()
+        while ancestor_id and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            links[(ancestor_id, unit_id)] = depth
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    return links
+
+
+def rebuild(check_only=False):
+    """
+    Recompute the closure from parent_unit and return the links that had drifted,
+    as (ancestor id, descendant id, stored depth, expected depth) with None for a missing side.
+    With check_only the stored rows are left alone.
+    """
+    with transaction.atomic():
+        expected = expected_links()
+        stored = {(ancestor_id, descendant_id): depth for ancestor_id, descendant_id, depth in
+                  models.BusinessUnitClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')}
+        drift = sorted((link + (stored.get(link), expected.get(link)) for link in set(stored) | set(expected)
+                        if stored.get(link) != expected.get(link)), key=lambda row: row[:2])
+        if not check_only:
+            models.BusinessUnitClosure.objects.all().delete()
+            models.BusinessUnitClosure.objects.bulk_create(
+                [models.BusinessUnitClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+                 for (ancestor_id, descendant_id), depth in expected.items()], batch_size=1000)
+    return drift
+
+
+@receiver(pre_save, sender=models.BusinessUnit)
+def check_parent(sender, instance, **kwargs):
+    instance._tree_parent_id = None
+    if instance._state.adding:
+        return
+    instance._tree_parent_id = models.BusinessUnit.objects.filter(pk=instance.pk).values_list(
+        'parent_unit_id', flat=True).first()
+    if instance.parent_unit_id != instance._tree_parent_id and instance.parent_unit_id and \
+            models.BusinessUnitClosure.objects.filter(ancestor_id=instance.pk,
+                                                      descendant_id=instance.parent_unit_id).exists():
+        raise ValueError('Business unit %s can not be moved under its own subtree' % instance.pk)
+
+
+@receiver(post_save, sender=models.BusinessUnit)
+def unit_saved(sender, instance, created, **kwargs):
+    if created:
+        insert(instance.pk, instance.parent_unit_id)
+    elif instance.parent_unit_id != instance._tree_parent_id:
+        move(instance.pk, instance.parent_unit_id)
+
+
+@receiver(pre_delete, sender=models.BusinessUnit)
+def unit_deleting(sender, instance, **kwargs):
+    # Its children become roots: parent_unit is cleared with a queryset update, which sends no signals.
+    # The rows of the unit itself go with the cascade.
+    detach(instance.pk)
@@ -5,9 +5,26 @@ app_name = 'assets'
 
 urlpatterns = [
     path('report/', views.report, name='report' ),
+    path('report/batch/', views.report_batch, name='report_batch'),
+    path('report/delta/', views.report_delta, name='report_delta'),
+    path('report/spool/', views.spool_stats, name='spool_stats'),
+    path('report/writer/', views.db_writer_stats, name='db_writer_stats'),
+    path('report/cache/', views.lookup_cache_stats, name='lookup_cache_stats'),
+    path('fragments/cache/', views.fragment_cache_stats, name='fragment_cache_stats'),
+    path('export/', views.export_assets, name='export'),
+    path('search/', views.search, name='search'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/ip/', views.ip_lookup, name='ip_lookup'),
+    path('api/ip/conflicts/', views.ip_conflicts, name='ip_conflicts'),
+    path('api/capacity/', views.capacity, name='capacity'),
+    path('api/topology/<int:asset_id>/', views.server_topology, name='topology'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('index/', views.index, name='index'),
     path('detail/<int:asset_id>/', views.detail, name="detail"),
+    path('async/report/', views.report_async, name='report_async'),
+    path('async/dashboard/', views.dashboard_async, name='dashboard_async'),
+    path('async/index/', views.index_async, name='index_async'),
+    path('async/detail/<int:asset_id>/', views.detail_async, name='detail_async'),
     path('', views.dashboard)
 
 ]
@@ -1,66 +1,467 @@
 from django.shortcuts import render
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.shortcuts import HttpResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-import json
+from django.views.decorators.http import condition
+from django.utils.http import quote_etag
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from datetime import datetime
+from urllib.parse import urlencode
+import functools
+import hashlib
 from assets import models
 from assets import asset_handler
+from assets import spool
+from assets import lookup_cache
+from assets import wire
+from assets import dashboard_counters
+from assets import fragment_cache
+from assets import export
+from assets import search_index
+from assets import ip_index
+from assets import capacity_rollups
+from assets import topology
+from assets import db_writer
 
 
 # Create your views here.
 
+def load_report(request):
+    """
+    Parse and validate the posted report, returns (data, error message).
+    Raises wire.WireError for bodies that can't be decoded.
+    """
+    data = wire.decode_report(request)
+    if not data:
+        return None, "No Data!"
+    if not issubclass(dict, type(data)):
+        return None, "Data must be dict type"
+    if not data.get('sn', None):
+        return None, "No Asset SN, Please check Data!"
+    return data, None
+
+
+def save_report(request, data):
+    """
+    Write a validated report, returns (response message, status code).
+    """
+    if getattr(settings, 'REPORT_SPOOL_ENABLED', False):
+        spool.ReportSpool().append(data)
+        return "Assets Data Accepted!", 202
+    sn = data['sn']
+    cached = lookup_cache.asset_for_sn(sn)
+    if cached:
+        asset_id, last_hash = cached
+        if last_hash and last_hash == asset_handler.report_hash(data) and \
+                asset_handler.touch_unchanged(asset_id, sn, last_hash):
+            return "Assets Data Unchanged!", 200
+        asset_obj = models.Asset.objects.select_related('server', 'cpu').filter(pk=asset_id, sn=sn).first()
+        if asset_obj is None:
+            lookup_cache.forget_asset(sn)
+            return save_report(request, data)
+        update_asset = asset_handler.UpdateAsset(request, asset_obj, data)
+        if not update_asset.result:
+            return "Assets Data Update Failed!", 500
+        if update_asset.unchanged:
+            return "Assets Data Unchanged!", 200
+        return "Assets Data Updated!", 200
+    else:
+        obj = asset_handler.NewAsset(request, data)
+        return obj.add_to_new_assets_zone(), 200
+
+
+def report_response(message, status, version):
+    response = HttpResponse(message, status=status)
+    if status in (200, 202):
+        # The agent keeps this as the base version of its next delta report.
+        response['X-Report-Version'] = version
+        response['ETag'] = quote_etag(version)
+    return response
+
+
 @csrf_exempt
 def report(request):
     if request.method == "POST":
-        asset_data = request.POST.get('asset_data')
-        data = json.loads(asset_data)
-        if not data:
-            return HttpResponse("No Data!")
-        if not issubclass(dict, type(data)):
-            return HttpResponse("Data must be dict type")
-
-        sn = data.get('sn', None)
-        if sn:
-            asset_obj = models.Asset.objects.filter(sn=sn)
-            if asset_obj:
-                update_asset = asset_handler.UpdateAsset(request, asset_obj[0], data)
-
-                return HttpResponse("Assets Data Updated!")
-            else:
-                obj = asset_handler.NewAsset(request, data)
-                response = obj.add_to_new_assets_zone()
-                return HttpResponse(response)
-        else:
-            return HttpResponse("No Asset SN, Please check Data!")
-
-    return HttpResponse('200 ok')
+        try:
+            data, error = load_report(request)
+        except wire.WireError as e:
+            return wire.advertise(HttpResponse(str(e), status=e.status), wire.report_types())
+        if error:
+            return HttpResponse(error)
+        message, status = db_writer.write(save_report, request, data)
+        return report_response(message, status, asset_handler.report_hash(data))
+
+    return wire.advertise(HttpResponse('200 ok'), wire.report_types())
+
+
+def load_delta(request):
+    """
+    Parse and validate a posted delta report, returns (delta, error message).
+    """
+    delta = wire.decode_report(request)
+    if not delta or not issubclass(dict, type(delta)):
+        return None, "Delta must be dict type"
+    for key in ('sn', 'base_version', 'version'):
+        if not delta.get(key):
+            return None, "No %s in delta, Please check Data!" % key
+    return delta, None
+
+
+def save_delta(request, delta):
+    """
+    Apply a validated delta report, returns (response message, status code).
+    Anything but an approved asset at the delta's base version asks the agent for a full report.
+    """
+    if getattr(settings, 'REPORT_SPOOL_ENABLED', False):
+        return "Delta reports are not spooled, please send a full report", 409
+    asset_obj = models.Asset.objects.select_related('server', 'cpu').filter(sn=delta['sn']).first()
+    if asset_obj is None or asset_obj.report_hash != delta['base_version']:
+        return "Report version mismatch, please send a full report", 409
+    patch_asset = asset_handler.PatchAsset(request, asset_obj, delta)
+    if not patch_asset.result:
+        return "Assets Data Update Failed!", 500
+    if patch_asset.unchanged:
+        return "Assets Data Unchanged!", 200
+    return "Assets Data Updated!", 200
+
+
+@csrf_exempt
+def report_delta(request):
+    if request.method == "POST":
+        try:
+            delta, error = load_delta(request)
+        except wire.WireError as e:
+            return wire.advertise(HttpResponse(str(e), status=e.status), wire.report_types())
+        if error:
+            return HttpResponse(error, status=400)
+        message, status = db_writer.write(save_delta, request, delta)
+        return report_response(message, status, delta['version'])
+
+    return wire.advertise(HttpResponse('200 ok'), wire.report_types())
+
+
+@csrf_exempt
+def report_batch(request):
+    if request.method != "POST":
+        return wire.advertise(HttpResponse('200 ok'), wire.batch_types())
+    try:
+        reports = wire.decode_batch(request)
+    except wire.WireError as e:
+        return wire.advertise(JsonResponse({'error': str(e)}, status=e.status), wire.batch_types())
+    if not isinstance(reports, list) or not reports:
+        return JsonResponse({'error': 'No Data!'}, status=400)
+    max_size = getattr(settings, 'REPORT_BATCH_MAX', 1000)
+    if len(reports) > max_size:
+        return JsonResponse({'error': 'Too many reports, at most %s per batch' % max_size}, status=413)
+
+    if getattr(settings, 'REPORT_SPOOL_ENABLED', False):
+        valid = [data for data in reports if isinstance(data, dict) and data.get('sn')]
+        spool.ReportSpool().append_many(valid)
+        results = [{'sn': data['sn'], 'status': 'queued', 'msg': 'Assets Data Accepted!'} for data in valid]
+        return JsonResponse({'results': results}, status=202)
+
+    results = db_writer.write(asset_handler.BatchReport(request, reports).run)
+    return JsonResponse({'results': results})
+
+
+def spool_stats(request):
+    return JsonResponse(spool.ReportSpool().stats())
 
 
+def db_writer_stats(request):
+    return JsonResponse(db_writer.info())
+
+
+def lookup_cache_stats(request):
+    return JsonResponse(lookup_cache.stats())
+
+
+def fragment_cache_stats(request):
+    return JsonResponse(fragment_cache.stats())
+
+
+INDEX_FILTERS = (
+    ('type', 'asset_type'),
+    ('status', 'status'),
+    ('idc', 'idc_id'),
+    # A business unit matches the assets of its whole subtree, joined through the closure table.
+    ('bu', 'business_unit__ancestor_links__ancestor_id'),
+)
+
+
+def encode_cursor(asset):
+    return '%s_%s' % (asset.c_time.isoformat(), asset.id)
+
+
+def decode_cursor(value):
+    """(c_time, id) of the last asset on the previous page, None for a missing or malformed cursor."""
+    try:
+        c_time, asset_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(c_time), int(asset_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def filter_choices():
+    return (models.Asset.asset_type_choice, models.Asset.asset_status,
+            models.IDC.objects.only('id', 'name'), models.BusinessUnit.objects.only('id', 'name'))
+
+
+def version_tag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def index_etag(request):
+    """
+    Moves with every asset write: the newest m_time (an index lookup), the asset total from the dashboard
+    counters for deletes, and the fragment generations for renamed IDCs, business units and tags and for
+    device and component saves that don't touch the asset.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT (SELECT MAX(m_time) FROM %s), (SELECT SUM(count) FROM %s)' % (
+            models.Asset._meta.db_table, models.AssetCounter._meta.db_table))
+        newest, total = cursor.fetchone()
+    return version_tag(newest, total, fragment_cache.index_generations(), request.GET.urlencode())
+
+
+def index_queryset():
+    """The assets of the index page with every relation its rows show."""
+    return models.Asset.objects.select_related(
+        'server', 'networkdevice', 'storagedevice', 'securitydevice', 'business_unit', 'idc',
+    ).prefetch_related('tags')
+
+
+@condition(etag_func=index_etag)
 def index(request):
-    assets = models.Asset.objects.all()
+    """
+    One page of assets, newest first. Pages are cut with a keyset cursor on (c_time, id) instead of OFFSET
+    and every relation the template shows is joined or prefetched, so a page costs the same few queries
+    whatever the inventory size.
+    """
+    page_size = getattr(settings, 'INDEX_PAGE_SIZE', 100)
+    assets = index_queryset().order_by('-c_time', '-id')
+
+    filters = dict()
+    for param, field in INDEX_FILTERS:
+        value = request.GET.get(param)
+        if value and (param == 'type' or value.isdigit()):
+            filters[param] = value
+            assets = assets.filter(**{field: value})
+
+    cursor = decode_cursor(request.GET.get('after'))
+    if cursor:
+        c_time, asset_id = cursor
+        assets = assets.filter(Q(c_time__lt=c_time) | Q(c_time=c_time, id__lt=asset_id))
+
+    assets = list(assets[:page_size + 1])
+    next_cursor = None
+    if len(assets) > page_size:
+        assets = assets[:page_size]
+        next_cursor = encode_cursor(assets[-1])
+    filter_query = urlencode(filters)
+    asset_types, asset_statuses, idcs, business_units = filter_choices()
+    return render(request, 'assets/index.html', locals())
+
+
+def search(request):
+    """Assets matching ?q= through the search index, rendered like the index page."""
+    q = request.GET.get('q', '').strip()
+    hits = search_index.search(q, getattr(settings, 'INDEX_PAGE_SIZE', 100), index_queryset())
+    assets = [asset for asset, score in hits]
+    asset_types, asset_statuses, idcs, business_units = filter_choices()
     return render(request, 'assets/index.html', locals())
 
 
+def search_api(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 200)
+    except ValueError:
+        limit = 20
+    results = [{'id': asset.id, 'sn': asset.sn, 'name': asset.name, 'asset_type': asset.asset_type,
+                'status': asset.get_status_display(), 'idc': str(asset.idc or ''), 'score': round(score, 3)}
+               for asset, score in search_index.search(query, limit)]
+    return JsonResponse({'query': query, 'results': results})
+
+
+def ip_lookup(request):
+    """NICs and assets with an address in ?cidr=, e.g. 10.20.0.0/16 or 2001:db8::/48."""
+    cidr = request.GET.get('cidr', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 500)), 5000)
+    except ValueError:
+        limit = 500
+    try:
+        nics = ip_index.nics_in(cidr, limit + 1)
+        assets = ip_index.assets_in(cidr, limit + 1)
+    except ValueError:
+        return JsonResponse({'error': 'invalid CIDR: %s' % cidr}, status=400)
+    return JsonResponse({'cidr': cidr, 'nics': nics[:limit], 'assets': assets[:limit],
+                         'truncated': len(nics) > limit or len(assets) > limit})
+
+
+def capacity(request):
+    """
+    RAM, disk and cores per ?by=idc (default) or business_unit, read from the capacity rollups.
+    ?bu= restricts them to the subtree of one business unit.
+    """
+    by = request.GET.get('by', 'idc')
+    groups = {'idc': models.IDC, 'business_unit': models.BusinessUnit}
+    if by not in groups:
+        return JsonResponse({'error': 'by must be one of: %s' % ', '.join(groups)}, status=400)
+    unit_id = request.GET.get('bu', '')
+    totals = capacity_rollups.rollup(by, unit_id if unit_id.isdigit() else None)
+    names = dict(groups[by].objects.filter(id__in=list(totals)).values_list('id', 'name'))
+    rows = [dict(totals[group_id], id=group_id or None, name=names.get(group_id)) for group_id in totals]
+    return JsonResponse({'by': by, 'rows': rows})
+
+
+def server_topology(request, asset_id):
+    """
+    The hosts a server runs on and everything hosted on it with component summaries,
+    in five queries whatever the size of the subtree.
+    """
+    nodes = topology.subtree(asset_id)
+    if not nodes:
+        return JsonResponse({'error': 'asset %s is not a server' % asset_id}, status=404)
+    return JsonResponse({'asset_id': asset_id, 'hosts': topology.hosts(asset_id)[1:],
+                         'blast_radius': len(nodes) - 1, 'totals': topology.totals(nodes), 'nodes': nodes})
+
+
+def ip_conflicts(request):
+    conflicts = ip_index.conflicts()
+    return JsonResponse({'count': len(conflicts), 'conflicts': conflicts})
+
+
+def export_assets(request):
+    """Stream every asset with its components, ?format=ndjson (default) or csv."""
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return HttpResponse('Unknown format, use one of: %s' % ', '.join(export.FORMATS), status=400)
+    lines, content_type = export.FORMATS[fmt]
+    response = StreamingHttpResponse(lines(), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="assets.%s"' % fmt
+    return response
+
+
+def dashboard_summary(request):
+    """Counter totals and the software count, read once per request by dashboard_etag and the view."""
+    if not hasattr(request, 'dashboard_summary'):
+        unit_id = request.GET.get('bu', '')
+        # Software licenses are not assets, their table stays small.
+        request.dashboard_summary = (dashboard_counters.totals(unit_id if unit_id.isdigit() else None),
+                                     models.Software.objects.count())
+    return request.dashboard_summary
+
+
+def dashboard_etag(request):
+    counts, software_number = dashboard_summary(request)
+    return version_tag(sorted(counts.items()), software_number, fragment_cache.generations()[0],
+                       request.GET.get('bu', ''))
+
+
+@condition(etag_func=dashboard_etag)
 def dashboard(request):
-    total = models.Asset.objects.count()
-    upline = models.Asset.objects.filter(status=0).count()
-    offline = models.Asset.objects.filter(status=1).count()
-    unknown = models.Asset.objects.filter(status=2).count()
-    breakdown = models.Asset.objects.filter(status=3).count()
-    backup = models.Asset.objects.filter(status=4).count()
-    up_rate = round(upline/total*100)
-    o_rate = round(offline/total*100)
-    un_rate = round(unknown/total*100)
-    bd_rate = round(breakdown/total*100)
-    bu_rate = round(backup/total*100)
-    server_number = models.Server.objects.count()
-    networkdevice_number = models.NetworkDevice.objects.count()
-    storagedevice_number = models.StorageDevice.objects.count()
-    securitydevice_number = models.SecurityDevice.objects.count()
-    software_number = models.Software.objects.count()
+    unit_id = request.GET.get('bu', '')
+    counts, software_number = dashboard_summary(request)
+    total = sum(counts.values())
+    by_status = [sum(n for (asset_type, status), n in counts.items() if status == value)
+                 for value, _ in models.Asset.asset_status]
+    upline, offline, unknown, breakdown, backup = by_status
+    up_rate, o_rate, un_rate, bd_rate, bu_rate = [round(n / total * 100) if total else 0 for n in by_status]
+    by_type = {asset_type: 0 for asset_type, _ in models.Asset.asset_type_choice}
+    for (asset_type, status), n in counts.items():
+        by_type[asset_type] = by_type.get(asset_type, 0) + n
+    server_number = by_type['server']
+    networkdevice_number = by_type['networkdevice']
+    storagedevice_number = by_type['storagedevice']
+    securitydevice_number = by_type['securitydevice']
+    business_units = models.BusinessUnit.objects.only('id', 'name')
 
     return render(request, 'assets/dashboard.html', locals())
 
 
+def detail_asset(request, asset_id):
+    """The asset of the detail page, None if it doesn't exist. Loaded once for the validators and the view."""
+    if not hasattr(request, 'detail_asset'):
+        request.detail_asset = models.Asset.objects.filter(id=asset_id).first()
+    return request.detail_asset
+
+
+def detail_etag(request, asset_id):
+    asset = detail_asset(request, asset_id)
+    if asset is None:
+        return None
+    # Renamed shared objects don't touch m_time, the generations cover them. No Last-Modified: it would miss
+    # them too, and m_time has a resolution of one second.
+    return version_tag(asset.m_time, fragment_cache.generations(asset_id))
+
+
+@condition(etag_func=detail_etag)
 def detail(request, asset_id):
-    asset = get_object_or_404(models.Asset, id=asset_id)
+    asset = detail_asset(request, asset_id)
+    if asset is None:
+        raise Http404('No Asset matches the given query.')
     return render(request, 'assets/detail.html', locals())
+
+
+# Async views, served natively when running under CMDB.asgi.
+# Requests are parsed on the event loop, ORM work and template rendering run in a bounded thread pool,
+# so waiting clients don't hold a thread each.
+
+_db_executor = None
+
+
+def db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_DB_WORKERS', 4),
+                                          thread_name_prefix='cmdb-db')
+    return _db_executor
+
+
+def _run_with_db(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_db_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor(), functools.partial(_run_with_db, func, *args))
+
+
+async def report_async(request):
+    if request.method == "POST":
+        try:
+            data, error = load_report(request)
+        except wire.WireError as e:
+            return wire.advertise(HttpResponse(str(e), status=e.status), wire.report_types())
+        if error:
+            return HttpResponse(error)
+        message, status = await run_in_db_executor(db_writer.write, save_report, request, data)
+        return report_response(message, status, asset_handler.report_hash(data))
+
+    return wire.advertise(HttpResponse('200 ok'), wire.report_types())
+
+
+# csrf_exempt() in Django 4.0 wraps the view in a sync function, set the flag directly instead.
+report_async.csrf_exempt = True
+
+
+async def index_async(request):
+    return await run_in_db_executor(index, request)
+
+
+async def dashboard_async(request):
+    return await run_in_db_executor(dashboard, request)
+
+
+async def detail_async(request, asset_id):
+    return await run_in_db_executor(detail, request, asset_id)
@@ -0,0 +1,127 @@
+import json
+import zlib
+
+from django.conf import settings
+from django.http import QueryDict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORM = 'application/x-www-form-urlencoded'
+MULTIPART = 'multipart/form-data'
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+
+
+class WireError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def report_types():
+    types = [JSON, FORM]
+    if msgpack is not None:
+        types.insert(0, MSGPACK)
+    return types
+
+
+def batch_types():
+    types = [JSON, NDJSON]
+    if msgpack is not None:
+        types.insert(0, MSGPACK)
+    return types
+
+
+def advertise(response, types):
+    """
+    Tell clients which bodies the endpoint takes (RFC 7694 Accept-Encoding in a response).
+    """
+    response['Accept-Post'] = ', '.join(types)
+    response['Accept-Encoding'] = 'gzip'
+    return response
+
+
+def gunzip(body, max_size=None):
+    # Bounded, a few KB of gzip must not expand into gigabytes.
+    max_size = max_size or settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 2621440
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_size)
+    except zlib.error as e:
+        raise WireError('Invalid gzip body: %s' % e)
+    if decompressor.unconsumed_tail:
+        raise WireError('Body too large', status=413)
+    return data
+
+
+def read_body(request, max_size):
+    """The raw body, up to max_size bytes instead of DATA_UPLOAD_MAX_MEMORY_SIZE."""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > max_size:
+        raise WireError('Body too large', status=413)
+    # Reading the stream directly skips the DATA_UPLOAD_MAX_MEMORY_SIZE check of request.body.
+    body = request.read(max_size + 1)
+    if len(body) > max_size:
+        raise WireError('Body too large', status=413)
+    return body
+
+
+def request_body(request, max_size=None):
+    """The decompressed body. max_size raises the limit of DATA_UPLOAD_MAX_MEMORY_SIZE for this request."""
+    body = read_body(request, max_size) if max_size else request.body
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding == 'gzip':
+        return gunzip(body, max_size)
+    if encoding != 'identity':
+        raise WireError('Unsupported Content-Encoding: %s' % encoding, status=415)
+    return body
+
+
+def decode_report(request):
+    """
+    Decode one report from a form (asset_data field), JSON or msgpack body.
+    """
+    content_type = request.content_type
+    encoded = 'Content-Encoding' in request.headers
+    if content_type not in report_types() + [MULTIPART] or (content_type == MULTIPART and encoded):
+        raise WireError('Unsupported Content-Type: %s' % content_type, status=415)
+    try:
+        if content_type in (FORM, MULTIPART):
+            if encoded:
+                asset_data = QueryDict(request_body(request).decode('utf-8')).get('asset_data')
+            else:
+                asset_data = request.POST.get('asset_data')
+            return json.loads(asset_data) if asset_data else None
+        body = request_body(request)
+        if content_type == MSGPACK:
+            return msgpack.unpackb(body, raw=False)
+        return json.loads(body)
+    except (ValueError, TypeError) as e:
+        raise WireError('Invalid report body: %s' % e)
+
+
+def decode_batch(request):
+    """
+    Decode a list of reports from a msgpack array, a JSON array or NDJSON, one report per line.
+    Bodies may take REPORT_BATCH_MAX_BYTES, decompressed.
+    """
+    body = request_body(request, getattr(settings, 'REPORT_BATCH_MAX_BYTES', None))
+    try:
+        if request.content_type == MSGPACK and msgpack is not None:
+            return msgpack.unpackb(body, raw=False)
+        text = body.decode('utf-8').strip()
+        if not text:
+            return []
+        if text.startswith('['):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except ValueError as e:
+        raise WireError('Invalid batch body: %s' % e)